@@ -0,0 +1,508 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Load-tests a running kurup instance with simulated browser tabs, to measure how many editors it supports.
+
+Every simulated client loads the page, connects to the NiceGUI websocket like a browser and then
+types into the note, searches, pastes images and saves notes, waiting for the response of the app
+to every action. The latency of each action, the throughput and the event loop lag of the server
+are reported as JSON.
+
+Clients save notes and paste images, so run kurup with a scratch notes directory, e.g.
+``python main.py --notes_dir loadtest_notes``.
+
+Usage::
+
+    python -m benchmarks.loadtest --url http://127.0.0.1:8080 --clients 50 --duration 60
+"""
+
+import ast
+import asyncio
+import json
+import random
+import re
+import struct
+import sys
+import time
+import uuid
+import zlib
+from argparse import ArgumentParser
+from collections import defaultdict
+from pathlib import Path
+
+import aiohttp
+import socketio
+
+# kurup
+from benchmarks.stats import get_environment, summarize
+from benchmarks.vault import PNG_SIGNATURE, SyntheticVault
+
+SOCKET_IO_PATH = "_nicegui_ws/socket.io"
+ELEMENTS_PATTERN = re.compile(r"parseElements\(String\.raw`(.*?)`\)", re.DOTALL)
+QUERY_PATTERN = re.compile(r"^\s*query: (\{.*\}),\s*$", re.MULTILINE)
+# the escaping of NiceGUI's page template, undone like nicegui.js does
+HTML_UNESCAPES = (("&#36;", "$"), ("&#96;", "`"), ("&gt;", ">"), ("&lt;", "<"), ("&amp;", "&"))
+# answered on the event loop without any I/O, its latency is the delay of the server's event loop
+PROBE_PATH = "/variants/probe/-/-"
+# a browser acknowledges received messages every 3 seconds, so the server can drop them
+ACK_INTERVAL = 3.0
+# relative frequency of each action of a client
+ACTION_WEIGHTS = {"type": 70, "search": 20, "upload": 5, "save": 5}
+# the note is saved and started over once it is longer than this
+MAX_NOTE_LENGTH = 20_000
+
+
+class LoadTestError(Exception):
+    """Raised when the page of the app cannot be loaded or understood."""
+
+
+def parse_page(html):
+    """
+    Reads the elements and the websocket query of a NiceGUI page.
+
+    Parameters
+    ----------
+    html : str
+        The HTML of the page.
+
+    Returns
+    -------
+    elements : dict
+        Maps element ids to their tag, props and event listeners.
+    query : dict
+        The websocket query, including the client id.
+    """
+    elements_match = ELEMENTS_PATTERN.search(html)
+    query_match = QUERY_PATTERN.search(html)
+    if elements_match is None or query_match is None:
+        raise LoadTestError("Not a NiceGUI page")
+    raw = elements_match.group(1)
+    for escaped, char in HTML_UNESCAPES:
+        raw = raw.replace(escaped, char)
+    # a Python dict in the template
+    return json.loads(raw), ast.literal_eval(query_match.group(1))
+
+
+def make_png(rng, width, height):
+    """Returns a valid RGB PNG of random noise, which does not compress, so its size is about 3 bytes per pixel."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    # every row starts with filter type 0
+    rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return PNG_SIGNATURE + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b"")
+
+
+def find_element(elements, html_id, event_type=None):
+    """
+    Finds an element by its HTML id.
+
+    Returns
+    -------
+    element_id : str
+        The NiceGUI id of the element.
+    listener_id : str or None
+        The id of its listener of `event_type`, if given.
+    """
+    for element_id, element in elements.items():
+        if element.get("props", {}).get("id") != html_id:
+            continue
+        if event_type is None:
+            return element_id, None
+        for event in element.get("events", []):
+            if event["type"] == event_type:
+                return element_id, event["listener_id"]
+        raise LoadTestError(f"#{html_id} has no {event_type} listener")
+    raise LoadTestError(f"#{html_id} not found on the page")
+
+
+class Recorder():
+    """Collects the latencies and failures of all clients."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.start = None
+        self.end = None
+
+    def add(self, action, seconds):
+        self.latencies[action].append(seconds)
+
+    def fail(self, action):
+        self.failures[action] += 1
+
+    def results(self):
+        duration = (self.end or time.perf_counter()) - self.start
+        actions = {}
+        for action in sorted(set(self.latencies) | set(self.failures)):
+            samples = self.latencies[action]
+            actions[action] = {
+                **summarize(samples),
+                "failed": self.failures[action],
+                "per_second": round(len(samples) / duration, 2),
+            }
+        completed = sum(len(samples) for action, samples in self.latencies.items() if action != "page_load")
+        return {
+            "duration_s": round(duration, 2),
+            "actions": actions,
+            "throughput_per_second": round(completed / duration, 2),
+        }
+
+
+class SimulatedClient():
+    """
+    A browser tab of kurup, driven through NiceGUI's websocket protocol.
+
+    Parameters
+    ----------
+    number : int
+        Number of the client, seeds its random choices.
+    base_url : str
+        URL of the kurup instance.
+    http : aiohttp.ClientSession
+        Session used for page loads and uploads.
+    recorder : Recorder
+        Receives the latency of every action.
+    vault : SyntheticVault
+        Provides the words typed and searched.
+    think_time : float
+        Mean pause between two actions in seconds.
+    timeout : float
+        Seconds to wait for the response to an action.
+    """
+
+    def __init__(self, number, base_url, http, recorder, vault, think_time, timeout):
+        self.number = number
+        self.base_url = base_url
+        self.http = http
+        self.recorder = recorder
+        self.vault = vault
+        self.think_time = think_time
+        self.timeout = timeout
+        self.rng = random.Random(f"{vault.seed}:client:{number}")
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.client_id = None
+        self.next_message_id = 0
+        self.text = ""
+        self._waiters = []
+        # ids of the preview and the notes grid and of all their descendants, updates only send changed children
+        self._subtrees = {}
+
+    async def connect(self):
+        """Loads the page and connects its websocket, like a browser opening kurup."""
+        start = time.perf_counter()
+        async with self.http.get(self.base_url + "/") as response:
+            response.raise_for_status()
+            html = await response.text()
+        elements, query = parse_page(html)
+        self.client_id = query["client_id"]
+        self.next_message_id = query.get("next_message_id", 0)
+        self.note_area = find_element(elements, "noteTextarea", "update:value")
+        self.search_input = find_element(elements, "search-notes", "update:value")
+        for html_id in ("markdownPreview", "notes-container"):
+            element_id, _ = find_element(elements, html_id)
+            self._subtrees[html_id] = self._get_subtree(elements, element_id)
+        self.save_button = find_element(elements, "save-note-button", "click")
+
+        for message_type in ("update", "notify", "run_javascript", "download", "open"):
+            self.sio.on(message_type, self._make_handler(message_type))
+        await self.sio.connect(
+            f"{self.base_url}?client_id={self.client_id}&next_message_id={self.next_message_id}",
+            socketio_path=SOCKET_IO_PATH, transports=["websocket"], wait_timeout=self.timeout,
+        )
+        handshake = {
+            "client_id": self.client_id,
+            "document_id": str(uuid.uuid4()),
+            "tab_id": str(uuid.uuid4()),
+            "old_tab_id": None,
+            "next_message_id": self.next_message_id,
+        }
+        if not await self.sio.call("handshake", handshake, timeout=self.timeout):
+            raise LoadTestError(f"Handshake of client {self.client_id} failed")
+        self.recorder.add("page_load", time.perf_counter() - start)
+
+    async def disconnect(self):
+        await self.sio.disconnect()
+
+    @staticmethod
+    def _get_subtree(elements, element_id):
+        subtree = set()
+        pending = [str(element_id)]
+        while pending:
+            current = pending.pop()
+            subtree.add(current)
+            pending.extend(str(child) for child in (elements.get(current) or {}).get("children", []))
+        return subtree
+
+    def _updates(self, data, html_id):
+        # True if an update message changes an element or a descendant of an element
+        return not self._subtrees[html_id].isdisjoint(data)
+
+    def _make_handler(self, message_type):
+        async def handler(data):
+            if isinstance(data, dict) and "_id" in data:
+                self.next_message_id = data.pop("_id") + 1
+            if message_type == "update":
+                for subtree in self._subtrees.values():
+                    for element_id, element in data.items():
+                        if element_id in subtree and element is not None:
+                            subtree.update(str(child) for child in element.get("children", []))
+            for waiter in list(self._waiters):
+                predicate, future = waiter
+                if not future.done() and predicate(message_type, data):
+                    future.set_result(time.perf_counter())
+                    self._waiters.remove(waiter)
+        return handler
+
+    async def _emit_and_wait(self, element, args, predicate):
+        # sends an event like nicegui.js and returns the time until a matching message arrives
+        element_id, listener_id = element
+        future = asyncio.get_running_loop().create_future()
+        waiter = (predicate, future)
+        self._waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            await self.sio.emit("event", {
+                "id": int(element_id),
+                "client_id": self.client_id,
+                "listener_id": listener_id,
+                "args": [json.dumps(arg) for arg in args],
+            })
+            end = await asyncio.wait_for(future, self.timeout)
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return end - start
+
+    async def type(self):
+        """Types a few words, the preview is updated in response, after the preview delay of the server."""
+        self.text += " ".join(self.vault.get_words(self.rng, self.rng.randint(1, 5))) + " "
+        if self.rng.random() < 0.1:
+            self.text += "\n\n"
+        return await self._emit_and_wait(
+            self.note_area, [self.text], lambda kind, data: kind == "update" and self._updates(data, "markdownPreview"),
+        )
+
+    async def search(self):
+        """Searches the saved notes, the note grid is updated in response."""
+        query = self.rng.choice(self.vault.vocabulary)[:self.rng.randint(3, 6)]
+        return await self._emit_and_wait(
+            self.search_input, [query], lambda kind, data: kind == "update" and self._updates(data, "notes-container"),
+        )
+
+    async def upload(self):
+        """Pastes an image, which is uploaded and then linked in the note."""
+        data = make_png(self.rng, self.rng.randint(64, 256), self.rng.randint(64, 256))
+        start = time.perf_counter()
+        async with self.http.post(
+            self.base_url + "/upload_image", data=data,
+            headers={"Content-Type": "image/png", "X-Kurup-Client": self.client_id},
+        ) as response:
+            response.raise_for_status()
+            url = (await response.json())["url"]
+        elapsed = time.perf_counter() - start
+        self.text += f"\n\n![pasted]({url})\n\n"
+        await self._emit_and_wait(
+            self.note_area, [self.text], lambda kind, data: kind == "update" and self._updates(data, "markdownPreview"),
+        )
+        return elapsed
+
+    async def save(self):
+        """Saves the note, a notification is shown in response."""
+        if not self.text:
+            return await self.type()
+        elapsed = await self._emit_and_wait(self.save_button, [], lambda kind, data: kind == "notify")
+        self.text = ""
+        return elapsed
+
+    async def run(self, deadline):
+        """Performs random actions until `deadline`, a `time.perf_counter` value."""
+        actions = list(ACTION_WEIGHTS)
+        weights = list(ACTION_WEIGHTS.values())
+        last_ack = time.perf_counter()
+        while time.perf_counter() < deadline:
+            action = "save" if len(self.text) > MAX_NOTE_LENGTH else self.rng.choices(actions, weights)[0]
+            try:
+                elapsed = await getattr(self, action)()
+            except (asyncio.TimeoutError, aiohttp.ClientError, socketio.exceptions.SocketIOError, KeyError):
+                self.recorder.fail(action)
+            else:
+                self.recorder.add(action, elapsed)
+
+            if time.perf_counter() - last_ack > ACK_INTERVAL:
+                await self.sio.emit("ack", {"client_id": self.client_id, "next_message_id": self.next_message_id})
+                last_ack = time.perf_counter()
+            await asyncio.sleep(self.rng.expovariate(1 / self.think_time) if self.think_time else 0)
+
+
+async def probe_loop_lag(base_url, http, samples, interval, stop_event):
+    """Requests `PROBE_PATH` every `interval` seconds and collects the latencies until stopped."""
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        try:
+            async with http.get(base_url + PROBE_PATH) as response:
+                await response.read()
+            samples.append(time.perf_counter() - start)
+        except aiohttp.ClientError:
+            pass
+        try:
+            await asyncio.wait_for(stop_event.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load_test(base_url, clients=10, duration=30.0, ramp_up=5.0, think_time=0.5, timeout=10.0,
+                        probe_interval=0.1, seed=0):
+    """
+    Runs a load test against a running kurup instance.
+
+    Parameters
+    ----------
+    base_url : str
+        URL of the kurup instance, e.g. ``http://127.0.0.1:8080``.
+    clients : int, optional
+        Number of simulated browser tabs.
+    duration : float, optional
+        Seconds every client performs actions for, after all clients connected.
+    ramp_up : float, optional
+        Seconds over which the clients connect.
+    think_time : float, optional
+        Mean pause of a client between two actions in seconds.
+    timeout : float, optional
+        Seconds to wait for the response to an action.
+    probe_interval : float, optional
+        Seconds between two probes of the event loop lag.
+    seed : int, optional
+        Seed of the random choices of the clients.
+
+    Returns
+    -------
+    dict
+        Latencies, failures and throughput of every action and the event loop lag of the server.
+    """
+    base_url = base_url.rstrip("/")
+    vault = SyntheticVault(notes=0, seed=seed)
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        # the lag of the idle server, subtracted from the lag under load
+        idle_samples = []
+        idle_stop = asyncio.Event()
+        idle_task = asyncio.create_task(probe_loop_lag(base_url, http, idle_samples, probe_interval / 2, idle_stop))
+        await asyncio.sleep(min(2.0, 20 * probe_interval))
+        idle_stop.set()
+        await idle_task
+        if not idle_samples:
+            raise LoadTestError(f"{base_url} is not reachable")
+        idle_latency = sorted(idle_samples)[len(idle_samples) // 2]
+
+        probe_samples = []
+        probe_stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe_loop_lag(base_url, http, probe_samples, probe_interval, probe_stop))
+
+        simulated = [
+            SimulatedClient(number, base_url, http, recorder, vault, think_time, timeout) for number in range(clients)
+        ]
+        recorder.start = time.perf_counter()
+
+        async def connect(client, delay):
+            await asyncio.sleep(delay)
+            try:
+                await client.connect()
+                return True
+            except (LoadTestError, aiohttp.ClientError, socketio.exceptions.SocketIOError, asyncio.TimeoutError) as e:
+                print(f"Client {client.number} could not connect: {e}", file=sys.stderr)
+                recorder.fail("page_load")
+                return False
+
+        connected = await asyncio.gather(*(
+            connect(client, ramp_up * number / max(clients, 1)) for number, client in enumerate(simulated)
+        ))
+        active = [client for client, ok in zip(simulated, connected) if ok]
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(client.run(deadline) for client in active))
+        recorder.end = time.perf_counter()
+
+        probe_stop.set()
+        await probe_task
+        await asyncio.gather(*(client.disconnect() for client in active), return_exceptions=True)
+
+    results = recorder.results()
+    results["clients"] = {"requested": clients, "connected": len(active)}
+    results["event_loop_lag"] = {
+        **summarize([max(sample - idle_latency, 0.0) for sample in probe_samples]),
+        "idle_probe_ms": round(idle_latency * 1000, 4),
+    }
+    return results
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="python -m benchmarks.loadtest", description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="URL of the running kurup instance")
+    parser.add_argument("--clients", type=int, default=10, help="number of simulated browser tabs")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load after all clients connected")
+    parser.add_argument("--ramp_up", type=float, default=5.0, help="seconds over which the clients connect")
+    parser.add_argument("--think_ms", type=float, default=500.0, help="mean pause between actions of a client")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for the response to an action")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random choices of the clients")
+    parser.add_argument("--output", type=Path, default=None, help="file the JSON results are written to")
+    args = parser.parse_args(argv)
+
+    params = {
+        "clients": args.clients, "duration": args.duration, "ramp_up": args.ramp_up,
+        "think_ms": args.think_ms, "timeout": args.timeout, "seed": args.seed,
+    }
+    try:
+        results = asyncio.run(run_load_test(
+            args.url, args.clients, args.duration, args.ramp_up, args.think_ms / 1000, args.timeout, seed=args.seed,
+        ))
+    except LoadTestError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    report = {
+        "benchmark": "loadtest",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": get_environment(),
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    actions = results["actions"]
+    summary = " | ".join(
+        f"{action} p50 {stats['p50']:.1f} ms p99 {stats['p99']:.1f} ms" + (f" ({stats['failed']} failed)" if stats["failed"] else "")
+        for action, stats in actions.items() if stats["count"]
+    )
+    lag = results["event_loop_lag"]
+    print(
+        f"{results['clients']['connected']}/{args.clients} clients, {results['throughput_per_second']} actions/s | "
+        f"{summary} | loop lag p50 {lag.get('p50', 0):.1f} ms p99 {lag.get('p99', 0):.1f} ms",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark of rewriting the image references of a note, as done when a note is saved.
+
+Compares `utils.md_refs` with the previous approach, an f-string regex and a ``str.replace``
+over the whole text per image, for notes with a growing number of images. With a linear
+rewrite the time per image stays flat as the note grows, with the previous one it grows
+with the size of the note.
+
+Usage::
+
+    python -m benchmarks.md_refs_bench --sizes 100 400 1600 6400
+"""
+
+import re
+import sys
+import time
+from argparse import ArgumentParser
+
+# kurup
+from utils import md_refs
+
+PARAGRAPH = "Some text with a #tag, `code` and a [link](https://example.org).\n\n"
+
+
+def make_note(images, temp_dir="temp"):
+    """Returns a note with `images` distinct pasted images, each followed by a paragraph."""
+    return "".join(f"## Image {i}\n\n![image {i}](/{temp_dir}/{i:064x}.png)\n\n{PARAGRAPH}" for i in range(images))
+
+
+def rewrite_replace(content, temp_dir="temp", notes_dir="notes"):
+    """The previous rewrite of `utils.image_handler.save_images`, without storing the images."""
+    pattern = rf"!\[(.*?)\]\(/({temp_dir})/([^)]+)\)"
+    updated_text = content
+    for match in re.finditer(pattern, content):
+        new_ref = f"![{match.group(1)}](/{notes_dir}/{match.group(3)})"
+        updated_text = updated_text.replace(match.group(0), new_ref)
+    return updated_text
+
+
+def rewrite_md_refs(content, temp_dir="temp", notes_dir="notes"):
+    """The rewrite of `utils.image_handler.save_images` with `utils.md_refs`, without storing the images."""
+    refs = md_refs.find_images(content, temp_dir)
+    return md_refs.rewrite(content, refs, lambda ref: f"![{ref.text}](/{notes_dir}/{ref.filename})")
+
+
+def measure(func, content, min_time=0.2):
+    """Returns the best time of one call in seconds, repeating calls for at least `min_time` seconds."""
+    best = float("inf")
+    total = 0.0
+    while total < min_time or best == float("inf"):
+        start = time.perf_counter()
+        func(content)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+    return best
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="python -m benchmarks.md_refs_bench", description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 400, 1600, 6400], help="images per note")
+    parser.add_argument("--min_time", type=float, default=0.2, help="seconds each measurement is repeated for")
+    args = parser.parse_args(argv)
+
+    print(f"{'images':>8} {'KB':>8} {'replace ms':>12} {'µs/image':>9} {'md_refs ms':>12} {'µs/image':>9}")
+    per_image = []
+    for size in args.sizes:
+        content = make_note(size)
+        if rewrite_replace(content) != rewrite_md_refs(content):
+            print(f"Results differ for {size} images", file=sys.stderr)
+            return 1
+        old = measure(rewrite_replace, content, args.min_time)
+        new = measure(rewrite_md_refs, content, args.min_time)
+        per_image.append((old / size, new / size))
+        print(
+            f"{size:>8} {len(content) / 1024:>8.0f} {old * 1000:>12.2f} {old / size * 1e6:>9.2f} "
+            f"{new * 1000:>12.2f} {new / size * 1e6:>9.2f}"
+        )
+
+    # 1.0 is perfectly linear
+    (old_first, new_first), (old_last, new_last) = per_image[0], per_image[-1]
+    print(
+        f"Time per image grew {old_last / old_first:.1f}x with replace and {new_last / new_first:.1f}x "
+        f"with md_refs from {args.sizes[0]} to {args.sizes[-1]} images"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import platform
+import sys
+import tomllib
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PYPROJECT_PATH = Path(__file__).parent.parent / "pyproject.toml"
+
+
+def percentile(sorted_samples, p):
+    """Returns the p-th percentile of sorted samples by the nearest-rank method."""
+    if not sorted_samples:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_samples)), 1)
+    return sorted_samples[rank - 1]
+
+
+def summarize(samples, scale=1000.0):
+    """
+    Summarizes latencies.
+
+    Parameters
+    ----------
+    samples : list of float
+        Latencies in seconds.
+    scale : float, optional
+        Factor applied to the results, milliseconds by default.
+
+    Returns
+    -------
+    dict
+        count, mean, p50, p90, p99 and max.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * scale, 4),
+        "p50": round(percentile(ordered, 50) * scale, 4),
+        "p90": round(percentile(ordered, 90) * scale, 4),
+        "p99": round(percentile(ordered, 99) * scale, 4),
+        "max": round(ordered[-1] * scale, 4),
+    }
+
+
+def get_peak_rss_mb():
+    """Returns the peak resident set size of this process in MB, or None where it is unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def get_environment():
+    """Returns the kurup version, Python version and platform, to tell results of releases and machines apart."""
+    try:
+        with open(PYPROJECT_PATH, "rb") as f:
+            version = tomllib.load(f)["project"]["version"]
+    except (OSError, KeyError, tomllib.TOMLDecodeError):
+        version = None
+    return {
+        "kurup": version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.machine(),
+    }
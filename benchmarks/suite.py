@@ -0,0 +1,214 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Benchmarks scanning, searching, sorting and saving notes of a synthetic vault.
+
+Results are written as JSON, so runs of different releases can be compared. Times are in
+milliseconds, peak RSS in MB is the peak of the whole process up to the end of each phase.
+
+Usage::
+
+    python -m benchmarks.suite --notes 10000 --output results.json
+"""
+
+import json
+import logging
+import random
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+# kurup
+from benchmarks.stats import get_environment, get_peak_rss_mb, summarize
+from benchmarks.vault import add_vault_arguments, create_vault
+from utils.image_handler import TempImageHandler
+from utils.metadata_store import METADATA_STORES
+from utils.note_record import NoteTable
+from utils.notes_handler import NotesHandler
+
+SORT_ORDERS = (("modified", True), ("modified", False), ("title", False), ("title", True))
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def run_suite(vault, root, metadata_store="sidecar", queries=200, rescans=5, sorts=20, saves=50, edits=50):
+    """
+    Runs all benchmarks on a generated vault.
+
+    Parameters
+    ----------
+    vault : SyntheticVault
+        The vault to generate.
+    root : Path
+        An empty directory, the vault is generated in ``root/notes``, pasted images go to ``root/temp``.
+    metadata_store : str, optional
+        Either "sidecar" or "log".
+    queries, rescans, sorts, saves, edits : int, optional
+        Number of repetitions of each benchmark.
+
+    Returns
+    -------
+    dict
+        The results of every phase.
+    """
+    notes_dir = root / "notes"
+    temp_dir = root / "temp"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+
+    summary, elapsed = _timed(vault.generate, notes_dir, metadata_store)
+    results["generate"] = {**summary, "ms": _ms(elapsed), "peak_rss_mb": get_peak_rss_mb()}
+
+    # first start, every note is read from disk
+    handler = NotesHandler(metadata_store=metadata_store)
+    _, elapsed = _timed(handler.load_index, notes_dir)
+    _, search_elapsed = _timed(handler.load_search_index)
+    results["scan_cold"] = {
+        "ms": _ms(elapsed), "search_index_ms": _ms(search_elapsed), "peak_rss_mb": get_peak_rss_mb(),
+    }
+    handler.close()
+
+    # next start, notes are loaded from the persisted note index
+    handler = NotesHandler(metadata_store=metadata_store)
+    _, elapsed = _timed(handler.load_index, notes_dir)
+    _, search_elapsed = _timed(handler.load_search_index)
+    # the rescan on every refresh of the note list, nothing changed
+    rescan_samples = [_timed(handler.update_notes_list, notes_dir)[1] for _ in range(rescans)]
+    results["scan_warm"] = {
+        "ms": _ms(elapsed), "search_index_ms": _ms(search_elapsed),
+        "rescan": summarize(rescan_samples), "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+    search_samples = []
+    result_counts = []
+    for query in vault.get_queries(queries):
+        found, elapsed = _timed(handler.search, query)
+        search_samples.append(elapsed)
+        result_counts.append(len(found))
+    results["search"] = {
+        **summarize(search_samples),
+        "mean_results": round(sum(result_counts) / max(len(result_counts), 1), 1),
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+    # cold: a new note table, as after the notes changed, cached: the same order again
+    results["sort"] = {}
+    for by, reverse in SORT_ORDERS:
+        cold = [_timed(NoteTable(handler.note_list).sorted, by, reverse)[1] for _ in range(sorts)]
+        cached = [_timed(handler.sorted_notes, by, reverse)[1] for _ in range(sorts)]
+        key = f"{by}_{'desc' if reverse else 'asc'}"
+        results["sort"][key] = {"cold": summarize(cold), "cached": summarize(cached)}
+    results["sort"]["peak_rss_mb"] = get_peak_rss_mb()
+
+    # new notes with their images pasted, like the Save button of the New tab
+    save_samples = []
+    for n in range(saves):
+        content, tags, images = vault.get_note(vault.notes + n, temp_dir.name)
+        for name, data in images.items():
+            (temp_dir / name).write_bytes(data)
+        filename = vault.get_filename(vault.notes + n)
+        _, elapsed = _timed(handler.save_new_note, notes_dir, temp_dir, filename, content, tags)
+        save_samples.append(elapsed)
+    results["save"] = {**summarize(save_samples), "peak_rss_mb": get_peak_rss_mb()}
+
+    # edits of existing notes, the part of the Save button of the edit dialog running in a worker thread
+    handler.update_notes_list(notes_dir)
+    rng = random.Random(f"{vault.seed}:edits")
+    filenames = sorted(handler.index)
+    edit_samples = []
+    for _ in range(edits):
+        note = handler.index[rng.choice(filenames)]["note"]
+        content = handler.get_content(note) + "\n" + " ".join(vault.get_words(rng, 20)) + "\n"
+        _, elapsed = _timed(
+            handler._write_note_edits, TempImageHandler(), content, note, notes_dir, temp_dir, list(note.tags)
+        )
+        edit_samples.append(elapsed)
+    results["edit"] = {**summarize(edit_samples), "peak_rss_mb": get_peak_rss_mb()}
+
+    handler.close()
+    return results
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="python -m benchmarks.suite", description=__doc__.splitlines()[1])
+    add_vault_arguments(parser)
+    parser.add_argument("--metadata_store", choices=METADATA_STORES, default="sidecar", help="metadata store")
+    parser.add_argument("--queries", type=int, default=200, help="number of search queries")
+    parser.add_argument("--rescans", type=int, default=5, help="number of rescans of an unchanged vault")
+    parser.add_argument("--sorts", type=int, default=20, help="number of sorts per order")
+    parser.add_argument("--saves", type=int, default=50, help="number of new notes saved")
+    parser.add_argument("--edits", type=int, default=50, help="number of edits saved")
+    parser.add_argument("--dir", type=Path, default=None, help="directory for the vault, kept afterwards")
+    parser.add_argument("--output", type=Path, default=None, help="file the JSON results are written to")
+    args = parser.parse_args(argv)
+
+    # only warnings, kurup logs every saved note
+    logging.getLogger("kurup_logger").setLevel(logging.WARNING)
+    vault = create_vault(args)
+    if args.dir is not None:
+        if args.dir.exists() and any(args.dir.iterdir()):
+            parser.error(f"{args.dir} is not empty")
+        root = args.dir
+    else:
+        root = Path(tempfile.mkdtemp(prefix="kurup-bench-"))
+    try:
+        results = run_suite(
+            vault, root, args.metadata_store, queries=args.queries, rescans=args.rescans,
+            sorts=args.sorts, saves=args.saves, edits=args.edits,
+        )
+    finally:
+        if args.dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "benchmark": "suite",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": get_environment(),
+        "params": {**vault.get_params(), "metadata_store": args.metadata_store},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    summary = (
+        f"scan {results['scan_cold']['ms']:.0f} ms cold, {results['scan_warm']['ms']:.0f} ms warm | "
+        f"search p50 {results['search']['p50']:.2f} ms, p99 {results['search']['p99']:.2f} ms | "
+        f"save p50 {results['save']['p50']:.1f} ms, edit p50 {results['edit']['p50']:.1f} ms | "
+        f"peak RSS {results['edit']['peak_rss_mb']} MB"
+    )
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Generates reproducible synthetic vaults of notes, tags and images for benchmarks.
+
+Usage::
+
+    python -m benchmarks.vault /tmp/vault --notes 10000 --images 2
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+# kurup
+from utils.metadata_store import METADATA_STORES, open_metadata_store
+from utils.notes_handler import write_notes
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+SYLLABLES = ("ka", "ru", "pa", "lo", "mi", "ten", "sor", "vel", "an", "qui", "do", "rex", "ul", "be", "zan", "fi")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# notes written with one WriteBatch
+WRITE_BATCH_SIZE = 256
+
+
+def _zipf_weights(count, skew):
+    # cumulative weights of ranks 1..count, rank r is drawn with probability ~ 1 / r**skew
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+class SyntheticVault():
+    """
+    A reproducible vault of generated notes: the same parameters always give the same notes.
+
+    Words and tags follow a Zipf distribution, so a few are frequent and most are rare, like
+    in real notes. Each note is generated from its own seed, so any note can be recreated
+    without generating the ones before it.
+
+    Parameters
+    ----------
+    notes : int, optional
+        Number of notes.
+    words : int, optional
+        Average number of words per note, the actual number varies by ±50%.
+    vocabulary : int, optional
+        Number of distinct words.
+    tags : int, optional
+        Number of distinct tags.
+    tags_per_note : int, optional
+        Maximum number of tags of a note, each note has between 0 and this many.
+    tag_skew : float, optional
+        Exponent of the Zipf distribution of tags, 0 for uniformly distributed tags.
+    images : float, optional
+        Average number of images per note.
+    shared_images : float, optional
+        Share of image links pointing to an image of another note, 0 to 1.
+    image_size : int, optional
+        Size of each image in bytes.
+    seed : int, optional
+        Seed of the random generator.
+    """
+
+    def __init__(self, notes=1000, words=300, vocabulary=5000, tags=50, tags_per_note=3, tag_skew=1.1,
+                 images=0.5, shared_images=0.1, image_size=16 * 1024, seed=0):
+        self.notes = notes
+        self.words = words
+        self.tags = tags
+        self.tags_per_note = tags_per_note
+        self.images = images
+        self.shared_images = shared_images
+        self.image_size = image_size
+        self.seed = seed
+        rng = random.Random(f"{seed}:vocabulary")
+        self.vocabulary = sorted({
+            "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(vocabulary * 2)
+        })[:vocabulary]
+        rng.shuffle(self.vocabulary)
+        self.tag_names = [f"{word}-{i}" for i, word in enumerate(self.vocabulary[:tags])]
+        self._word_weights = _zipf_weights(len(self.vocabulary), 1.0)
+        self._tag_weights = _zipf_weights(tags, tag_skew) if tags else []
+
+    def get_params(self):
+        """Returns the parameters of the vault, e.g. for benchmark results."""
+        return {
+            "notes": self.notes,
+            "words": self.words,
+            "vocabulary": len(self.vocabulary),
+            "tags": self.tags,
+            "tags_per_note": self.tags_per_note,
+            "images": self.images,
+            "shared_images": self.shared_images,
+            "image_size": self.image_size,
+            "seed": self.seed,
+        }
+
+    def get_filename(self, i):
+        """Returns the filename of the i-th note."""
+        return f"note_{i:06d}.md"
+
+    def get_image(self, key):
+        """Returns the content of an image, a PNG signature followed by reproducible bytes."""
+        data = random.Random(f"{self.seed}:image:{key}").randbytes(max(self.image_size - len(PNG_SIGNATURE), 0))
+        return PNG_SIGNATURE + data
+
+    def get_words(self, rng, count):
+        """Returns `count` words drawn from the vocabulary."""
+        return rng.choices(self.vocabulary, cum_weights=self._word_weights, k=count)
+
+    def get_note(self, i, image_dir="notes"):
+        """
+        Generates the i-th note.
+
+        Parameters
+        ----------
+        i : int
+            Number of the note.
+        image_dir : str, optional
+            URL directory of the image links, e.g. ``temp`` for a note not saved yet.
+
+        Returns
+        -------
+        content : str
+            The markdown content.
+        tags : list of str
+            The tags of the note.
+        images : dict
+            Maps the filename of every linked image to its content.
+        """
+        rng = random.Random(f"{self.seed}:note:{i}")
+        tags = []
+        if self.tags:
+            tags = list(dict.fromkeys(
+                rng.choices(self.tag_names, cum_weights=self._tag_weights, k=rng.randint(0, self.tags_per_note))
+            ))
+
+        word_count = max(1, round(self.words * rng.uniform(0.5, 1.5)))
+        words = self.get_words(rng, word_count)
+        paragraphs = [" ".join(words[start:start + 60]) for start in range(0, word_count, 60)]
+
+        images = {}
+        image_count = int(self.images) + (rng.random() < self.images % 1)
+        for n in range(image_count):
+            # another note's image, shared images are stored once
+            key = rng.randrange(self.notes) if rng.random() < self.shared_images else f"{i}:{n}"
+            data = self.get_image(key)
+            images[f"{hashlib.sha256(data).hexdigest()}.png"] = data
+        links = [f"![image {n}](/{image_dir}/{name})" for n, name in enumerate(images)]
+
+        sections = [f"# {' '.join(words[:3]).capitalize()}"]
+        for n, paragraph in enumerate(paragraphs):
+            if n and n % 3 == 0:
+                sections.append(f"## {' '.join(rng.sample(words, min(2, len(words)))).capitalize()}")
+            sections.append(paragraph)
+            if n < len(links):
+                sections.append(links[n])
+        sections.extend(links[len(paragraphs):])
+        return "\n\n".join(sections) + "\n", tags, images
+
+    def generate(self, notes_dir, metadata_store="sidecar"):
+        """
+        Writes the notes, their images and metadata to a directory, as if they were saved with kurup.
+
+        Modification times are set one minute apart, the first note being the newest.
+
+        Parameters
+        ----------
+        notes_dir : Path
+            The directory where the notes are stored, created if it does not exist.
+        metadata_store : str, optional
+            Either "sidecar" or "log", see `utils.metadata_store`.
+
+        Returns
+        -------
+        dict
+            Number of notes and images and the total size of the vault in bytes.
+        """
+        notes_dir.mkdir(parents=True, exist_ok=True)
+        metadata = open_metadata_store(notes_dir, metadata_store)
+        image_count = total_bytes = 0
+        start_mtime = time.time()
+        try:
+            for start in range(0, self.notes, WRITE_BATCH_SIZE):
+                batch = []
+                for i in range(start, min(start + WRITE_BATCH_SIZE, self.notes)):
+                    content, tags, images = self.get_note(i, notes_dir.name)
+                    for name, data in images.items():
+                        path = notes_dir / name
+                        if not path.exists():
+                            path.write_bytes(data)
+                            image_count += 1
+                            total_bytes += len(data)
+                    batch.append((self.get_filename(i), content, list(images), tags))
+                    total_bytes += len(content.encode("utf-8"))
+                write_notes(notes_dir, batch, metadata)
+                for i, (filename, _, _, _) in enumerate(batch, start):
+                    mtime = start_mtime - i * 60
+                    os.utime(notes_dir / filename, (mtime, mtime))
+        finally:
+            metadata.close()
+        logger.info(f"Generated {self.notes} notes and {image_count} images in {notes_dir}")
+        return {"notes": self.notes, "images": image_count, "bytes": total_bytes}
+
+    def get_queries(self, count, seed=None):
+        """
+        Returns reproducible search queries: frequent and rare words, prefixes, two words and tags.
+
+        Parameters
+        ----------
+        count : int
+            Number of queries.
+        seed : int, optional
+            Seed of the queries, the seed of the vault by default.
+
+        Returns
+        -------
+        list of str
+            The queries.
+        """
+        rng = random.Random(f"{self.seed if seed is None else seed}:queries")
+        queries = []
+        for n in range(count):
+            kind = n % 5
+            if kind == 0:
+                query = self.get_words(rng, 1)[0]
+            elif kind == 1:
+                query = rng.choice(self.vocabulary)
+            elif kind == 2:
+                query = rng.choice(self.vocabulary)[:3]
+            elif kind == 3:
+                query = " ".join(self.get_words(rng, 2))
+            else:
+                query = f"tag:{rng.choice(self.tag_names)}" if self.tag_names else rng.choice(self.vocabulary)
+            queries.append(query)
+        return queries
+
+
+def add_vault_arguments(parser):
+    """Adds the parameters of `SyntheticVault` to an argument parser."""
+    parser.add_argument("--notes", type=int, default=1000, help="number of notes")
+    parser.add_argument("--words", type=int, default=300, help="average number of words per note")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="number of distinct words")
+    parser.add_argument("--tags", type=int, default=50, help="number of distinct tags")
+    parser.add_argument("--tags_per_note", type=int, default=3, help="maximum number of tags per note")
+    parser.add_argument("--tag_skew", type=float, default=1.1, help="Zipf exponent of tags, 0 for uniform")
+    parser.add_argument("--images", type=float, default=0.5, help="average number of images per note")
+    parser.add_argument("--shared_images", type=float, default=0.1, help="share of links to another note's image")
+    parser.add_argument("--image_size", type=int, default=16 * 1024, help="size of each image in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+
+
+def create_vault(args):
+    """Creates a `SyntheticVault` from parsed arguments, see `add_vault_arguments`."""
+    return SyntheticVault(
+        notes=args.notes, words=args.words, vocabulary=args.vocabulary, tags=args.tags,
+        tags_per_note=args.tags_per_note, tag_skew=args.tag_skew, images=args.images,
+        shared_images=args.shared_images, image_size=args.image_size, seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="python -m benchmarks.vault", description=__doc__.splitlines()[1])
+    parser.add_argument("notes_dir", type=Path, help="directory the notes are written to")
+    parser.add_argument("--metadata_store", choices=METADATA_STORES, default="sidecar", help="metadata store")
+    add_vault_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.notes_dir.exists() and any(args.notes_dir.iterdir()):
+        parser.error(f"{args.notes_dir} is not empty")
+    start = time.perf_counter()
+    summary = create_vault(args).generate(args.notes_dir, args.metadata_store)
+    print(
+        f"{summary['notes']} notes, {summary['images']} images, {summary['bytes'] / 1024 / 1024:.1f} MB "
+        f"in {time.perf_counter() - start:.1f} s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,22 +17,32 @@
 # along with kurup. If not, see <https://www.gnu.org/licenses/>.
 
 
+import asyncio
 import uuid
-import shutil
 import json
-import re
-import time
 import logging
 import urllib
 from argparse import ArgumentParser
 from datetime import datetime
-from fastapi import UploadFile
-from nicegui import app, ui
+from fastapi import Query, Request
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from nicegui import app, background_tasks, run, ui
 from pathlib import Path
+from urllib.parse import urlencode
 
 # kurup
-from utils.image_handler import TempImageHandler, get_image_refs, save_images
+from utils import metrics
+from utils.image_handler import UploadRejected, get_image_refs, receive_image
+from utils.export import iter_zip_export
+from utils.http_cache import IMMUTABLE_CACHE_CONTROL, CacheHeadersMiddleware, StaticAssets, get_content_digest, is_not_modified
+from utils.image_variants import VARIANT_SIZES, VARIANTS_URL, ImageVariants
+from utils.janitor import TempJanitor, get_dir_size
+from utils.index_store import KURUP_DIR_NAME
+from utils.live_preview import LivePreview
+from utils.markdown_cache import CachedMarkdown, MarkdownCache
 from utils.notes_handler import NotesHandler
+from utils.notes_watcher import NotesWatcher
+from utils.session import CLIENT_ID_HEADER, create_session, get_session, get_sessions, is_temp_image_in_use
 from utils.fun import get_random_label,get_tag_colors
 # from utils.walkthrough_handler import WalkthroughHandler
 
@@ -63,14 +73,54 @@ parser.add_argument(
     default=9494,
     help="Port to serve the app",
 )
+parser.add_argument(
+    "--no_watch",
+    action="store_true",
+    help="do not watch the notes directory for changes made outside kurup",
+)
+parser.add_argument(
+    "--preview_debounce_ms",
+    type=int,
+    default=300,
+    help="delay after the last keystroke before the new note preview is updated",
+)
+parser.add_argument(
+    "--metadata_store",
+    choices=["sidecar", "log"],
+    default="sidecar",
+    help="keep note metadata in one hidden file per note (sidecar) or in a single log file (log)",
+)
+parser.add_argument(
+    "--max_upload_mb",
+    type=int,
+    default=20,
+    help="maximum size of a pasted image in megabytes",
+)
+parser.add_argument(
+    "--io_workers",
+    type=int,
+    default=4,
+    help="maximum number of file operations running at the same time",
+)
+parser.add_argument(
+    "--avif",
+    action="store_true",
+    help="also create AVIF image previews, smaller than WebP but slower to create (needs Pillow)",
+)
+parser.add_argument(
+    "--slow_ms",
+    type=int,
+    default=0,
+    help="log a warning for every operation taking at least this many milliseconds, 0 to disable",
+)
 args = parser.parse_args()
+metrics.set_slow_threshold(args.slow_ms)
 
 
 # GLOBAL VARIABLES
 
 ## version and update setup
 CURRENT_VERSION = "0.1.3"
-UPDATE_BADGE = None
 
 ## directory setup
 BASE_DIR = Path(__file__).parent.resolve()
@@ -80,16 +130,9 @@ STATIC_DIR = BASE_DIR / "static"
 logger.info(f"Notes will be saved at {NOTES_DIR}")
 logger.info(f"Temporary files will be saved at {TEMP_DIR}")
 
-## tags related
-INIT_TAGS_DATA = {}
-TAGS_DATA = {}  
-CURRENT_TAGS = {}
+## tags related, the tags of every client are kept in its Session
 AVAILABLE_COLORS = get_tag_colors()
 
-## Labels
-QUOTE_LABEL = None
-STATUS_LABEL = None
-
 # make directories
 NOTES_DIR.mkdir(parents=True, exist_ok=True)
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
@@ -98,49 +141,169 @@ TEMP_DIR.mkdir(parents=True, exist_ok=True)
 app.add_static_files(f"/{NOTES_DIR.name}", str(NOTES_DIR))
 app.add_static_files(f"/{TEMP_DIR.name}", str(TEMP_DIR))
 app.add_static_files("/static", str(STATIC_DIR))
+static_assets = StaticAssets(STATIC_DIR, "./static")
+# fingerprinted static files and content-addressed images can be cached forever
+app.add_middleware(
+    CacheHeadersMiddleware,
+    static_url="/static",
+    image_dirs={f"/{NOTES_DIR.name}": NOTES_DIR, f"/{TEMP_DIR.name}": TEMP_DIR},
+)
+
+# handlers for images and notes, shared by all clients
+notes_handler = NotesHandler(io_concurrency=args.io_workers, metadata_store=args.metadata_store)
+storage = notes_handler.storage
+markdown_cache = MarkdownCache(path=NOTES_DIR / KURUP_DIR_NAME / "markdown_cache.sqlite3")
+image_variants = ImageVariants(NOTES_DIR, formats=("avif", "webp") if args.avif else ("webp",))
+notes_watcher = NotesWatcher(notes_handler, NOTES_DIR)
+janitor = TempJanitor(
+    TEMP_DIR,
+    storage,
+    in_use=is_temp_image_in_use,
+    variants_dir=image_variants.variants_dir,
+    image_dirs=[NOTES_DIR, TEMP_DIR],
+)
+app.on_startup(janitor.start)
+app.on_shutdown(janitor.stop)
+
+# read when /metrics is scraped, operation latencies are recorded with metrics.timed
+metrics.registry.gauge("kurup_notes", "Number of indexed notes.", func=lambda: len(notes_handler.index))
+metrics.registry.gauge(
+    "kurup_images", "Number of distinct images referenced by notes.", func=lambda: len(notes_handler.image_refcounts())
+)
+metrics.registry.gauge("kurup_temp_dir_bytes", "Size of the files in the temp directory.", func=lambda: get_dir_size(TEMP_DIR))
+metrics.registry.gauge("kurup_clients", "Number of open browser tabs.", func=lambda: len(get_sessions()))
+metrics.registry.counter(
+    "kurup_cache_hits_total", "Lookups answered from a cache.", ["cache"],
+    func=lambda: {
+        "markdown": markdown_cache.stats["hits"],
+        "note_content": notes_handler.content_cache_hits,
+        "image_variants": image_variants.hits,
+    },
+)
+metrics.registry.counter(
+    "kurup_cache_misses_total", "Lookups which were not cached.", ["cache"],
+    func=lambda: {
+        "markdown": markdown_cache.stats["misses"],
+        "note_content": notes_handler.content_cache_misses,
+        "image_variants": image_variants.misses,
+    },
+)
+metrics.registry.gauge("kurup_markdown_cache_entries", "Number of cached markdown renders.", func=lambda: len(markdown_cache))
+metrics.registry.counter(
+    "kurup_janitor_removed_files_total", "Expired temporary files removed.", func=lambda: janitor.removed_files
+)
+metrics.registry.counter(
+    "kurup_janitor_reclaimed_bytes_total", "Size of the expired temporary files removed.", func=lambda: janitor.reclaimed_bytes
+)
+
+if not args.no_watch:
+    app.on_startup(notes_watcher.start)
+    app.on_shutdown(notes_watcher.stop)
 
-# handlers for images and notes
-temp_image_handler = TempImageHandler()
-notes_handler = NotesHandler()
+async def load_search_index():
+    """Load the search index in the background, searches wait for it if needed"""
+    if notes_handler.search_index is None:
+        await run.io_bound(notes_handler.load_search_index)
+
+def close_index():
+    notes_handler.close()
+    markdown_cache.close()
+
+app.on_startup(load_search_index)
+app.on_shutdown(close_index)
+app.on_shutdown(image_variants.shutdown)
 # walkthrough_handler = WalkthroughHandler(BASE_DIR)
-note_area_labels = get_random_label("note")
-quote = get_random_label("quote")
 
 # pasted images handling
 @app.post("/upload_image")
-async def upload_image(file: UploadFile):
-    """Handle image uploads and store them in temp directory"""
-    file_extension = file.filename.split(".")[-1]
-    file_name = f"{uuid.uuid4()}.{file_extension}"
-    file_path = TEMP_DIR / file_name
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    temp_image_handler.temp_images.append(file_name)
+async def upload_image(request: Request):
+    """Handle image uploads sent as raw request body and store them in temp directory"""
+    max_size = args.max_upload_mb * 1024 * 1024
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_size:
+        # rejected before any of the body is read
+        return JSONResponse({"error": f"Image is larger than {args.max_upload_mb} MB"}, status_code=413)
+
+    try:
+        with metrics.timed("upload_image"):
+            file_name = await receive_image(request.stream(), TEMP_DIR, max_size, storage)
+    except UploadRejected as e:
+        logger.warning(f"Rejected image upload: {e}")
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    # the images of a note are kept until it is saved, by the session of the pasting client
+    session = get_session(request.headers.get(CLIENT_ID_HEADER))
+    if session is not None and file_name not in session.temp_image_handler.temp_images:
+        session.temp_image_handler.temp_images.append(file_name)
+    # previews are ready before the note is saved
+    image_variants.submit_all(TEMP_DIR / file_name)
     return {"url": f"/{TEMP_DIR.name}/{file_name}"}
 
-def set_quotes():
+@app.get("/metrics")
+def get_metrics():
+    """Metrics in the Prometheus text format, runs in a worker thread as some values are read from disk"""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get(VARIANTS_URL + "/{size}/{directory}/{filename}")
+async def get_image_variant(request: Request, size: str, directory: str, filename: str):
+    """Serve a downscaled variant of an image, or redirect to the original if there is none"""
+    directories = {NOTES_DIR.name: NOTES_DIR, TEMP_DIR.name: TEMP_DIR}
+    if size not in VARIANT_SIZES or directory not in directories or filename.startswith("."):
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    original = f"/{directory}/{filename}"
+    fmt = image_variants.select_format(request.headers.get("accept", ""))
+    headers = {"Vary": "Accept"}
+    digest = get_content_digest(filename)
+    if fmt and digest:
+        headers["ETag"] = f'"{digest}-{size}.{fmt}"'
+        headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        if (is_not_modified(request.headers.get("if-none-match"), headers["ETag"])
+                and image_variants.get_path(filename, size, fmt).exists()):
+            return Response(status_code=304, headers=headers)
+    path = await image_variants.get(directories[directory] / filename, size, fmt) if fmt else None
+    if path is None:
+        return RedirectResponse(original)
+    return FileResponse(path, media_type=f"image/{fmt}", headers=headers)
+
+@app.get("/export")
+async def export_notes(q: str = "", tag: list[str] = Query(default=[])):
+    """Stream a zip archive of all notes, or of the notes matching a search and all given tags"""
+    def select_notes():
+        if q.strip() or tag:
+            # tags are matched case-insensitively, like tag:name in the search box
+            return notes_handler.search(q, tags=tag)
+        return notes_handler.sorted_notes("title")
+
+    notes = await storage.run(select_notes)
+    filename = f"kurup_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip"
+    # the archive is created while it is sent, from a worker thread
+    return StreamingResponse(
+        iter_zip_export(notes, NOTES_DIR),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+def set_quotes(session):
     """
     Sets random labels in the UI when a note is saved.
     """
-    global QUOTE_LABEL
     quote = get_random_label("quote")
-    QUOTE_LABEL.set_text(quote)
+    session.quote_label.set_text(quote)
 
 # new note tab
 class NewNote:
     """Class to handle creation of new notes"""
 
-    def __init__(self):
+    def __init__(self, session):
+        self.session = session
         self.note_title = None
         self.note_area = None
         self.markdown_area = None
+        self._preview_handle = None
         self.save_button = None
         self.my_notes_reference = None
 
     def create_new_note_ui(self):
         """Create the UI for the new note tab"""
-        global note_label
-
         logger.info("Creating New Note tab")
         with ui.row():
             self.note_title = (
@@ -151,7 +314,7 @@ class NewNote:
                         "Title too long": lambda value: len(value) <= 99,
                         "A note with this title already exists, choose a different title.": lambda value: value
                         not in [
-                            note["title"]
+                            note.title
                             for note in self.my_notes_reference.all_notes_cache
                         ],
                     },
@@ -161,7 +324,7 @@ class NewNote:
             )
 
             self.tags_select = ui.select(
-                options=list(TAGS_DATA.keys()),
+                options=list(self.session.tags_data.keys()),
                 multiple=True,
                 label="Tags",
                 with_input=True,
@@ -243,7 +406,7 @@ class NewNote:
                 ).props("size=sm").tooltip("Code block")
 
             self.note_area = (
-                ui.textarea(label=note_area_labels, on_change=self._update_markdown)
+                ui.textarea(label=get_random_label("note"), on_change=self._update_markdown)
                 .classes("w-full")
                 .props("id=noteTextarea")
             )
@@ -251,48 +414,47 @@ class NewNote:
         with ui.column().classes("w-full"):
             with ui.element("div").classes("w-full"):
                 self.markdown_area = (
-                    ui.markdown("").classes("w-full").props("id=markdownPreview")
+                    LivePreview(markdown_cache).classes("w-full").props("id=markdownPreview")
                 )
 
-        timestamp = str(int(time.time()))
-        ui.add_body_html(
-            f'<script src="./static/text_formatter.js?v={timestamp}"></script>'
-        )
-        ui.add_body_html('<script src="./static/image_handler.js"></script>')
-        ui.add_body_html('<script src="./static/edit_image_handler.js"></script>')
+        for script in ("text_formatter.js", "image_handler.js", "edit_image_handler.js"):
+            ui.add_body_html(f'<script src="{static_assets.url(script)}"></script>')
 
     def _update_markdown(self):
-        """Update markdown preview and clean up unused temp images"""
+        """Schedule an update of the markdown preview, restarting the delay on every change"""
+        self._cancel_preview_update()
+        self._preview_handle = asyncio.get_running_loop().call_later(
+            args.preview_debounce_ms / 1000, self._render_markdown
+        )
+
+    def _cancel_preview_update(self):
+        if self._preview_handle is not None:
+            self._preview_handle.cancel()
+            self._preview_handle = None
+
+    def _render_markdown(self):
+        """Update markdown preview and the references to temp images"""
+        self._preview_handle = None
+        if self.markdown_area.is_deleted:
+            return
         logger.debug("Markdown updated.")
-        self.markdown_area.set_content(self.note_area.value)
+        self.markdown_area.set_content(
+            image_variants.rewrite(self.note_area.value, {TEMP_DIR.name, NOTES_DIR.name}, "large")
+        )
 
-        temp_image_handler.temp_image_refs = get_image_refs(
+        self.session.temp_image_handler.temp_image_refs = get_image_refs(
             self.note_area.value, TEMP_DIR
         )
 
-    def _clean_unused_temp_images(self):
-        """Remove temporary images that are no longer referenced"""
-        for img in list(temp_image_handler.temp_images):
-            if img not in temp_image_handler.temp_image_refs:
-                try:
-                    img_path = TEMP_DIR / img
-                    if img_path.exists():
-                        img_path.unlink()
-                    temp_image_handler.temp_images.remove(img)
-                    logger.info(f"Removed temporary file which is not referenced: {img_path}")
-                except Exception as e:
-                    logger.error(f"Error removing temp image {img}: {e}")
-
-    def save_button_clicked(self):
+    async def save_button_clicked(self):
         """Save button click event"""
-        global CURRENT_TAGS
         # nothing in the note_area.
         if self.note_area.value == "":
             ui.notify("Nothing to save!", color="negative")
             return
         
         # tags
-        tags = list(CURRENT_TAGS.keys()) or []
+        tags = list(self.session.current_tags.keys()) or []
 
         # content in note area
         if self.note_title.value:
@@ -300,45 +462,51 @@ class NewNote:
         else:
             filename = f"untitled_{datetime.now().strftime('%d%m%Y%H%M%S')}.md"
 
-        # save note content and move images
-        updated_content, img_list = save_images(
-            self.note_area.value, NOTES_DIR, TEMP_DIR
-        )
-        
-        # write the note
-        note_path = NOTES_DIR / filename
-        note_path.write_text(updated_content, encoding="utf-8")
-        logger.info(f"Saved note titled {filename}.")
-
-        # kurup_metadata = {filename: img_list} (until v.0.1.1)
-        kurup_metadata = {filename: {"images": img_list, "tags": tags}} 
-        kurup_file_path = NOTES_DIR / f".{filename}.kurup"
-        kurup_file_path.write_text(json.dumps(kurup_metadata), encoding="utf-8")
-        logger.info(f"Saved kurup metadata for {filename}.")
+        # save note content and move images, off the event loop
+        self.save_button.disable()
+        try:
+            await storage.run(
+                notes_handler.save_new_note, NOTES_DIR, TEMP_DIR, filename, self.note_area.value, tags,
+                self._is_used_elsewhere,
+            )
+        except Exception as e:
+            logger.error(f"Error saving note {filename}: {e}")
+            ui.notify(f"Error saving note: {e}", color="negative")
+            return
+        finally:
+            self.save_button.enable()
 
         ui.notify(f"Saved as {filename}", color="positive")
 
         # cleanup
-        self._clean_all_temp_images()
+        await storage.run(self._clean_all_temp_images)
         self.note_title.value = ""
         self.note_area.value = ""
+        self._cancel_preview_update()
         self.markdown_area.set_content("")
-        self.tags_select.set_options(list(TAGS_DATA.keys()))
+        self.tags_select.set_options(list(self.session.tags_data.keys()))
         self.tags_select.set_value([])
         self.selected_tags_area.clear()
-        CURRENT_TAGS = {}
+        self.session.current_tags = {}
 
         # refresh notes
         if self.my_notes_reference:
-            self.my_notes_reference.sort_notes()
+            await self.my_notes_reference.sort_notes(rescan=False)
 
         # set new label message
         self.note_area.set_label(get_random_label("note"))
-        set_quotes()
+        set_quotes(self.session)
+
+    def _is_used_elsewhere(self, img):
+        """Check if a temp image is also pasted into a note of another client"""
+        return is_temp_image_in_use(img, exclude=self.session)
 
     def _clean_all_temp_images(self):
         """Clean up all temporary images"""
+        temp_image_handler = self.session.temp_image_handler
         for img in list(temp_image_handler.temp_images):
+            if self._is_used_elsewhere(img):
+                continue
             try:
                 img_path = TEMP_DIR / img
                 if img_path.exists():
@@ -352,7 +520,7 @@ class NewNote:
     def _validate_title(self, e):
         title = e.value.strip()
         if (
-            title in [note["title"] for note in self.my_notes_reference.all_notes_cache]
+            title in [note.title for note in self.my_notes_reference.all_notes_cache]
             or len(title) > 99
         ):
             self.save_button.disable()
@@ -360,33 +528,47 @@ class NewNote:
             self.save_button.enable()
 
     def on_tags_change(self, e):
-        global TAGS_DATA, CURRENT_TAGS
+        session = self.session
         self.selected_tags_area.clear()
         if e.value:
             for tag in e.value:
-                if tag not in TAGS_DATA:
-                    TAGS_DATA[tag] = AVAILABLE_COLORS[len(TAGS_DATA) % len(AVAILABLE_COLORS)]
-                CURRENT_TAGS[tag] = tag
+                session.add_tag(tag)
+                session.current_tags[tag] = tag
                 with self.selected_tags_area:
-                    ui.chip(tag, removable=True,icon='label',color=TAGS_DATA[tag],on_value_change= lambda _,t=tag: self.remove_tag(t))
+                    ui.chip(tag, removable=True,icon='label',color=session.tags_data[tag],on_value_change= lambda _,t=tag: self.remove_tag(t))
 
     def remove_tag(self, tag):
-        
-        CURRENT_TAGS.pop(tag,None)
-        if tag not in INIT_TAGS_DATA:
-            TAGS_DATA.pop(tag,None)
-        self.tags_select.set_options(list(TAGS_DATA.keys()))
-        self.tags_select.set_value(list(CURRENT_TAGS.keys()))
+        session = self.session
+        session.current_tags.pop(tag,None)
+        if tag not in session.init_tags_data:
+            session.tags_data.pop(tag,None)
+        self.tags_select.set_options(list(session.tags_data.keys()))
+        self.tags_select.set_value(list(session.current_tags.keys()))
 
 
 # my note tab
 class MyNotes:
     """Class to handle viewing and managing existing notes"""
 
-    def __init__(self):
+    page_size = 48
+
+    def __init__(self, session):
+        self.session = session
         self.notes_container = None
         self.edit_area = None
         self.new_note_refrence = None
+        self.pagination = None
+        self.shown_notes = []
+        # position of the first shown note, search results hold only the current page
+        self.shown_offset = 0
+        self.empty_message = "No notes found"
+        self.notes_status = ""
+        self._changing_page = False
+        self.preview_cards = set()
+        # the active search, its pages are ranked when they are shown
+        self.search_term = None
+        # results of an older search are dropped if a newer one started meanwhile
+        self._search_count = 0
         
 
     def create_my_notes_ui(self):
@@ -400,12 +582,10 @@ class MyNotes:
         ]
 
         with ui.row().classes("w-full q-pa-md justify-center"):
-            global STATUS_LABEL
-
             self.sort_option = ui.select(
                 options=options,
                 value="Most recent",
-                on_change=lambda: self.sort_notes(sorting=self.sort_option.value),
+                on_change=lambda: self.sort_notes(sorting=self.sort_option.value, rescan=False),
             ).classes("w-32 text-base")
             
             
@@ -418,6 +598,7 @@ class MyNotes:
                 )
                 .classes("w-96 text-base")
                 .props("id=search-notes")
+                .tooltip("All words must match, use tag:name to filter by tag.")
             )
             self.notes_select = (
                 ui.select(
@@ -440,8 +621,30 @@ class MyNotes:
                 ),
                 icon="refresh",
             ).classes("w-16 h-14").props("id=refresh-notes").tooltip("Refresh notes.")
-     
-        STATUS_LABEL = ui.label(f"Processing {len(notes_handler.note_list)} notes ...").classes("text-s")
+
+            # rebuild button, re-reads every note instead of only changed ones
+            ui.button(
+                "",
+                on_click=self.rebuild_notes,
+                icon="restart_alt",
+            ).classes("w-16 h-14").props("id=rebuild-notes").tooltip("Rebuild note index.")
+
+            # export button, downloads the notes matching the search
+            ui.button(
+                "",
+                on_click=self.export_notes_click,
+                icon="archive",
+            ).classes("w-16 h-14").props("id=export-notes").tooltip("Export the shown notes as zip.")
+
+        self.session.status_label = ui.label(f"Processing {len(notes_handler.note_list)} notes ...").classes("text-s")
+
+        # only the cards of the current page are created
+        with ui.row().classes("w-full justify-center"):
+            self.pagination = (
+                ui.pagination(1, 1, direction_links=True, on_change=self._on_page_change)
+                .props("max-pages=9 boundary-numbers id=notes-pagination")
+            )
+            self.pagination.set_visibility(False)
 
         self.notes_container = (
             ui.element("div")
@@ -453,32 +656,88 @@ class MyNotes:
         )
         #self.refresh_notes()
 
-    def on_search_input(self, search_term=""):
+    async def on_search_input(self, search_term=""):
         """Handle search input - filter notes as user types"""
         if search_term is not None:
             search_term = search_term.lower()
         if not hasattr(self, "all_notes_cache"):
             return
 
-        if search_term:
-            filtered_notes = [
-                note
-                for note in self.all_notes_cache
-                if search_term in note["title"].lower()
-                or search_term in note["content"].lower()
-                or search_term in [tag.lower() for tag in note["tags"]]
-            ]
+        if search_term and search_term.strip():
+            self.search_term = search_term
+            await self._show_search_page(1)
         else:
-            filtered_notes = self.all_notes_cache
+            self._search_count += 1
+            self._show_notes(self.all_notes_cache)
+
+    async def _show_search_page(self, page):
+        """Rank the matches of the active search up to the given page and show that page"""
+        self._search_count += 1
+        search_count = self._search_count
+        search_term = self.search_term
+        if notes_handler.search_index is None:
+            # still loading after startup, waited for without blocking the event loop
+            await load_search_index()
+        # ranked results from the search index, best match first, searched off the event loop
+        offset = (page - 1) * self.page_size
+        notes, total, complete = await storage.run(notes_handler.search_page, search_term, offset, self.page_size)
+        if search_count != self._search_count or self.notes_container.is_deleted:
+            return
 
+        self.shown_notes = notes
+        self.shown_offset = offset
+        self.empty_message = f"No notes found matching '{search_term}'"
+        self._set_page_count(total, page)
+        if complete:
+            self.session.status_label.set_text(f"{total} notes match '{search_term}'.")
+        else:
+            # very common search terms only matched their closest words
+            self.session.status_label.set_text(
+                f"{total}+ notes match '{search_term}', type more to find all matching notes."
+            )
+        self._render_page()
+
+    def _show_notes(self, notes, empty_message="No notes found"):
+        """Show notes in the grid, starting at the first page"""
+        self.search_term = None
+        self.shown_notes = notes
+        self.shown_offset = 0
+        self.empty_message = empty_message
+        self._set_page_count(len(notes), 1)
+        if self.notes_status:
+            self.session.status_label.set_text(self.notes_status)
+        self._render_page()
+
+    def _set_page_count(self, note_count, page):
+        page_count = max(1, -(-note_count // self.page_size))
+        self._changing_page = True
+        try:
+            self.pagination.max = page_count
+            self.pagination.set_value(min(page, page_count))
+        finally:
+            self._changing_page = False
+        self.pagination.set_visibility(page_count > 1)
+
+    def _on_page_change(self):
+        if self._changing_page:
+            return
+        if self.search_term:
+            background_tasks.create(self._show_search_page(self.pagination.value))
+        else:
+            self._render_page()
+
+    def _render_page(self):
+        """Create the cards of the current page only"""
         self.notes_container.clear()
-        if not filtered_notes:
+        self.preview_cards = set()
+        if not self.shown_notes:
             with self.notes_container:
-                ui.label(f"No notes found matching '{search_term}'").classes(
-                    "text-h6 q-pa-md"
-                )
-        else:
-            for note in filtered_notes:
+                ui.label(self.empty_message).classes("text-h6 q-pa-md")
+            return
+
+        start = (self.pagination.value - 1) * self.page_size - self.shown_offset
+        with metrics.timed("render_cards"):
+            for note in self.shown_notes[start:start + self.page_size]:
                 self._create_note_card(note)
 
     def refresh_notes_options(self, current_notes):
@@ -492,9 +751,9 @@ class MyNotes:
 
         for note in current_notes:
             display_title = (
-                note["title"]
-                if note["title"] != "Untitled"
-                else f"Untitled ({note['filename']})"
+                note.title
+                if note.title != "Untitled"
+                else f"Untitled ({note.filename})"
             )
             options.append(display_title)
             self.notes_data[display_title] = note
@@ -509,17 +768,19 @@ class MyNotes:
             not self.notes_select.value
             or self.notes_select.value not in self.notes_data
         ):
-            self.notes_container.clear()
             if hasattr(self, "current_notes_cache") and self.current_notes_cache:
-                for note in self.current_notes_cache:
-                    self._create_note_card(note)
+                self._show_notes(self.current_notes_cache)
             return
         selected_note = self.notes_data[self.notes_select.value]
-        self.notes_container.clear()
-        self._create_note_card(selected_note)
+        self._show_notes([selected_note])
 
-    def sort_notes(self, sorting=None, search_term="",current_notes=None):
-        current_notes = current_notes if current_notes is not None else notes_handler.update_notes_list(NOTES_DIR)
+    async def sort_notes(self, sorting=None, search_term="", rescan=True):
+        """Rescan the notes directory off the event loop, then show the sorted notes"""
+        if rescan:
+            await storage.run(notes_handler.update_notes_list, NOTES_DIR)
+        self.show_sorted_notes(sorting=sorting, search_term=search_term)
+
+    def show_sorted_notes(self, sorting=None, search_term=""):
         options = [
             "Most recent",
             "Least recent",
@@ -527,122 +788,121 @@ class MyNotes:
             "Title (Z–A)",
         ]
 
-        def natural_key(note):
-            return [
-                int(text) if text.isdigit() else text.lower()
-                for text in re.split(r"([0-9]+)", note["filename"])
-            ]
-
         if sorting is None:
             sorting = self.sort_option.value
-        if sorting == options[0]:
-            current_notes.sort(key=lambda note: note["modified"], reverse=True)
-        elif sorting == options[1]:
-            current_notes.sort(key=lambda note: note["modified"])
+        if sorting == options[1]:
+            current_notes = notes_handler.sorted_notes("modified")
         elif sorting == options[2]:
-            current_notes.sort(key=natural_key)
+            current_notes = notes_handler.sorted_notes("title")
         elif sorting == options[3]:
-            current_notes.sort(key=natural_key, reverse=True)
+            current_notes = notes_handler.sorted_notes("title", reverse=True)
         else:
-            current_notes.sort(key=lambda note: note["modified"], reverse=True)
+            current_notes = notes_handler.sorted_notes("modified", reverse=True)
 
         self.refresh_notes(current_notes=current_notes)
         
         if search_term == "":
             self.search_input.set_value(None)
 
+    def on_notes_changed(self, changed):
+        """Refresh the notes after files were changed outside kurup"""
+        if self.notes_container.is_deleted:
+            return
+        search_term = self.search_input.value or ""
+        self.show_sorted_notes(
+            sorting=self.sort_option.value,
+            search_term=search_term,
+        )
+        if search_term:
+            background_tasks.create(self.on_search_input(search_term=search_term))
+
+    async def rebuild_notes(self):
+        """Re-read every note from disk and refresh the notes"""
+        await storage.run(notes_handler.rebuild_index, NOTES_DIR)
+        self.show_sorted_notes(sorting=self.sort_option.value)
+
     def refresh_notes(self, current_notes=None,create_note_cards=True):
-        global TAGS_DATA
-        
+        tags_data = self.session.tags_data
+
         logger.info("Refreshing saved notes.")
         current_notes = current_notes if current_notes is not None else notes_handler.update_notes_list(NOTES_DIR)
         
-        if self.notes_container:
-            self.notes_container.clear()
-
         self.all_notes_cache = current_notes
         self.current_notes_cache = current_notes
 
         # Update dropdown options
         self.refresh_notes_options(current_notes)
 
-        all_tags = {tag for note in current_notes if note["tags"] for tag in note["tags"]}
-        tag_keys = list(TAGS_DATA.keys())
+        all_tags = {tag for note in current_notes for tag in note.tags}
+        tag_keys = list(tags_data.keys())
         for tag in tag_keys:
             if tag not in all_tags:
-                TAGS_DATA.pop(tag,None)
+                tags_data.pop(tag,None)
         
         for tag in all_tags:
-            if tag not in TAGS_DATA:
-                TAGS_DATA[tag] = AVAILABLE_COLORS[len(TAGS_DATA) % len(AVAILABLE_COLORS)]
+            self.session.add_tag(tag)
         
         if self.new_note_reference:
-            self.new_note_reference.tags_select.set_options(list(TAGS_DATA.keys()))
+            self.new_note_reference.tags_select.set_options(list(tags_data.keys()))
 
         if not current_notes:
-            with self.notes_container:
-                ui.label("No notes found").classes("text-h6 q-pa-md")
+            self._show_notes([])
             return
         
         if create_note_cards:
             current_notes_len = len(current_notes)
             total_tags = 0
             total_images = 0
-            for idx,note in enumerate(current_notes):
-                total_tags += len(note.get('tags', []))
-                total_images += len(note.get('image_refs', []))
-                self._create_note_card(note)
-            STATUS_LABEL.set_text(f"{current_notes_len} notes, {total_images} images and {total_tags} tags.")
+            for note in current_notes:
+                total_tags += len(note.tags)
+                total_images += len(note.image_refs)
+            self.notes_status = f"{current_notes_len} notes, {total_images} images and {total_tags} tags."
+            self._show_notes(current_notes)
 
     def _create_note_card(self, note):
         """Create a simple card showing only title and basic info"""
-        global TAGS_DATA
-        
         with self.notes_container:
-            with ui.card().classes("q-mb-sm cursor-pointer transition-all duration-800 hover:bg-[#e9f5d0] dark:hover:bg-[#3c542d]").on('click', lambda: self.show_full_note(note)):
-                
-                # Add tooltip with rendered markdown
-                with ui.tooltip().classes('max-w-[50vw] w-fit overflow-hidden'):
-                    preview_content = self._get_markdown_preview(note["content"])
-                    ui.markdown(preview_content).classes('text-xs max-w-[50vw] w-fit')
+            with ui.card().classes("q-mb-sm cursor-pointer transition-all duration-800 hover:bg-[#e9f5d0] dark:hover:bg-[#3c542d]").on('click', lambda: self.show_full_note(note)) as card:
+
+                # tooltip with rendered markdown, created on first hover
+                card.on('mouseenter', lambda: self._add_preview_tooltip(card, note))
                 with ui.card_section():
-                    ui.label(note["title"]).classes("text-h6")
-                    ui.label(f"Modified: {note['modified'].strftime('%Y-%m-%d %H:%M')}").classes("text-caption")
-                    if note.get('tags'):
+                    ui.label(note.title).classes("text-h6")
+                    ui.label(f"Modified: {note.modified.strftime('%Y-%m-%d %H:%M')}").classes("text-caption")
+                    if note.tags:
                         with ui.row().classes("q-mt-xs"):
-                            for tag in note['tags']:
-                                ui.chip(tag, removable=False, icon='label', color=TAGS_DATA.get(tag, '#gray'))
+                            for tag in note.tags:
+                                ui.chip(tag, removable=False, icon='label', color=self.session.tags_data.get(tag, '#gray'))
 
-    def _get_markdown_preview(self, content, max_lines=10):
-        """Efficiently return the first `max_lines` lines of markdown content as preview."""
-        if not content:
-            return "No content available"
-        
-        lines = content.splitlines()
-        if len(lines) <= max_lines:
-            return content
-        
-        preview_lines = lines[:max_lines]
-        preview = '\n'.join(preview_lines) + '\n\n*....*'
-        return preview
-    
-    def show_full_note(self, note):
+    def _add_preview_tooltip(self, card, note):
+        """Add the markdown preview tooltip to a card and show it, only once per card"""
+        if card in self.preview_cards:
+            return
+        self.preview_cards.add(card)
+        with card:
+            with ui.tooltip().classes('max-w-[50vw] w-fit overflow-hidden') as tooltip:
+                preview = image_variants.rewrite(note.preview, {NOTES_DIR.name}, "small")
+                CachedMarkdown(preview, cache=markdown_cache).classes('text-xs max-w-[50vw] w-fit')
+        tooltip.run_method('show')
+
+    async def show_full_note(self, note):
+        content = await storage.run(notes_handler.get_content, note)
         dialog = ui.dialog().classes("w-full")
         with dialog:
             with ui.card().style("width: 100%; max-width: 95vw;"):
                 with ui.card_section():
 
-                    ui.label(note["title"]).classes("text-h6")
-                    ui.label(f"Modified: {note['modified'].strftime('%Y-%m-%d %H:%M')}").classes("text-caption")
+                    ui.label(note.title).classes("text-h6")
+                    ui.label(f"Modified: {note.modified.strftime('%Y-%m-%d %H:%M')}").classes("text-caption")
                     
                     # some stats, does not have a huge performance impact.
                     with ui.row().classes("gap-6 mt-3 text-grey-7"):
                         # count chars
-                        char_count = len(note["content"])
+                        char_count = len(content)
                         ui.label(f"📝 {char_count:,} characters").classes("text-caption")
                         
                         # count word
-                        word_count = len(note["content"].split()) if note["content"].strip() else 0
+                        word_count = len(content.split()) if content.strip() else 0
                         ui.label(f"🔢 {word_count:,} words").classes("text-caption")
                         
                         # calculated using an average of 200 words per min.
@@ -650,19 +910,19 @@ class MyNotes:
                         ui.label(f"⏱️ <{reading_time} min read").classes("text-caption")
                         
                         # count tags and show them too
-                        if note.get("tags"):
-                            tag_count = len(note["tags"])
-                            ui.label(f"🏷️ {tag_count} tags: {', '.join(note['tags'])}").classes("text-caption")
+                        if note.tags:
+                            tag_count = len(note.tags)
+                            ui.label(f"🏷️ {tag_count} tags: {', '.join(note.tags)}").classes("text-caption")
 
                 with ui.card_section().classes("w-full flex-grow"):
-                    self._create_note_tabs_in_dialog(note)
+                    self._create_note_tabs_in_dialog(note, content)
                 with ui.card_actions().classes("justify-end"):
                     ui.button("Close", on_click=dialog.close)
                     ui.button("Delete", color="negative", on_click=lambda: self.delete_note_click(note))
                     ui.button("Download", color="primary", on_click=lambda: self.download_note_click(note, NOTES_DIR, TEMP_DIR))
         dialog.open()
 
-    def _create_note_tabs_in_dialog(self, note):
+    def _create_note_tabs_in_dialog(self, note, content):
         """Create the preview/raw/edit tabs for a note"""
         with ui.tabs().classes("w-96") as note_tabs:
             preview_tab = ui.tab("Preview")
@@ -671,18 +931,18 @@ class MyNotes:
 
         with ui.tab_panels(note_tabs, value=preview_tab).classes("w-full"):
             with ui.tab_panel(preview_tab):
-                ui.markdown(note["content"])
+                CachedMarkdown(image_variants.rewrite(content, {NOTES_DIR.name}, "large"), cache=markdown_cache)
 
             with ui.tab_panel(raw_tab):
-                ui.code(note["content"], language="markdown").classes("w-full")
+                ui.code(content, language="markdown").classes("w-full")
 
             with ui.tab_panel(edit_tab):
 
                 self.tags_select = ui.select(
-                    options=list(TAGS_DATA.keys()),
+                    options=list(self.session.tags_data.keys()),
                     multiple=True,
                     label="Tags",
-                    value=note.get('tags', []),
+                    value=list(note.tags),
                     with_input=True,
                     new_value_mode="add"
                 ).classes("w-full q-mb-sm")
@@ -750,7 +1010,7 @@ class MyNotes:
                     ).props("size=sm").tooltip("Code block")
 
                 edit_area = (
-                    ui.textarea(value=note["content"], on_change=self.edit_area_change)
+                    ui.textarea(value=content, on_change=self.edit_area_change)
                     .classes("w-full")
                     .style("min-height: 100px")
                     .props(f"id={edit_textarea_id}")
@@ -761,28 +1021,33 @@ class MyNotes:
 
     def delete_note_click(self, note):
         """Handle delete note button click"""
-        notes_handler.delete_note(note, NOTES_DIR, self.sort_notes)
+        notes_handler.delete_note(note, NOTES_DIR, lambda: self.sort_notes(rescan=False))
 
-    def save_edits_click(self, edit_area, note):
-        notes_handler.save_note_edits(
-            temp_image_handler, edit_area.value, note, NOTES_DIR, TEMP_DIR, self.tags_select.value
+    async def save_edits_click(self, edit_area, note):
+        await notes_handler.save_note_edits(
+            self.session.temp_image_handler, edit_area.value, note, NOTES_DIR, TEMP_DIR, self.tags_select.value,
+            lambda img: is_temp_image_in_use(img, exclude=self.session),
         )
-        self.sort_notes(sorting=self.sort_option.value)
+        await self.sort_notes(sorting=self.sort_option.value, rescan=False)
 
     def edit_area_change(self):
         """Handle edit area change event"""
         if hasattr(self, "edit_area") and self.edit_area:
-            temp_image_handler.temp_image_refs = get_image_refs(
+            self.session.temp_image_handler.temp_image_refs = get_image_refs(
                 self.edit_area.value, TEMP_DIR
             )
 
-    def download_note_click(self, note, NOTES_DIR, TEMP_DIR):
-        notes_handler.download_note(note, NOTES_DIR, TEMP_DIR)
-        logger.info(f"Downloaded note {note['filename']}")
+    def export_notes_click(self):
+        """Download a zip archive of all notes, or of the notes matching the search"""
+        search_term = (self.search_input.value or "").strip()
+        ui.download(f"/export?{urlencode({'q': search_term})}" if search_term else "/export")
 
+    async def download_note_click(self, note, NOTES_DIR, TEMP_DIR):
+        await notes_handler.download_note(note, NOTES_DIR, TEMP_DIR, janitor)
+        logger.info(f"Downloaded note {note.filename}")
 
-def check_for_update():
-    global UPDATE_BADGE
+
+def check_for_update(session):
     try:
         with urllib.request.urlopen(
             "https://api.github.com/repos/davistdaniel/kurup/releases/latest"
@@ -793,27 +1058,31 @@ def check_for_update():
                 ui.notify(
                     f"A new version of kurup is available: {latest_version}. Current version: {CURRENT_VERSION}"
                 )
-                if UPDATE_BADGE:
-                    UPDATE_BADGE.set_text("!")
-                    UPDATE_BADGE.style("display: block")
+                if session.update_badge:
+                    session.update_badge.set_text("!")
+                    session.update_badge.style("display: block")
             else:
                 ui.notify("You're using the latest version of kurup.", color="positive")
-                if UPDATE_BADGE:
-                    UPDATE_BADGE.style("display: none")
+                if session.update_badge:
+                    session.update_badge.style("display: none")
     except Exception as e:
         ui.notify("Error checking for updates.", color="negative")
         logger.error(f"Failed to check for updates: {e}")
 
 
+@ui.page("/")
 def create_ui():
-    """Create the main UI for the application"""
-    global QUOTE_LABEL, UPDATE_BADGE
-    my_notes = MyNotes()
-    new_note = NewNote()
+    """Create the main UI for the application, once for every client"""
+    session = create_session(AVAILABLE_COLORS)
+    session.init_tags(notes_handler.note_list)
+    my_notes = MyNotes(session)
+    new_note = NewNote(session)
 
     # this is needed for refreshing the my_notes tab when a new note is saved
     new_note.my_notes_reference = my_notes
     my_notes.new_note_reference = new_note
+    notes_watcher.add_listener(my_notes.on_notes_changed)
+    ui.context.client.on_disconnect(lambda: notes_watcher.remove_listener(my_notes.on_notes_changed))
 
     dark = ui.dark_mode()
 
@@ -829,17 +1098,17 @@ def create_ui():
             "id=dark-mode-switch"
         )
 
-    QUOTE_LABEL = ui.label(f"{quote}").classes("text-l text-italic")
+    session.quote_label = ui.label(get_random_label("quote")).classes("text-l text-italic")
 
     with ui.header().classes("bg-[#e9f5d0] dark:bg-[#3c542d]"):
-        ui.image("./static/logo.webp").classes("w-64").props("id=kurup-logo")
+        ui.image(static_assets.url("logo.webp")).classes("w-64").props("id=kurup-logo")
         with ui.column():
             with (
-                ui.button("", on_click=check_for_update, icon="system_update_alt")
+                ui.button("", on_click=lambda: check_for_update(session), icon="system_update_alt")
                 .classes("w-10 h-10")
                 .tooltip("Check for a newer version of kurup")
             ):
-                UPDATE_BADGE = (
+                session.update_badge = (
                     ui.badge("", color="red").props("floating").style("display: none")
                 )
 
@@ -862,21 +1131,11 @@ def create_ui():
         with ui.tab_panel(my_notes_tab):
             my_notes.create_my_notes_ui()
 
-    # this needs to be done before, so that tags have their colors defined.
-    current_notes = notes_handler.update_notes_list(NOTES_DIR)
-    global TAGS_DATA, INIT_TAGS_DATA
-    all_tags = {tag for note in notes_handler.note_list if note["tags"] for tag in note["tags"]}
-    for tag in all_tags:
-        if tag not in INIT_TAGS_DATA:
-            INIT_TAGS_DATA[tag] = AVAILABLE_COLORS[len(INIT_TAGS_DATA) % len(AVAILABLE_COLORS)]
-    new_note.tags_select.set_options(list(INIT_TAGS_DATA.keys()))
-    TAGS_DATA = INIT_TAGS_DATA.copy()
-
     # sort the notes initially
-    my_notes.sort_notes(current_notes=current_notes,search_term="")
+    my_notes.show_sorted_notes(search_term="")
 
-# create the UI and start the app
+# load the note index shared by all clients and start the app
 logger.info("Starting kurup: a simple markdown-based notes app")
-create_ui()
+notes_handler.load_index(NOTES_DIR)
 # check_for_update()
 ui.run(port=args.port, favicon=STATIC_DIR / "favicon.svg", title="kurup")
@@ -53,21 +53,28 @@ document.addEventListener('DOMContentLoaded', () => {
           const file = item.getAsFile();
           if (!file) return;
 
-          const formData = new FormData();
-          formData.append('file', file);
-          
+          // the image is sent as raw body, the server streams it to disk
+          const cursorPos = textarea.selectionStart;
+          const textBefore = textarea.value.substring(0, cursorPos);
+          const textAfter = textarea.value.substring(cursorPos);
+
           try {
-            const cursorPos = textarea.selectionStart;
-            const textBefore = textarea.value.substring(0, cursorPos);
-            const textAfter = textarea.value.substring(cursorPos);
             textarea.value = textBefore + "[Uploading image...]" + textAfter;
             
             const response = await fetch('/upload_image', {
               method: 'POST',
-              body: formData,
+              headers: {
+                'Content-Type': file.type || 'application/octet-stream',
+                // pasted images belong to this browser tab until the note is saved
+                'X-Kurup-Client': window.clientId,
+              },
+              body: file,
             });
             
             const result = await response.json();
+            if (!response.ok) {
+              throw new Error(result.error || response.statusText);
+            }
             const imageUrl = result.url;
             
             const markdownSyntax = `![pasted image](${imageUrl})`;
@@ -80,7 +87,7 @@ document.addEventListener('DOMContentLoaded', () => {
             console.error('Image upload failed', err);
             
             // upload failed
-            textarea.value = textBefore + "[Image upload failed]" + textAfter;
+            textarea.value = textBefore + `[Image upload failed: ${err.message}]` + textAfter;
             textarea.dispatchEvent(new Event('input', { bubbles: true }));
           }
           
@@ -0,0 +1,148 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from utils import atomic_write
+from utils.atomic_write import TEMP_SUFFIX, WriteBatch, get_journal_dir, recover
+from utils.metadata_store import LogMetadataStore
+
+
+class Killed(BaseException):
+    """Stands in for the process being killed."""
+
+
+@pytest.fixture
+def crash_before_apply(monkeypatch):
+    """Makes committing a batch stop after its journal was written, like a killed process."""
+    def apply(*args, **kwargs):
+        raise Killed()
+    monkeypatch.setattr(atomic_write, "_apply", apply)
+
+
+def test_commit_applies_all_changes(tmp_path):
+    (tmp_path / "old.md").write_text("old")
+    with WriteBatch(get_journal_dir(tmp_path)) as batch:
+        batch.write_text(tmp_path / "a.md", "a")
+        batch.delete(tmp_path / "old.md")
+        batch.append_text(tmp_path / "log.jsonl", "1\n")
+        batch.append_text(tmp_path / "log.jsonl", "2\n")
+
+    assert (tmp_path / "a.md").read_text() == "a"
+    assert not (tmp_path / "old.md").exists()
+    assert (tmp_path / "log.jsonl").read_text() == "1\n2\n"
+    assert list(get_journal_dir(tmp_path).iterdir()) == []
+    assert list(tmp_path.glob(f".*{TEMP_SUFFIX}")) == []
+
+
+def test_recover_finishes_interrupted_batch(tmp_path, monkeypatch, crash_before_apply):
+    (tmp_path / "a.md").write_text("old")
+    (tmp_path / "gone.md").write_text("gone")
+    (tmp_path / "log.jsonl").write_text("1\n")
+    with pytest.raises(Killed):
+        with WriteBatch(get_journal_dir(tmp_path)) as batch:
+            batch.write_text(tmp_path / "a.md", "new")
+            batch.write_text(tmp_path / "b.md", "b")
+            batch.delete(tmp_path / "gone.md")
+            batch.append_text(tmp_path / "log.jsonl", "2\n")
+    assert (tmp_path / "a.md").read_text() == "old"
+    monkeypatch.undo()
+
+    assert recover(tmp_path) == 1
+    assert (tmp_path / "a.md").read_text() == "new"
+    assert (tmp_path / "b.md").read_text() == "b"
+    assert not (tmp_path / "gone.md").exists()
+    assert (tmp_path / "log.jsonl").read_text() == "1\n2\n"
+    assert list(get_journal_dir(tmp_path).iterdir()) == []
+    assert list(tmp_path.glob(f".*{TEMP_SUFFIX}")) == []
+    assert recover(tmp_path) == 0
+
+
+def test_recover_discards_batch_without_journal(tmp_path, monkeypatch):
+    (tmp_path / "a.md").write_text("old")
+
+    def write_journal(self, renames):
+        raise Killed()
+    monkeypatch.setattr(WriteBatch, "_write_journal", write_journal)
+    with pytest.raises(Killed):
+        with WriteBatch(get_journal_dir(tmp_path)) as batch:
+            batch.write_text(tmp_path / "a.md", "new")
+    monkeypatch.undo()
+
+    # the temporary file is removed when the journal could not be written
+    assert list(tmp_path.glob(f".*{TEMP_SUFFIX}")) == []
+    leftover = tmp_path / f".b.md.12345678{TEMP_SUFFIX}"
+    leftover.write_text("b")
+    assert recover(tmp_path) == 0
+    assert not leftover.exists()
+    assert (tmp_path / "a.md").read_text() == "old"
+
+
+def test_recover_ignores_broken_journal(tmp_path):
+    journal_dir = get_journal_dir(tmp_path)
+    journal_dir.mkdir(parents=True)
+    (journal_dir / "torn.json").write_text('{"renames": [["/tmp/x", ')
+    (journal_dir / "incomplete.json").write_text('{"renames": []}')
+
+    assert recover(tmp_path) == 0
+    assert list(journal_dir.iterdir()) == []
+
+
+def test_recovered_append_starts_after_torn_line(tmp_path, monkeypatch, crash_before_apply):
+    store = LogMetadataStore(tmp_path)
+    store.put("a.md", ["old.png"], ["old"])
+    with pytest.raises(Killed):
+        with WriteBatch(get_journal_dir(tmp_path)) as batch:
+            (tmp_path / "a.md").write_text("new")
+            store.put("a.md", ["new.png"], ["new"], batch)
+    store.close()
+    monkeypatch.undo()
+    # a line torn by the crash, while appending outside of the batch
+    with open(store.path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 99, "filen')
+
+    assert recover(tmp_path) == 1
+    store = LogMetadataStore(tmp_path)
+    try:
+        assert store.get("a.md") == {"images": ["new.png"], "tags": ["new"]}
+    finally:
+        store.close()
+
+
+def test_failed_batch_leaves_metadata_unchanged(tmp_path):
+    store = LogMetadataStore(tmp_path)
+    store.put("a.md", ["a.png"], ["a"])
+    with pytest.raises(RuntimeError):
+        with WriteBatch(get_journal_dir(tmp_path)) as batch:
+            store.put("a.md", ["b.png"], ["b"], batch)
+            store.delete("c.md", batch)
+            raise RuntimeError()
+    assert store.get("a.md") == {"images": ["a.png"], "tags": ["a"]}
+    store.close()
+    store = LogMetadataStore(tmp_path)
+    assert store.get("a.md") == {"images": ["a.png"], "tags": ["a"]}
+    store.close()
+
+
+def test_batch_which_is_not_durable_writes_no_journal(tmp_path, monkeypatch):
+    def write_journal(self, renames):
+        raise AssertionError("journal written")
+    monkeypatch.setattr(WriteBatch, "_write_journal", write_journal)
+    with WriteBatch(get_journal_dir(tmp_path), durable=False) as batch:
+        batch.write_text(tmp_path / "a.md", "a")
+    assert (tmp_path / "a.md").read_text() == "a"
@@ -0,0 +1,73 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from utils.notes_handler import NotesHandler
+
+
+def search(handler, query):
+    return [note.filename for note in handler.search(query)]
+
+
+@pytest.fixture
+def notes_dir(tmp_path):
+    for i in range(5):
+        (tmp_path / f"note{i}.md").write_text(f"# Note {i}\nshared words and number{i}")
+    handler = NotesHandler()
+    handler.load_index(tmp_path)
+    handler.load_search_index()
+    handler.close()
+    return tmp_path
+
+
+def test_search_index_is_restored_from_its_snapshot(notes_dir):
+    handler = NotesHandler()
+    handler.load_index(notes_dir)
+    assert handler.store.search_state_path.exists()
+    assert sorted(search(handler, "shared")) == [f"note{i}.md" for i in range(5)]
+    handler.close()
+
+
+def test_snapshot_is_updated_with_notes_changed_while_closed(notes_dir):
+    (notes_dir / "note1.md").write_text("# Note 1\nrewritten")
+    (notes_dir / "note2.md").unlink()
+    (notes_dir / "note5.md").write_text("# Note 5\nshared words and number5")
+
+    handler = NotesHandler()
+    handler.load_index(notes_dir)
+    assert search(handler, "number1") == []
+    assert search(handler, "rewritten") == ["note1.md"]
+    assert sorted(search(handler, "shared")) == ["note0.md", "note3.md", "note4.md", "note5.md"]
+    handler.close()
+
+
+def test_notes_changed_after_the_snapshot_was_written_are_updated(notes_dir):
+    handler = NotesHandler()
+    handler.load_index(notes_dir)
+    handler.load_search_index()
+    (notes_dir / "note3.md").write_text("# Note 3\nchanged")
+    handler.update_notes_list(notes_dir)
+    # the database was committed, but the process ended before the snapshot was written
+    handler.store.close()
+
+    handler = NotesHandler()
+    handler.load_index(notes_dir)
+    assert search(handler, "changed") == ["note3.md"]
+    assert search(handler, "number3") == []
+    handler.close()
@@ -0,0 +1,60 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from utils import search_index
+from utils.search_index import SearchIndex
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    for i in range(100):
+        # few distinct scores, so pages have to break ties by id
+        index.add(f"n{i:03}.md", f"note {i}", "apple " * (i % 4 + 1) + "applesauce pineapple", [])
+    return index
+
+
+def test_pages_match_the_full_ranking(index):
+    ranking = index.search("apple")
+    assert len(ranking) == 100
+    for offset in range(0, 100, 7):
+        ids, total, complete = index.search_page("apple", offset, 7)
+        assert ids == ranking[offset:offset + 7]
+        assert total == 100 and complete
+
+
+def test_tag_filters_only_are_ordered_by_id():
+    index = SearchIndex()
+    for name in ("c.md", "a.md", "b.md"):
+        index.add(name, "", "text", ["Work"])
+    assert index.search_page("tag:work", 1, 1) == (["b.md"], 3, True)
+
+
+def test_expansion_beyond_the_budget_is_reported(index, monkeypatch):
+    monkeypatch.setattr(search_index, "MAX_EXPANSION_POSTINGS", 250)
+    index.add("extra.md", "", "applet", [])
+    # the exact match is always used, the prefix and substring matches fit the budget
+    ids, total, complete = index.search_page("apple", 0, None)
+    assert total == 101 and complete
+    monkeypatch.setattr(search_index, "MAX_EXPANSION_POSTINGS", 50)
+    # the closest expansion is used even above the budget, the others are not
+    ids, total, complete = index.search_page("appl", 0, 10)
+    assert len(ids) == 10 and total == 100 and not complete
+    assert "extra.md" not in index.search("appl")
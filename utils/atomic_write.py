@@ -0,0 +1,271 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+
+# kurup
+from utils.index_store import KURUP_DIR_NAME
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+TEMP_SUFFIX = ".kurup-tmp"
+
+
+def get_journal_dir(notes_dir):
+    """Returns the directory holding the journals of unfinished write batches."""
+    return notes_dir / KURUP_DIR_NAME / "journal"
+
+
+def _temp_path(path):
+    # hidden, so notes scans and the watcher ignore it
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}{TEMP_SUFFIX}")
+
+
+def _write_temp(path, text, sync):
+    tmp_path = _temp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+    return tmp_path
+
+
+def _fsync_file(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # directories cannot be opened on every platform
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_text(path, text):
+    """
+    Replaces a text file atomically, readers see either the old or the new content.
+
+    Parameters
+    ----------
+    path : Path
+        The file to write.
+    text : str
+        The new content, written as UTF-8.
+    """
+    tmp_path = _write_temp(path, text, sync=True)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+
+
+class WriteBatch():
+    """
+    Writes and deletes several files as one unit, e.g. a note together with its metadata.
+
+    All new contents are first written to temporary files and made durable, then a journal
+    listing the pending renames, deletes and appends is written. If the process is killed
+    while applying them, `recover` finishes the batch on the next start, so either all or
+    none of the files of a batch are changed.
+
+    Use as context manager, the batch is committed when the block exits without an error::
+
+        with WriteBatch(get_journal_dir(notes_dir)) as batch:
+            batch.write_text(note_path, content)
+            batch.write_text(metadata_path, metadata)
+
+    Parameters
+    ----------
+    journal_dir : Path
+        The directory for the journal of this batch.
+    durable : bool, optional
+        If False, nothing is synced to disk and no journal is written. For files which can be
+        rebuilt after a crash, e.g. metadata created for notes without it.
+    """
+
+    def __init__(self, journal_dir, durable=True):
+        self.journal_dir = journal_dir
+        self.durable = durable
+        self._writes = {}
+        self._deletes = []
+        self._appends = {}
+        self._callbacks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+    def __len__(self):
+        return len(self._writes) + len(self._deletes) + len(self._appends)
+
+    def write_text(self, path, text):
+        """Schedules writing a text file, replacing a previously scheduled write of the same file."""
+        self._writes[Path(path)] = text
+
+    def delete(self, path):
+        """Schedules deleting a file, missing files are ignored."""
+        self._deletes.append(Path(path))
+
+    def append_text(self, path, text):
+        """
+        Schedules appending lines of text to a file, all appends to the same file are written
+        at once and start on a new line.
+
+        The text is kept in the journal, a recovered batch may append it a second time if the
+        process was killed right after appending. Only for files where that is harmless, e.g.
+        a log in which the last line of a key wins.
+        """
+        self._appends.setdefault(Path(path), []).append(text)
+
+    def on_commit(self, callback):
+        """Registers a function called after the batch was committed."""
+        self._callbacks.append(callback)
+
+    def commit(self):
+        """Writes all scheduled changes."""
+        if self._writes or self._deletes or self._appends:
+            self._commit()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _commit(self):
+        renames = []
+        journal_path = None
+        try:
+            for path, text in self._writes.items():
+                renames.append((_write_temp(path, text, sync=False), path))
+            if self.durable:
+                # all files are written before the first is synced, so they reach the disk together
+                for tmp_path, _ in renames:
+                    _fsync_file(tmp_path)
+                for directory in {path.parent for _, path in renames}:
+                    _fsync_dir(directory)
+                journal_path = self._write_journal(renames)
+        except BaseException:
+            for tmp_path, _ in renames:
+                tmp_path.unlink(missing_ok=True)
+            raise
+
+        _apply(renames, self._deletes, self._get_appends(), sync=self.durable)
+        if journal_path is not None:
+            journal_path.unlink(missing_ok=True)
+        self._writes = {}
+        self._deletes = []
+        self._appends = {}
+
+    def _write_journal(self, renames):
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        journal = {
+            "renames": [[str(tmp_path), str(path)] for tmp_path, path in renames],
+            "deletes": [str(path) for path in self._deletes],
+            "appends": [[str(path), text] for path, text in self._get_appends()],
+        }
+        journal_path = self.journal_dir / f"{uuid.uuid4().hex}.json"
+        tmp_path = _write_temp(journal_path, json.dumps(journal), sync=True)
+        os.replace(tmp_path, journal_path)
+        _fsync_dir(self.journal_dir)
+        return journal_path
+
+    def _get_appends(self):
+        return [(path, "".join(texts)) for path, texts in self._appends.items()]
+
+
+def _apply(renames, deletes, appends=(), sync=True):
+    directories = set()
+    for tmp_path, path in renames:
+        if tmp_path.exists():
+            os.replace(tmp_path, path)
+        directories.add(path.parent)
+    for path in deletes:
+        path.unlink(missing_ok=True)
+        directories.add(path.parent)
+    for path, text in appends:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a+b") as f:
+            # after a crash the file may end in a torn line
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(text.encode("utf-8"))
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        directories.add(path.parent)
+    if sync:
+        for directory in directories:
+            _fsync_dir(directory)
+
+
+def recover(notes_dir):
+    """
+    Finishes write batches interrupted by a crash and removes leftover temporary files.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+
+    Returns
+    -------
+    int
+        The number of finished batches.
+    """
+    journal_dir = get_journal_dir(notes_dir)
+    recovered = 0
+    if journal_dir.is_dir():
+        for journal_path in sorted(journal_dir.glob("*.json")):
+            try:
+                journal = json.loads(journal_path.read_text(encoding="utf-8"))
+                renames = [(Path(tmp), Path(path)) for tmp, path in journal["renames"]]
+                deletes = [Path(path) for path in journal["deletes"]]
+                appends = [(Path(path), text) for path, text in journal.get("appends", [])]
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Ignoring broken write journal {journal_path}: {e}")
+            else:
+                _apply(renames, deletes, appends)
+                recovered += 1
+                logger.info(f"Finished interrupted write of {len(renames) + len(appends)} files from {journal_path.name}")
+            journal_path.unlink(missing_ok=True)
+
+    # temporary files of batches which never reached their journal
+    for directory in (notes_dir, journal_dir):
+        if not directory.is_dir():
+            continue
+        for tmp_path in directory.glob(f".*{TEMP_SUFFIX}"):
+            logger.info(f"Removing unfinished write {tmp_path.name}")
+            tmp_path.unlink(missing_ok=True)
+    return recovered
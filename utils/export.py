@@ -0,0 +1,119 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import logging
+import zipfile
+
+# kurup
+from utils.metrics import timed
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+# bytes read from a file and handed to the response at a time
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkWriter(io.RawIOBase):
+    # a write-only, non-seekable file, so zipfile streams entries with data descriptors
+    # instead of seeking back to fill in their sizes
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        # yields nothing for an empty buffer, an empty chunk would end a chunked response
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            yield data
+
+
+def iter_zip_export(notes, notes_dir, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields a zip archive of notes and their images piece by piece, without a temporary file.
+
+    The archive has the layout of a single note download, notes and images side by side.
+    Images shared by several notes are added once. Notes are compressed, images are stored
+    as they are. Memory use does not depend on the size of the archive.
+
+    Parameters
+    ----------
+    notes : iterable of NoteRecord
+        The notes to export.
+    notes_dir : Path
+        The directory where the notes and images are stored.
+    chunk_size : int, optional
+        Number of bytes read from a file at a time.
+
+    Yields
+    ------
+    bytes
+        The next part of the zip archive.
+    """
+    writer = _ChunkWriter()
+    added_images = set()
+    note_count = 0
+    # includes the time the response waits for the client to receive the archive
+    with timed("export"), zipfile.ZipFile(writer, "w") as zipf:
+        for note in notes:
+            yield from _iter_file(zipf, notes_dir / note.filename, note.filename, zipfile.ZIP_DEFLATED, chunk_size, writer)
+            if note.filename not in zipf.NameToInfo:
+                continue
+            note_count += 1
+            for img in note.image_refs:
+                if img in added_images:
+                    continue
+                added_images.add(img)
+                yield from _iter_file(zipf, notes_dir / img, img, zipfile.ZIP_STORED, chunk_size, writer)
+    # the central directory is written when the archive is closed
+    yield from writer.drain()
+    logger.info(f"Exported {note_count} notes and {len(added_images)} images")
+
+
+def _iter_file(zipf, path, arcname, compress_type, chunk_size, writer):
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        # deleted since the notes were listed
+        logger.warning(f"Skipping {arcname}, it no longer exists")
+        return
+    with f:
+        info = zipfile.ZipInfo.from_file(path, arcname)
+        info.compress_type = compress_type
+        # the size is known up front, so zip64 is only used for files which need it
+        with zipf.open(info, "w") as entry:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                entry.write(chunk)
+                yield from writer.drain()
@@ -0,0 +1,169 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+from urllib.parse import parse_qs, unquote
+
+# kurup
+from utils.image_handler import SHA256_HEX_PATTERN
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+# a year, the longest max-age browsers honour
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+FINGERPRINT_LENGTH = 12
+
+
+def get_content_digest(filename):
+    """Returns the content hash a file is named by, or None if it is not named by its content."""
+    stem, _, suffix = filename.partition(".")
+    if suffix and "/" not in filename and SHA256_HEX_PATTERN.fullmatch(stem):
+        return stem
+    return None
+
+
+def is_not_modified(if_none_match, etag):
+    """Checks if the If-None-Match header of a request matches an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags
+
+
+class StaticAssets():
+    """
+    Creates fingerprinted URLs of static files, e.g. ``/static/app.js?v=1a2b3c4d5e6f``.
+
+    The fingerprint is derived from the file content, so the URL changes whenever the file
+    changes and browsers may cache it forever. Fingerprints are recomputed only when the
+    modification time or size of a file changes.
+
+    Parameters
+    ----------
+    directory : Path
+        The directory of the static files.
+    url_path : str, optional
+        The URL the directory is served at.
+    """
+
+    def __init__(self, directory, url_path="/static"):
+        self.directory = directory
+        self.url_path = url_path.rstrip("/")
+        self._fingerprints = {}
+
+    def url(self, name):
+        """Returns the fingerprinted URL of a static file, or the plain URL if it does not exist."""
+        path = self.directory / name
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            logger.warning(f"Static file {path} not found")
+            return f"{self.url_path}/{name}"
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._fingerprints.get(name)
+        if cached is None or cached[0] != stamp:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()[:FINGERPRINT_LENGTH]
+            cached = (stamp, digest)
+            self._fingerprints[name] = cached
+        return f"{self.url_path}/{name}?v={cached[1]}"
+
+
+class CacheHeadersMiddleware():
+    """
+    ASGI middleware adding long-lived cache headers to files which never change under their URL.
+
+    - Static files requested with a fingerprint (``?v=...``, see `StaticAssets`) are marked immutable.
+    - Images named by the hash of their content get a strong ETag derived from that hash and are
+      marked immutable. Requests revalidating such an image are answered with 304 Not Modified
+      without opening the file.
+
+    Parameters
+    ----------
+    app : ASGI application
+        The wrapped application.
+    static_url : str
+        The URL static files are served at.
+    image_dirs : dict
+        Maps the URLs images are served at to their directories.
+    """
+
+    def __init__(self, app, static_url, image_dirs):
+        self.app = app
+        self.static_prefix = static_url.rstrip("/") + "/"
+        self.image_dirs = {url.rstrip("/") + "/": directory for url, directory in image_dirs.items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        headers = None
+        if path.startswith(self.static_prefix):
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            if "v" in query:
+                headers = {b"cache-control": IMMUTABLE_CACHE_CONTROL.encode()}
+        else:
+            headers = await self._image_headers(scope, send, path)
+            if headers is False:
+                # answered with 304
+                return
+
+        if headers is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message["headers"] = [
+                    (key, value) for key, value in message.get("headers", []) if key not in headers
+                ] + list(headers.items())
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    async def _image_headers(self, scope, send, path):
+        for prefix, directory in self.image_dirs.items():
+            if not path.startswith(prefix):
+                continue
+            filename = unquote(path[len(prefix):])
+            digest = get_content_digest(filename)
+            if digest is None:
+                return None
+            etag = f'"{digest}"'
+            headers = {b"etag": etag.encode(), b"cache-control": IMMUTABLE_CACHE_CONTROL.encode()}
+            if_none_match = _get_header(scope, b"if-none-match")
+            if is_not_modified(if_none_match, etag) and (directory / filename).is_file():
+                await send({"type": "http.response.start", "status": 304, "headers": list(headers.items())})
+                await send({"type": "http.response.body", "body": b""})
+                return False
+            return headers
+        return None
+
+
+def _get_header(scope, name):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
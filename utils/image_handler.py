@@ -16,13 +16,37 @@
 # You should have received a copy of the GNU General Public License
 # along with kurup. If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
+import os
 import re
 import shutil
 import logging
+import uuid
+
+# kurup
+from utils import md_refs
+from utils.atomic_write import TEMP_SUFFIX
 
 # logging
 logger = logging.getLogger("kurup_logger") 
 
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# uploads are written to disk in blocks of this size
+UPLOAD_WRITE_SIZE = 1024 * 1024
+
+# leading bytes of the accepted image formats and their file extensions
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+)
+SNIFF_SIZE = 16
+
+SHA256_HEX_PATTERN = re.compile(r"[0-9a-f]{64}")
+
 def get_image_refs(note_area_val, directory):
     """    
     Extracts image references from markdown text that point to a specific directory.
@@ -31,22 +55,205 @@ def get_image_refs(note_area_val, directory):
     ----------
     note_area_val : str
         The markdown text containing image references.
-    directory : str
-        The directory to search for in image references.
+    directory : str or Path
+        The directory to search for in image references, only its name is used.
 
     Returns
     -------
     refs : list of str
         A list of image filenames referenced in the markdown text, with the directory portion removed.
     """
-    pattern = rf"!\[.*?\]\((\/{directory}\/[^)]+)\)"
-    refs = [match.replace(f'/{directory}/', '') for match in re.findall(pattern, note_area_val)]
-    return refs
+    return [ref.filename for ref in md_refs.find_images(note_area_val, directory)]
+
+def get_file_hash(path):
+    """
+    Computes the SHA-256 hex digest of a file, reading it in chunks.
+
+    Parameters
+    ----------
+    path : Path
+        The file to hash.
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_blob_name(digest, suffix):
+    """Returns the content-addressed filename of an image, its hash with the original extension."""
+    return f"{digest}{suffix.lower()}"
 
-def save_images(current_note_area_val, notes_dir, temp_dir):
+def store_image(source, notes_dir, digest=None, keep_source=False, suffix=None):
+    """
+    Moves an image into the content-addressed image store of the notes directory.
+
+    Images are named by the hash of their content, so an image which is already stored
+    is not copied again and the source is just removed.
+
+    Parameters
+    ----------
+    source : Path
+        The image to store, it is moved or removed.
+    notes_dir : Path
+        The directory where images are permanently saved.
+    digest : str, optional
+        The SHA-256 hex digest of the image, computed if not given.
+    keep_source : bool, optional
+        Copy the image instead of moving it, e.g. while another note still uses the source.
+    suffix : str, optional
+        The file extension of the stored image, the extension of `source` by default.
+
+    Returns
+    -------
+    str
+        The filename of the stored image.
+    """
+    if digest is None:
+        digest = get_file_hash(source)
+    filename = get_blob_name(digest, source.suffix if suffix is None else suffix)
+    destination = notes_dir / filename
+    if destination.exists():
+        logger.info(f"Image {source.name} is already stored as {filename}")
+        if not keep_source:
+            source.unlink(missing_ok=True)
+    else:
+        logger.info(f"Moving {source.name} from {source} to {destination}")
+        tmp_destination = notes_dir / f".{filename}{TEMP_SUFFIX}"
+        if keep_source:
+            shutil.copy2(source, tmp_destination)
+        else:
+            shutil.move(source, tmp_destination)
+        # appears under its final name only once it is complete
+        os.replace(tmp_destination, destination)
+    return filename
+
+def sniff_image_type(header):
+    """
+    Detects the format of an image from its first bytes, ignoring what the client claims.
+
+    Parameters
+    ----------
+    header : bytes
+        At least the first `SNIFF_SIZE` bytes of the file.
+
+    Returns
+    -------
+    str or None
+        The file extension of the image format, None if it is not an accepted image.
+    """
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    if header[4:12] in (b"ftypavif", b"ftypavis"):
+        return ".avif"
+    return None
+
+class UploadRejected(Exception):
+    """
+    Raised when an uploaded image is not accepted.
+
+    Parameters
+    ----------
+    status_code : int
+        The HTTP status code for the response.
+    message : str
+        The reason shown to the user.
+    """
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+async def receive_image(chunks, temp_dir, max_size, storage):
+    """
+    Streams an uploaded image into the temp directory.
+
+    The image is hashed and written block by block in worker threads while it is received,
+    it is never held in memory as a whole. The file is named by the hash of its content.
+
+    Parameters
+    ----------
+    chunks : async iterable of bytes
+        The request body.
+    temp_dir : Path
+        The directory where uploaded images are stored temporarily.
+    max_size : int
+        Maximum size of the image in bytes.
+    storage : Storage
+        Runs the file operations.
+
+    Returns
+    -------
+    str
+        The filename of the image in `temp_dir`.
+
+    Raises
+    ------
+    UploadRejected
+        If the image is too large, empty or not in an accepted format.
+    """
+    digest = hashlib.sha256()
+    extension = None
+    size = 0
+    pending = bytearray()
+    part_path = temp_dir / f".upload-{uuid.uuid4().hex}{TEMP_SUFFIX}"
+    part_file = None
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            size += len(chunk)
+            if size > max_size:
+                raise UploadRejected(413, f"Image is larger than {max_size // (1024 * 1024)} MB")
+            digest.update(chunk)
+            pending += chunk
+            if extension is None:
+                if len(pending) < SNIFF_SIZE:
+                    continue
+                extension = sniff_image_type(bytes(pending[:SNIFF_SIZE]))
+                if extension is None:
+                    raise UploadRejected(415, "Only PNG, JPEG, GIF, WebP, AVIF and BMP images can be pasted")
+            if len(pending) >= UPLOAD_WRITE_SIZE:
+                if part_file is None:
+                    part_file = await storage.run(open, part_path, "wb")
+                await storage.run(part_file.write, bytes(pending))
+                pending.clear()
+
+        if extension is None:
+            extension = sniff_image_type(bytes(pending))
+            if extension is None:
+                raise UploadRejected(415 if size else 400, "The upload is not an image")
+        if part_file is None:
+            part_file = await storage.run(open, part_path, "wb")
+        if pending:
+            await storage.run(part_file.write, bytes(pending))
+        await storage.run(part_file.close)
+        part_file = None
+
+        filename = get_blob_name(digest.hexdigest(), extension)
+        # identical uploads share one temp file
+        await storage.run(os.replace, part_path, temp_dir / filename)
+        logger.info(f"Received image {filename} ({size} bytes)")
+        return filename
+    finally:
+        if part_file is not None:
+            await storage.run(part_file.close)
+        await storage.run(part_path.unlink, missing_ok=True)
+
+def save_images(current_note_area_val, notes_dir, temp_dir, in_use=None):
     """
     Saves images from a temp_dir to a notes_dir and updates image references in the entered text.
 
+    Images are stored content-addressed, see `store_image`, identical images are stored once.
+
     Parameters
     ----------
     current_note_area_val : str
@@ -55,34 +262,45 @@ def save_images(current_note_area_val, notes_dir, temp_dir):
         The directory where images should be permanently saved.
     temp_dir : str
         The directory where images are temporarily saved.
+    in_use : callable, optional
+        Called with the filename of a temp image, images for which it returns True are
+        copied instead of moved, because another unsaved note references them as well.
 
     Returns
     -------
     updated_text : str
         The text with updated image references pointing to the permanent location.
     img_list : list of str
-        A list of filenames of the images that were moved.
+        A list of filenames of the stored images referenced by the text.
     """
-    pattern = rf"!\[(.*?)\]\(/({temp_dir.name})/([^)]+)\)"
     img_list = []
-    updated_text = current_note_area_val
-
-    for match in re.finditer(pattern, current_note_area_val):
-        alt_text = match.group(1)
-        #temp_subdir = match.group(2) # same as temp_dir
-        filename = match.group(3)
-
-        source = temp_dir / filename
-        destination = notes_dir / filename
+    stored = {}
 
-        logger.info(f"Moving {filename} from {source} to {destination}")
-        shutil.move(source, destination)
+    def replace(ref):
+        filename = ref.filename
+        # the same temp image may be referenced more than once
+        if filename not in stored:
+            source = temp_dir / filename
+            # uploads are named by their hash, see receive_image
+            digest = source.stem if SHA256_HEX_PATTERN.fullmatch(source.stem) else None
+            if source.exists():
+                keep_source = in_use is not None and in_use(filename)
+                stored[filename] = store_image(source, notes_dir, digest, keep_source)
+            elif digest and (notes_dir / filename).exists():
+                # the same image was already saved with another note
+                stored[filename] = filename
+            else:
+                logger.warning(f"Referenced temp image does not exist: {source}")
+                return None
+        blob_name = stored[filename]
 
-        old_ref = match.group(0)
-        new_ref = f"![{alt_text}](/{notes_dir.name}/{filename})"
+        if blob_name not in img_list:
+            img_list.append(blob_name)
+        return f"![{ref.text}](/{notes_dir.name}/{blob_name})"
 
-        img_list.append(filename)
-        updated_text = updated_text.replace(old_ref, new_ref)
+    # all references are replaced in one pass over the text
+    refs = md_refs.find_images(current_note_area_val, temp_dir)
+    updated_text = md_refs.rewrite(current_note_area_val, refs, replace)
 
     return updated_text, img_list
 
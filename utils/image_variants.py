@@ -0,0 +1,252 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional, originals are served without it
+    Image = None
+
+# kurup
+from utils import md_refs
+from utils.atomic_write import TEMP_SUFFIX
+from utils.index_store import KURUP_DIR_NAME
+from utils.metrics import timed
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+VARIANTS_URL = "/variants"
+
+# longest side in pixels of each variant size
+VARIANT_SIZES = {'small': 480, 'large': 1600}
+
+VARIANT_QUALITY = {'webp': 80, 'avif': 60}
+
+# animations would lose all but their first frame
+SKIPPED_SUFFIXES = ('.gif', '.svg')
+
+
+def get_variants_dir(notes_dir):
+    """Returns the directory where image variants are cached."""
+    return notes_dir / KURUP_DIR_NAME / "variants"
+
+
+def use_variants(content, directories, size="small"):
+    """
+    Rewrites the images of markdown content to show a downscaled variant, linked to the original.
+
+    Parameters
+    ----------
+    content : str
+        The markdown content.
+    directories : collection of str
+        URL directories of images to rewrite, e.g. ``{'notes', 'temp'}``.
+    size : str, optional
+        One of the keys of `VARIANT_SIZES`.
+
+    Returns
+    -------
+    str
+        The content with ``![alt](/notes/x.png)`` replaced by
+        ``[![alt](/variants/small/notes/x.png)](/notes/x.png)``.
+    """
+    def replace(ref):
+        directory, _, filename = ref.target[1:].partition("/")
+        if (
+            ref.kind != "image"
+            # already linked, e.g. rewritten before
+            or content[ref.start - 1:ref.start] == "["
+            or directory not in directories
+            or not ref.is_in(directory)
+            or filename.lower().endswith(SKIPPED_SUFFIXES)
+        ):
+            return None
+        original = f"/{directory}/{filename}"
+        return f"[![{ref.text}]({VARIANTS_URL}/{size}{original})]({original})"
+
+    return md_refs.rewrite(content, md_refs.find_images(content), replace)
+
+
+class ImageVariants():
+    """
+    Creates and caches downscaled WebP (and optionally AVIF) variants of note images in a worker pool.
+
+    Variants are stored in `get_variants_dir` named after their image. Images are named by
+    their content hash, so a variant stays valid for as long as its image exists. Without
+    Pillow no variants are created and callers fall back to the original images.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+    formats : tuple of str, optional
+        Variant formats in order of preference, "webp" and/or "avif".
+        Formats not supported by the installed Pillow are left out.
+    max_workers : int, optional
+        Number of worker threads encoding images.
+
+    Attributes
+    ----------
+    formats : tuple of str
+        The formats variants are created in, empty if Pillow is not installed.
+    hits, misses : int
+        Number of variants requested with `get` which existed and which had to be created first.
+    """
+
+    def __init__(self, notes_dir, formats=("webp",), max_workers=2):
+        self.variants_dir = get_variants_dir(notes_dir)
+        if Image is None:
+            logger.info("Pillow is not installed, images are served at full size")
+            self.formats = ()
+        else:
+            self.formats = tuple(fmt for fmt in formats if features.check(fmt))
+            for fmt in set(formats) - set(self.formats):
+                logger.warning(f"Pillow cannot encode {fmt}, no {fmt} image variants are created")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kurup-images")
+        self._pending = {}
+        # (filename, size, fmt) of variants which failed or would be larger than their image
+        self._skipped = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, filename, size, fmt):
+        """Returns the path of a variant, whether it exists or not."""
+        return self.variants_dir / size / f"{filename}.{fmt}"
+
+    def select_format(self, accept):
+        """Returns the preferred format accepted by a browser, given its Accept header, or None."""
+        for fmt in self.formats:
+            if f"image/{fmt}" in accept:
+                return fmt
+        return None
+
+    def rewrite(self, content, directories, size="small"):
+        """Applies `use_variants` to markdown content, unless no variants can be created."""
+        if not self.formats:
+            return content
+        return use_variants(content, directories, size)
+
+    def submit(self, source, fmt):
+        """
+        Creates all sizes of a variant of an image in the worker pool.
+
+        Parameters
+        ----------
+        source : Path
+            The image.
+        fmt : str
+            One of `formats`.
+
+        Returns
+        -------
+        concurrent.futures.Future or None
+            Done once the variants were written, None if the image has no variants.
+        """
+        if fmt not in self.formats or source.suffix.lower() in SKIPPED_SUFFIXES:
+            return None
+        key = (source.name, fmt)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._create, source, fmt)
+                self._pending[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+        return future
+
+    def submit_all(self, source):
+        """Creates the variants of an image in every format in the worker pool, e.g. after an upload."""
+        for fmt in self.formats:
+            self.submit(source, fmt)
+
+    async def get(self, source, size, fmt):
+        """
+        Returns the path of a variant, waiting for it to be created if needed.
+
+        Parameters
+        ----------
+        source : Path
+            The image.
+        size : str
+            One of the keys of `VARIANT_SIZES`.
+        fmt : str
+            One of `formats`.
+
+        Returns
+        -------
+        Path or None
+            The variant, or None if the original image should be used instead.
+        """
+        path = self.get_path(source.name, size, fmt)
+        if path.exists():
+            self.hits += 1
+            return path
+        if (source.name, size, fmt) in self._skipped or not source.is_file():
+            return None
+        self.misses += 1
+        future = self.submit(source, fmt)
+        if future is None:
+            return None
+        await asyncio.wrap_future(future)
+        return path if path.exists() else None
+
+    def shutdown(self):
+        """Stops the worker pool, queued images are dropped."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    @timed("create_variants")
+    def _create(self, source, fmt):
+        # largest first, every smaller size is scaled down from the previous one
+        sizes = sorted(VARIANT_SIZES.items(), key=lambda item: item[1], reverse=True)
+        try:
+            original_size = source.stat().st_size
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image)
+                if image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+                for size, longest_side in sizes:
+                    path = self.get_path(source.name, size, fmt)
+                    image.thumbnail((longest_side, longest_side))
+                    if path.exists() or (source.name, size, fmt) in self._skipped:
+                        continue
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp_path = path.with_name(f".{path.name}{TEMP_SUFFIX}")
+                    image.save(tmp_path, fmt.upper(), quality=VARIANT_QUALITY[fmt])
+                    if tmp_path.stat().st_size >= original_size:
+                        # the image is already small, the original is served instead
+                        tmp_path.unlink()
+                        self._skipped.add((source.name, size, fmt))
+                        continue
+                    os.replace(tmp_path, path)
+            logger.debug(f"Created {fmt} variants of {source.name}")
+        except FileNotFoundError:
+            # moved from the temp directory into the notes while queued
+            pass
+        except Exception as e:
+            logger.warning(f"Could not create {fmt} variants of {source.name}: {e}")
+            self._skipped.update((source.name, size, fmt) for size, _ in sizes)
@@ -0,0 +1,449 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Imports markdown notes and their images from a directory or zip archive, e.g. an Obsidian vault.
+
+Run ``python -m utils.importer SOURCE --notes_dir notes`` while kurup is stopped, or with the
+default sidecar metadata store while it is running. See ``--help`` for all options.
+"""
+
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import sys
+import time
+import uuid
+import zipfile
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import unquote
+
+# kurup
+from utils import md_refs
+from utils.atomic_write import TEMP_SUFFIX
+from utils.image_handler import store_image
+from utils.metadata_store import METADATA_STORES, open_metadata_store
+from utils.notes_handler import write_notes
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+NOTE_SUFFIXES = ('.md', '.markdown')
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.svg', '.avif')
+
+# notes written with one WriteBatch
+IMPORT_BATCH_SIZE = 256
+# below this many notes parsing in worker processes costs more than it saves
+PROCESS_POOL_MIN_NOTES = 64
+COPY_CHUNK_SIZE = 1024 * 1024
+
+FRONT_MATTER_PATTERN = re.compile(r"\A---[ \t]*\r?\n(.*?)\r?\n(?:---|\.\.\.)[ \t]*(?:\r?\n|\Z)", re.DOTALL)
+# the alias of ![[image.png|100x200]] is a size, not an alt text
+SIZE_ALIAS_PATTERN = re.compile(r"\d+(?:x\d+)?")
+URL_SCHEME_PATTERN = re.compile(r"[a-zA-Z][a-zA-Z0-9+.-]*:")
+
+
+def parse_front_matter_tags(content):
+    """
+    Reads the tags of a note from its YAML front matter, without a YAML parser.
+
+    Supports ``tags: [a, b]``, ``tags: a, b``, ``tags: a b`` and a block list of ``- a`` lines,
+    also under the key ``tag``. Leading ``#`` are removed.
+
+    Parameters
+    ----------
+    content : str
+        The markdown content.
+
+    Returns
+    -------
+    list of str
+        The tags in order, without duplicates.
+    """
+    match = FRONT_MATTER_PATTERN.match(content)
+    if not match:
+        return []
+    tags = []
+    lines = match.group(1).splitlines()
+    for i, line in enumerate(lines):
+        key, sep, value = line.partition(":")
+        if not sep or key.strip().lower() not in ("tags", "tag") or line[:1].isspace():
+            continue
+        value = value.strip()
+        if value:
+            is_list = value.startswith("[")
+            value = value.strip("[]")
+            tags.extend(value.split(",") if is_list or "," in value else value.split())
+        else:
+            for item in lines[i + 1:]:
+                stripped = item.strip()
+                if not stripped.startswith("-"):
+                    break
+                tags.append(stripped[1:])
+        break
+    cleaned = (tag.strip().strip("'\"").lstrip("#").strip() for tag in tags)
+    return list(dict.fromkeys(tag for tag in cleaned if tag))
+
+
+def find_image_links(content):
+    """
+    Finds the local image links of a note, Obsidian embeds and markdown images.
+
+    Parameters
+    ----------
+    content : str
+        The markdown content.
+
+    Returns
+    -------
+    list of tuple
+        (start, end, alt text, target) of every link, in order. Targets are URL-decoded paths,
+        links to web images and embedded notes are left out.
+    """
+    links = []
+    for ref in md_refs.find_images(content):
+        if ref.kind == "embed":
+            if not ref.target.lower().endswith(IMAGE_SUFFIXES):
+                # an embedded note
+                continue
+            alias = ref.text.strip()
+            alt_text = alias if alias and not SIZE_ALIAS_PATTERN.fullmatch(alias) else posixpath.basename(ref.target)
+            links.append((ref.start, ref.end, alt_text, ref.target))
+        elif not URL_SCHEME_PATTERN.match(ref.target):
+            # not http:, https:, data: ...
+            links.append((ref.start, ref.end, ref.text, unquote(ref.target)))
+    return links
+
+
+class _DirectorySource():
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def names(self):
+        for root, dirs, files in os.walk(self.path):
+            # hidden folders, e.g. .obsidian, .git or kurup's own .kurup
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            relative_root = Path(root).relative_to(self.path).as_posix()
+            for name in sorted(files):
+                if not name.startswith("."):
+                    yield name if relative_root == "." else f"{relative_root}/{name}"
+
+    def open(self, name):
+        return open(self.path / name, "rb")
+
+    def close(self):
+        pass
+
+
+class _ZipSource():
+
+    def __init__(self, path):
+        self.zipf = zipfile.ZipFile(path)
+
+    def names(self):
+        for info in self.zipf.infolist():
+            parts = info.filename.split("/")
+            if not info.is_dir() and not any(part.startswith(".") for part in parts):
+                yield info.filename
+
+    def open(self, name):
+        return self.zipf.open(name)
+
+    def close(self):
+        self.zipf.close()
+
+
+def _open_source(path):
+    return _ZipSource(path) if zipfile.is_zipfile(path) else _DirectorySource(path)
+
+
+@dataclass
+class ImportResult:
+    """
+    Summary of an import.
+
+    Attributes
+    ----------
+    imported : list of str
+        Filenames of the imported notes.
+    skipped : list of str
+        Notes not imported because a note with the same filename exists.
+    failed : list of str
+        Notes which could not be read.
+    images : int
+        Number of imported images, each stored once.
+    missing_images : list of str
+        Image links which did not match any file of the source.
+    seconds : float
+        Duration of the import.
+    """
+
+    imported: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+    images: int = 0
+    missing_images: list = field(default_factory=list)
+    seconds: float = 0.0
+
+
+# the source opened once by every worker process
+_worker_source = None
+
+
+def _init_worker(source_path):
+    global _worker_source
+    _worker_source = _open_source(source_path)
+
+
+def _parse_note(name, source=None):
+    # runs in a worker process, only picklable values are returned
+    source = source or _worker_source
+    try:
+        with source.open(name) as f:
+            content = f.read().decode("utf-8-sig")
+    except (OSError, UnicodeDecodeError, KeyError) as e:
+        return name, None, str(e), None
+    content = content.replace("\r\n", "\n")
+    return name, content, parse_front_matter_tags(content), find_image_links(content)
+
+
+class _ImageResolver():
+    # finds the file an image link points to, like Obsidian does: relative to the note,
+    # relative to the root of the vault or anywhere by its filename
+
+    def __init__(self, image_names):
+        self.paths = set(image_names)
+        self.by_basename = {}
+        for name in image_names:
+            self.by_basename.setdefault(posixpath.basename(name).lower(), name)
+
+    def resolve(self, note_name, target):
+        target = target.replace("\\", "/")
+        candidates = (
+            posixpath.normpath(posixpath.join(posixpath.dirname(note_name), target)),
+            posixpath.normpath(target.lstrip("/")),
+        )
+        for candidate in candidates:
+            if candidate in self.paths:
+                return candidate
+        return self.by_basename.get(posixpath.basename(target).lower())
+
+
+def _copy_image(source, name, notes_dir):
+    # hashed while copied, the copy is renamed to its content hash by store_image
+    tmp_path = notes_dir / f".import-{uuid.uuid4().hex}{TEMP_SUFFIX}"
+    digest = hashlib.sha256()
+    try:
+        with source.open(name) as src, open(tmp_path, "wb") as dst:
+            while chunk := src.read(COPY_CHUNK_SIZE):
+                digest.update(chunk)
+                dst.write(chunk)
+        return store_image(tmp_path, notes_dir, digest.hexdigest(), suffix=posixpath.splitext(name)[1])
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _get_note_filename(name, taken):
+    # the notes directory is flat, notes of subfolders keep their filename if it is free
+    basename = posixpath.splitext(posixpath.basename(name))[0] + ".md"
+    if basename not in taken:
+        return basename
+    stem = posixpath.splitext(name.replace("/", "_"))[0]
+    candidate = f"{stem}.md"
+    counter = 2
+    while candidate in taken:
+        candidate = f"{stem}_{counter}.md"
+        counter += 1
+    return candidate
+
+
+def import_notes(source_path, notes_dir, metadata=None, workers=None, progress=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports all markdown notes of a directory or zip archive together with their images.
+
+    Notes are parsed in worker processes: front matter tags are read and image links, including
+    Obsidian ``![[...]]`` embeds, are resolved against the images of the source. Images are copied
+    into the content-addressed image store of `notes_dir` in threads, and notes are written in
+    batches with one WriteBatch each, so a crash never leaves half a batch behind. The original
+    markdown is kept except for the rewritten image links.
+
+    Notes whose filename already exists in `notes_dir` are skipped, so an interrupted import
+    can simply be started again.
+
+    Parameters
+    ----------
+    source_path : Path
+        A directory or a zip archive.
+    notes_dir : Path
+        The directory where the notes are stored.
+    metadata : SidecarMetadataStore or LogMetadataStore, optional
+        The store holding the kurup metadata, sidecar files by default.
+    workers : int, optional
+        Number of worker processes parsing notes, the number of CPUs by default.
+    progress : callable, optional
+        Called as ``progress(done, total)`` after every written batch of notes.
+    batch_size : int, optional
+        Number of notes written with one WriteBatch.
+
+    Returns
+    -------
+    ImportResult
+        What was imported, skipped or missing.
+    """
+    started = time.perf_counter()
+    result = ImportResult()
+    source = _open_source(source_path)
+    pool = None
+    try:
+        note_names, image_names = [], []
+        for name in source.names():
+            lower = name.lower()
+            if lower.endswith(NOTE_SUFFIXES):
+                note_names.append(name)
+            elif lower.endswith(IMAGE_SUFFIXES):
+                image_names.append(name)
+        logger.info(f"Importing {len(note_names)} notes and up to {len(image_names)} images from {source_path}")
+
+        resolver = _ImageResolver(image_names)
+        existing = {entry.name for entry in os.scandir(notes_dir)}
+        taken = set(existing)
+        stored = {}
+        workers = workers or os.cpu_count() or 1
+        if len(note_names) >= PROCESS_POOL_MIN_NOTES and workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(str(source_path),))
+            parsed = pool.map(_parse_note, note_names, chunksize=32)
+        else:
+            parsed = (_parse_note(name, source) for name in note_names)
+
+        with ThreadPoolExecutor(max_workers=4) as copy_pool:
+            batch = []
+            for name, content, tags, links in parsed:
+                if content is None:
+                    logger.warning(f"Could not read {name}: {tags}")
+                    result.failed.append(name)
+                    continue
+                if posixpath.splitext(posixpath.basename(name))[0] + ".md" in existing:
+                    # imported before, or another note has the same name
+                    result.skipped.append(name)
+                    continue
+                filename = _get_note_filename(name, taken)
+                taken.add(filename)
+                batch.append((name, filename, content, tags, links))
+                if len(batch) >= batch_size:
+                    _write_batch(batch, source, resolver, stored, copy_pool, notes_dir, metadata, result)
+                    batch = []
+                    if progress:
+                        progress(len(result.imported) + len(result.skipped) + len(result.failed), len(note_names))
+            if batch:
+                _write_batch(batch, source, resolver, stored, copy_pool, notes_dir, metadata, result)
+            if progress:
+                progress(len(note_names), len(note_names))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        source.close()
+
+    result.images = len(set(stored.values()) - {None})
+    result.seconds = time.perf_counter() - started
+    logger.info(
+        f"Imported {len(result.imported)} notes and {result.images} images in {result.seconds:.1f} s, "
+        f"{len(result.skipped)} skipped, {len(result.failed)} failed, {len(result.missing_images)} missing images"
+    )
+    return result
+
+
+def _write_batch(batch, source, resolver, stored, copy_pool, notes_dir, metadata, result):
+    # copy the images of the batch which were not copied for an earlier note
+    new_images = {}
+    for name, _, _, _, links in batch:
+        for _, _, _, target in links:
+            image_name = resolver.resolve(name, target)
+            if image_name is not None and image_name not in stored:
+                new_images[image_name] = None
+    futures = {image_name: copy_pool.submit(_copy_image, source, image_name, notes_dir) for image_name in new_images}
+    for image_name, future in futures.items():
+        try:
+            stored[image_name] = future.result()
+        except OSError as e:
+            logger.warning(f"Could not import image {image_name}: {e}")
+            stored[image_name] = None
+
+    notes = []
+    for name, filename, content, tags, links in batch:
+        parts, images, position = [], [], 0
+        for start, end, alt_text, target in links:
+            image_name = resolver.resolve(name, target)
+            blob_name = stored.get(image_name) if image_name is not None else None
+            if blob_name is None:
+                result.missing_images.append(f"{name}: {target}")
+                continue
+            parts.append(content[position:start])
+            parts.append(f"![{alt_text}](/{notes_dir.name}/{blob_name})")
+            position = end
+            if blob_name not in images:
+                images.append(blob_name)
+        parts.append(content[position:])
+        notes.append((filename, "".join(parts), images, tags))
+    write_notes(notes_dir, notes, metadata)
+    result.imported.extend(filename for filename, _, _, _ in notes)
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog="python -m utils.importer",
+        description="Import markdown notes and images from a directory or zip archive into kurup",
+    )
+    parser.add_argument("source", type=Path, help="directory or zip archive to import, e.g. an Obsidian vault")
+    parser.add_argument("--notes_dir", type=str, default="notes", help="directory where notes are saved")
+    parser.add_argument(
+        "--metadata_store",
+        choices=METADATA_STORES,
+        default="sidecar",
+        help="metadata store used by kurup, see main.py --help",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="number of processes parsing notes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # relative to the kurup directory, like main.py
+    notes_dir = Path(__file__).parent.parent.resolve() / args.notes_dir
+    notes_dir.mkdir(parents=True, exist_ok=True)
+    if not args.source.exists():
+        parser.error(f"{args.source} does not exist")
+
+    def report(done, total):
+        print(f"\r{done}/{total} notes", end="\n" if done == total else "", file=sys.stderr, flush=True)
+
+    metadata = open_metadata_store(notes_dir, args.metadata_store)
+    try:
+        result = import_notes(args.source, notes_dir, metadata, workers=args.workers, progress=report)
+    finally:
+        metadata.close()
+    for missing in result.missing_images:
+        print(f"Missing image {missing}", file=sys.stderr)
+    return 1 if result.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import marshal
+import os
+import sqlite3
+
+# kurup
+from utils.note_record import NoteRecord
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+# bump when the stored note format changes, older databases are discarded
+SCHEMA_VERSION = 3
+
+# hidden directory inside the notes directory for kurup's own files
+KURUP_DIR_NAME = ".kurup"
+
+
+def get_index_path(notes_dir):
+    """
+    Returns the path of the index database for a notes directory.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the markdown notes are stored.
+
+    Returns
+    -------
+    Path
+        The path of the index database.
+    """
+    return notes_dir / KURUP_DIR_NAME / "index.sqlite3"
+
+
+def get_search_state_path(index_path):
+    """
+    Returns the path of the search index snapshot stored next to an index database.
+
+    Parameters
+    ----------
+    index_path : Path
+        The path of the index database.
+
+    Returns
+    -------
+    Path
+        The path of the snapshot file.
+    """
+    return index_path.with_name("search.marshal")
+
+
+def _stamp_from_json(value):
+    md_mtime_ns, md_size, kr_stamp = json.loads(value)
+    return (md_mtime_ns, md_size, tuple(kr_stamp) if kr_stamp is not None else None)
+
+
+def _note_to_json(note):
+    return json.dumps(note.to_row())
+
+
+def _note_from_json(value):
+    return NoteRecord.from_row(json.loads(value))
+
+
+class IndexStore():
+    """
+    Persists the note index and the search terms of every note in a SQLite database,
+    so a restart only has to re-read notes whose file stamps changed.
+
+    The database is a cache: it can be deleted at any time and is rebuilt from the notes.
+    The built search index is kept in a snapshot file next to it, so it does not have to be
+    rebuilt from the search terms of every note on each start.
+
+    Attributes
+    ----------
+    path : Path
+        The path of the database file.
+    search_state_path : Path
+        The path of the search index snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.search_state_path = get_search_state_path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = self._connect()
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            if version:
+                logger.info(f"Discarding note index at {self.path}, format changed")
+            self._conn.execute("DROP TABLE IF EXISTS notes")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS notes ("
+            "filename TEXT PRIMARY KEY, stamp TEXT NOT NULL, note TEXT NOT NULL, terms TEXT NOT NULL, tags TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def load_notes(self):
+        """
+        Loads the stored stamps and notes.
+
+        Returns
+        -------
+        dict
+            Maps note filenames to dictionaries with 'stamp' and 'note' (a NoteRecord) keys.
+        """
+        index = {}
+        for filename, stamp, note in self._conn.execute("SELECT filename, stamp, note FROM notes"):
+            try:
+                index[filename] = {'stamp': _stamp_from_json(stamp), 'note': _note_from_json(note)}
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Ignoring broken index entry for {filename}: {e}")
+        return index
+
+    def iter_terms(self, filenames=None):
+        """
+        Yields the stored search terms of every note.
+
+        Opens its own connection, so it can be used from a worker thread.
+
+        Parameters
+        ----------
+        filenames : list of str, optional
+            Only yield the terms of these notes.
+
+        Yields
+        ------
+        filename : str
+            The filename of the note.
+        term_scores : dict
+            Maps each term of the note to its score.
+        tags : list of str
+            The tags of the note.
+        """
+        conn = self._connect()
+        try:
+            if filenames is None:
+                rows = conn.execute("SELECT filename, terms, tags FROM notes")
+            else:
+                rows = self._select_terms(conn, list(filenames))
+            for filename, terms, tags in rows:
+                yield filename, json.loads(terms), json.loads(tags)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _select_terms(conn, filenames):
+        # in chunks, SQLite limits the number of query parameters
+        for i in range(0, len(filenames), 500):
+            chunk = filenames[i:i + 500]
+            yield from conn.execute(
+                f"SELECT filename, terms, tags FROM notes WHERE filename IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+
+    def load_stamps(self):
+        """
+        Loads the stored stamp of every note, as stored.
+
+        Opens its own connection, so it can be used from a worker thread.
+
+        Returns
+        -------
+        dict
+            Maps note filenames to their stamps in the stored JSON form.
+        """
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT filename, stamp FROM notes"))
+        finally:
+            conn.close()
+
+    def load_search_state(self):
+        """
+        Loads the search index snapshot written by `save_search_state`.
+
+        Returns
+        -------
+        stamps : dict
+            Maps the filenames of the notes in the snapshot to their stamps in the stored JSON
+            form, compare with `load_stamps` to find the notes changed since.
+        state : tuple
+            The state of the search index, see `SearchIndex.from_state`.
+        None
+            If there is no usable snapshot.
+        """
+        try:
+            data = self.search_state_path.read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Could not read search index snapshot {self.search_state_path}: {e}")
+            return None
+        try:
+            version, stamps, state = marshal.loads(data)
+        except (EOFError, ValueError, TypeError) as e:
+            logger.warning(f"Ignoring broken search index snapshot {self.search_state_path}: {e}")
+            return None
+        if version != SCHEMA_VERSION:
+            return None
+        return stamps, state
+
+    def save_search_state(self, stamps, state):
+        """
+        Writes a snapshot of the search index.
+
+        Parameters
+        ----------
+        stamps : dict
+            Maps the filenames of the notes in the search index to their current stamps.
+        state : tuple
+            The state of the search index, see `SearchIndex.get_state`.
+        """
+        data = marshal.dumps((SCHEMA_VERSION, {filename: json.dumps(stamp) for filename, stamp in stamps.items()}, state))
+        # a cache like the database, a torn snapshot is ignored, so it is not synced
+        temp_path = self.search_state_path.with_name(self.search_state_path.name + ".tmp")
+        try:
+            temp_path.write_bytes(data)
+            os.replace(temp_path, self.search_state_path)
+        except OSError as e:
+            logger.warning(f"Could not write search index snapshot {self.search_state_path}: {e}")
+
+    def put(self, filename, stamp, note, term_scores):
+        """Stores or replaces a note. Changes are written on `commit`."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO notes (filename, stamp, note, terms, tags) VALUES (?, ?, ?, ?, ?)",
+            (filename, json.dumps(stamp), _note_to_json(note), json.dumps(term_scores),
+             json.dumps(note.tags)),
+        )
+
+    def delete(self, filename):
+        """Removes a note. Changes are written on `commit`."""
+        self._conn.execute("DELETE FROM notes WHERE filename = ?", (filename,))
+
+    def clear(self):
+        """Removes all notes. Changes are written on `commit`."""
+        self._conn.execute("DELETE FROM notes")
+
+    def commit(self):
+        """Writes pending changes to disk."""
+        self._conn.commit()
+
+    def close(self):
+        """Writes pending changes and closes the database."""
+        self._conn.commit()
+        self._conn.close()
@@ -0,0 +1,226 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+# pasted images of notes which were never saved
+IMAGE_TTL = 24 * 60 * 60
+# zip archives, only needed until the browser has downloaded them
+DOWNLOAD_TTL = 5 * 60
+DOWNLOAD_SUFFIXES = ('.zip',)
+
+
+def get_dir_size(directory):
+    """Returns the total size in bytes of the files directly in a directory, 0 if it does not exist."""
+    total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except FileNotFoundError:
+                    # removed while scanning
+                    continue
+    except FileNotFoundError:
+        return 0
+    return total
+
+
+class TempJanitor():
+    """
+    Removes expired files from the temp directory, e.g. pasted images of notes which were
+    never saved and zip archives which were already downloaded.
+
+    Files registered with `track` expire after their own time to live, all other files once
+    they were not modified for the default time to live of their kind. So files left behind
+    before a restart are removed as well. Sweeps run at startup and then periodically in a
+    background task, the file operations run in worker threads.
+
+    Optionally, cached image variants whose image no longer exists are removed too.
+
+    Parameters
+    ----------
+    temp_dir : Path
+        The temp directory.
+    storage : Storage
+        Runs the sweeps in worker threads.
+    interval : float, optional
+        Seconds between sweeps.
+    in_use : callable, optional
+        Called with a filename, files for which it returns True are never removed,
+        e.g. images of a note which is still being written.
+    variants_dir : Path, optional
+        The directory of cached image variants, see `utils.image_variants`.
+    image_dirs : list of Path, optional
+        Directories where the originals of the image variants are looked up.
+
+    Attributes
+    ----------
+    removed_files : int
+        Number of files removed since the start.
+    reclaimed_bytes : int
+        Size of all files removed since the start.
+    """
+
+    def __init__(self, temp_dir, storage, interval=300.0, in_use=None, variants_dir=None, image_dirs=()):
+        self.temp_dir = temp_dir
+        self.storage = storage
+        self.interval = interval
+        self.in_use = in_use
+        self.variants_dir = variants_dir
+        self.image_dirs = list(image_dirs)
+        self.removed_files = 0
+        self.reclaimed_bytes = 0
+        self._expiry = {}
+        self._lock = threading.Lock()
+        self._stop_event = None
+        self._task = None
+
+    def track(self, path, ttl):
+        """Registers a file in the temp directory which is removed `ttl` seconds from now."""
+        with self._lock:
+            self._expiry[path.name] = time.time() + ttl
+
+    def start(self):
+        """Sweeps once and then periodically in a background task of the running event loop."""
+        self._stop_event = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background task."""
+        if self._stop_event:
+            self._stop_event.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, timeout=5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                await self.storage.run(self.sweep)
+            except Exception as e:
+                logger.error(f"Error cleaning up {self.temp_dir}: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def sweep(self, now=None):
+        """
+        Removes all expired files, blocking.
+
+        Parameters
+        ----------
+        now : float, optional
+            The current time as returned by `time.time`, for tests.
+
+        Returns
+        -------
+        tuple of int
+            The number of removed files and their total size in bytes.
+        """
+        now = time.time() if now is None else now
+        removed, reclaimed = self._sweep_temp_dir(now)
+        if self.variants_dir is not None:
+            variants_removed, variants_reclaimed = self._sweep_variants(now)
+            removed += variants_removed
+            reclaimed += variants_reclaimed
+
+        self.removed_files += removed
+        self.reclaimed_bytes += reclaimed
+        if removed:
+            logger.info(
+                f"Removed {removed} expired temporary files, reclaimed {reclaimed / 1024 / 1024:.1f} MB "
+                f"({self.reclaimed_bytes / 1024 / 1024:.1f} MB since start)"
+            )
+        return removed, reclaimed
+
+    def _sweep_temp_dir(self, now):
+        if not self.temp_dir.is_dir():
+            return 0, 0
+        removed = reclaimed = 0
+        with os.scandir(self.temp_dir) as entries:
+            files = [entry for entry in entries if entry.is_file(follow_symlinks=False)]
+        for entry in files:
+            if self.in_use is not None and self.in_use(entry.name):
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                expiry = self._expiry.get(entry.name)
+            if expiry is None:
+                ttl = DOWNLOAD_TTL if entry.name.endswith(DOWNLOAD_SUFFIXES) else IMAGE_TTL
+                expiry = st.st_mtime + ttl
+            if expiry > now:
+                continue
+            if self._remove(entry.path):
+                removed += 1
+                reclaimed += st.st_size
+            with self._lock:
+                self._expiry.pop(entry.name, None)
+        return removed, reclaimed
+
+    def _sweep_variants(self, now):
+        if not self.variants_dir.is_dir():
+            return 0, 0
+        removed = reclaimed = 0
+        for size_dir in self.variants_dir.iterdir():
+            if not size_dir.is_dir():
+                continue
+            with os.scandir(size_dir) as entries:
+                files = [entry for entry in entries if entry.is_file(follow_symlinks=False)]
+            for entry in files:
+                # <image name>.<variant format>
+                image_name = entry.name.rpartition('.')[0]
+                if any((directory / image_name).exists() for directory in self.image_dirs):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                # a variant of an image being uploaded right now
+                if st.st_mtime + DOWNLOAD_TTL > now:
+                    continue
+                if self._remove(entry.path):
+                    removed += 1
+                    reclaimed += st.st_size
+        return removed, reclaimed
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+            return False
+        logger.debug(f"Removed expired temporary file {path}")
+        return True
@@ -0,0 +1,154 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import re
+
+from nicegui import ui
+from nicegui.elements.markdown import remove_indentation
+
+# kurup
+from utils.markdown_cache import CachedMarkdown
+
+FENCE_MARKERS = ("```", "~~~")
+LIST_ITEM_PATTERN = re.compile(r"(?:[*+-]|\d+[.)])[ \t]")
+# reference definitions and HTML blocks can affect any other block of the content
+FULL_RENDER_PATTERN = re.compile(r"^ {0,3}(?:\[[^\]\n]+\]:|<[A-Za-z!/])", re.MULTILINE)
+
+
+def split_blocks(content):
+    """
+    Splits markdown content into blocks separated by blank lines, which render the same on
+    their own as within the whole content.
+
+    Blank lines inside fenced code blocks do not split them. Indented lines after blank lines,
+    e.g. indented code or list item paragraphs, and list items after blank lines in a list
+    continue the block before them.
+
+    Parameters
+    ----------
+    content : str
+        The markdown content.
+
+    Returns
+    -------
+    list of str
+        The non-empty blocks in order.
+    """
+    blocks = []
+    lines = []
+    # blank lines after the current block, kept if the next line continues it
+    blank_lines = []
+    fence = None
+    is_list = False
+    is_quote = False
+    # markdown2 renders everything after a block quote followed by indented lines as part of it
+    is_open_quote = False
+    for line in content.splitlines():
+        stripped = line.strip()
+        if fence is None:
+            if not stripped:
+                if lines:
+                    blank_lines.append(line)
+                continue
+            if blank_lines:
+                if line[0] in " \t" or is_open_quote or (is_list and LIST_ITEM_PATTERN.match(line)):
+                    lines.extend(blank_lines)
+                else:
+                    blocks.append("\n".join(lines))
+                    lines = []
+                    is_list = is_quote = False
+                blank_lines = []
+            if stripped.startswith(FENCE_MARKERS):
+                fence = stripped[:3]
+            elif LIST_ITEM_PATTERN.match(stripped):
+                is_list = True
+            elif stripped.startswith(">"):
+                is_quote = True
+            if is_quote and line[0] in " \t":
+                is_open_quote = True
+        elif stripped.startswith(fence):
+            fence = None
+        lines.append(line)
+    if lines:
+        blocks.append("\n".join(lines))
+    return blocks
+
+
+class LivePreview(ui.element):
+    """
+    A markdown preview which renders every block of the content in its own element.
+
+    On a content change only the blocks that differ from the previous content are rendered
+    again and sent to the browser, unchanged blocks before and after them are kept. Content
+    with reference definitions or HTML blocks is rendered as a whole.
+
+    Parameters
+    ----------
+    cache : MarkdownCache
+        The cache used for rendering the blocks.
+    """
+
+    def __init__(self, cache):
+        super().__init__("div")
+        self._cache = cache
+        self._blocks = []
+        self._block_elements = []
+
+    def set_content(self, content):
+        """
+        Updates the preview to show markdown content.
+
+        Parameters
+        ----------
+        content : str
+            The markdown content.
+        """
+        # the indentation of the whole content is removed like for a saved note, not per block
+        content = remove_indentation(content)
+        if FULL_RENDER_PATTERN.search(content):
+            blocks = [content]
+        else:
+            blocks = split_blocks(content)
+        old_blocks = self._blocks
+
+        shared = min(len(old_blocks), len(blocks))
+        prefix = 0
+        while prefix < shared and old_blocks[prefix] == blocks[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < shared - prefix and old_blocks[-1 - suffix] == blocks[-1 - suffix]:
+            suffix += 1
+
+        old_changed = self._block_elements[prefix:len(old_blocks) - suffix]
+        new_changed = blocks[prefix:len(blocks) - suffix]
+
+        # changed blocks reuse the elements of the blocks they replace
+        elements = []
+        for element, block in zip(old_changed, new_changed):
+            element.set_content(block)
+            elements.append(element)
+        for element in old_changed[len(new_changed):]:
+            self.remove(element)
+        for i, block in enumerate(new_changed[len(old_changed):], start=prefix + len(elements)):
+            with self:
+                element = CachedMarkdown(block, cache=self._cache)
+            element.move(target_index=i)
+            elements.append(element)
+
+        self._block_elements[prefix:len(old_blocks) - suffix] = elements
+        self._blocks = blocks
@@ -0,0 +1,198 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import sqlite3
+from collections import OrderedDict
+
+import markdown2
+from nicegui import ui
+from nicegui.elements.markdown import remove_indentation
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+# the markdown2 extras ui.markdown uses by default
+MARKDOWN_EXTRAS = ('fenced-code-blocks', 'tables')
+
+
+def get_content_key(content, extras=MARKDOWN_EXTRAS):
+    """
+    Returns the cache key of markdown content rendered with a set of extras.
+
+    Parameters
+    ----------
+    content : str
+        The markdown content.
+    extras : sequence of str, optional
+        The markdown2 extras used for rendering.
+
+    Returns
+    -------
+    str
+        A hex digest identifying this version of the content.
+    """
+    digest = hashlib.sha1(' '.join(extras).encode())
+    digest.update(b'\0')
+    digest.update(content.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+class MarkdownCache():
+    """
+    Renders markdown to HTML once per version of the content.
+
+    Rendered HTML is kept in memory, keyed by a hash of the content and evicted least recently
+    used first. With a `path` the cache is saved on `close` and loaded again on startup.
+
+    Parameters
+    ----------
+    max_size : int, optional
+        Maximum total length of the cached HTML in characters.
+    path : Path, optional
+        The SQLite file the cache is persisted in.
+
+    Attributes
+    ----------
+    hits : int
+        Number of renders answered from the cache.
+    misses : int
+        Number of renders that had to run markdown2.
+    """
+
+    def __init__(self, max_size=16 * 1024 * 1024, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        if self.path is not None:
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        """Hit and miss counters and the current size of the cache, as dict."""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'size': self._size}
+
+    def render(self, content, extras=MARKDOWN_EXTRAS):
+        """
+        Returns the HTML of markdown content, rendering it only if it is not cached.
+
+        Parameters
+        ----------
+        content : str
+            The markdown content.
+        extras : sequence of str, optional
+            The markdown2 extras to render with.
+
+        Returns
+        -------
+        str
+            The rendered HTML.
+        """
+        key = get_content_key(content, extras)
+        html = self._entries.get(key)
+        if html is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+        self.misses += 1
+        html = markdown2.markdown(remove_indentation(content), extras=list(extras))
+        self._put(key, html)
+        return html
+
+    def clear(self):
+        """Removes all cached HTML."""
+        self._entries.clear()
+        self._size = 0
+
+    def close(self):
+        """Saves the cache if it is persisted."""
+        logger.info(f"Markdown cache: {self.hits} hits, {self.misses} misses, {len(self._entries)} entries")
+        if self.path is not None:
+            self._save()
+
+    def _put(self, key, html):
+        if len(html) > self.max_size:
+            return
+        self._entries[key] = html
+        self._size += len(html)
+        while self._size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                # rows are stored least recently used first
+                for key, html in conn.execute("SELECT key, html FROM rendered ORDER BY position"):
+                    self._put(key, html)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Ignoring markdown cache at {self.path}: {e}")
+            self.clear()
+            return
+        logger.info(f"Loaded {len(self._entries)} rendered notes from the markdown cache")
+
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            try:
+                with conn:
+                    conn.execute("DROP TABLE IF EXISTS rendered")
+                    conn.execute("CREATE TABLE rendered (position INTEGER PRIMARY KEY, key TEXT NOT NULL, html TEXT NOT NULL)")
+                    conn.executemany("INSERT INTO rendered (key, html) VALUES (?, ?)", self._entries.items())
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save the markdown cache to {self.path}: {e}")
+
+
+class CachedMarkdown(ui.markdown):
+    """
+    A `ui.markdown` element which takes its HTML from a MarkdownCache.
+
+    Parameters
+    ----------
+    content : str, optional
+        The markdown content to display.
+    cache : MarkdownCache
+        The cache used for rendering.
+    """
+
+    def __init__(self, content="", *, cache):
+        # the content is rendered while the element is initialized
+        self._cache = cache
+        super().__init__(content, extras=list(MARKDOWN_EXTRAS))
+
+    def _handle_content_change(self, content):
+        html = self._cache.render(content, self.extras)
+        if self._props.get('innerHTML') != html:
+            self._props['innerHTML'] = html
+            self.update()
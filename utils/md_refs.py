@@ -0,0 +1,129 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from dataclasses import dataclass
+
+# ![alt](/notes/image.png), ![alt](<path with spaces.png>) or ![alt](/notes/image.png "title")
+_IMAGE = r"!\[(?P<alt>[^\]\n]*)\]\(\s*(?:<(?P<angle_url>[^>\n]+)>|(?P<url>[^)\s]+))(?:\s+\"[^\"\n]*\")?\s*\)"
+# ![[image.png]], ![[image.png|alias]], ![[image.png#anchor]] (Obsidian)
+_EMBED = r"!\[\[(?P<embed>[^\]|#\n]+)(?:#[^\]|\n]*)?(?:\|(?P<alias>[^\]\n]*))?\]\]"
+
+IMAGE_PATTERN = re.compile(f"{_IMAGE}|{_EMBED}")
+
+
+@dataclass(slots=True)
+class Ref:
+    """
+    An image found in markdown content.
+
+    Attributes
+    ----------
+    kind : str
+        "image" for markdown images, "embed" for Obsidian ``![[...]]`` embeds.
+    start, end : int
+        Position of the reference in the content, ``content[start:end]`` is its text.
+    text : str
+        The alt text or alias of the image.
+    target : str
+        The URL or path of the image.
+    """
+
+    kind: str
+    start: int
+    end: int
+    text: str
+    target: str
+
+    @property
+    def filename(self):
+        """The last path component of the target."""
+        return self.target.rpartition("/")[2]
+
+    def is_in(self, directory):
+        """Checks if an image is served from a directory, e.g. ``/notes/``, given its name."""
+        return self.target.startswith(f"/{directory}/") and "/" not in self.target[len(directory) + 2:]
+
+
+def _image_ref(match):
+    if match.group("embed") is None:
+        target = match.group("url") or match.group("angle_url")
+        return Ref("image", match.start(), match.end(), match.group("alt"), target)
+    return Ref("embed", match.start(), match.end(), match.group("alias") or "", match.group("embed").strip())
+
+
+def find_images(content, directory=None):
+    """
+    Finds the images of markdown content in a single pass.
+
+    Parameters
+    ----------
+    content : str
+        The markdown content.
+    directory : str or Path, optional
+        Only images served from this directory, e.g. ``notes`` for ``![](/notes/x.png)``.
+        Obsidian embeds have no directory and are left out then.
+
+    Returns
+    -------
+    list of Ref
+        The images in order of their position.
+    """
+    refs = [_image_ref(match) for match in IMAGE_PATTERN.finditer(content)]
+    if directory is not None:
+        name = getattr(directory, "name", directory)
+        refs = [ref for ref in refs if ref.kind == "image" and ref.is_in(name)]
+    return refs
+
+
+def image_filenames(content, directory):
+    """Returns the filenames of the images served from a directory, each once, in order."""
+    return list(dict.fromkeys(ref.filename for ref in find_images(content, directory)))
+
+
+def rewrite(content, refs, replace):
+    """
+    Replaces references in a single pass.
+
+    Parameters
+    ----------
+    content : str
+        The markdown content.
+    refs : list of Ref
+        References found in `content`, in order of their position.
+    replace : callable
+        Called with every reference, returns its new text or None to keep it.
+
+    Returns
+    -------
+    str
+        The rewritten content.
+    """
+    parts = []
+    position = 0
+    for ref in refs:
+        new_text = replace(ref)
+        if new_text is None:
+            continue
+        parts.append(content[position:ref.start])
+        parts.append(new_text)
+        position = ref.end
+    if not parts:
+        return content
+    parts.append(content[position:])
+    return "".join(parts)
@@ -0,0 +1,414 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import threading
+
+# kurup
+from utils.atomic_write import WriteBatch, atomic_write_text, get_journal_dir
+from utils.index_store import KURUP_DIR_NAME
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+METADATA_STORES = ("sidecar", "log")
+METADATA_LOG_NAME = "metadata.jsonl"
+
+# the log is rewritten on startup once it has this many times more lines than notes
+COMPACT_RATIO = 2
+
+
+def get_sidecar_path(notes_dir, filename):
+    """Returns the path of the hidden kurup metadata file of a note."""
+    return notes_dir / f".{filename}.kurup"
+
+
+def is_sidecar_name(name):
+    """Checks if a filename is the name of a kurup metadata file."""
+    return name.startswith('.') and name.endswith('.md.kurup')
+
+
+def parse_sidecar(kurup_data, filename):
+    """
+    Extracts the metadata of a note from the content of its kurup metadata file.
+
+    Parameters
+    ----------
+    kurup_data : dict
+        The decoded metadata file.
+    filename : str
+        The filename of the note.
+
+    Returns
+    -------
+    dict
+        'images' and 'tags' of the note, only the keys present in the file.
+        Empty if the file has no entry for this note.
+    """
+    entry = kurup_data.get(filename)
+    if isinstance(entry, list):
+        # old format - just images, until v. 0.1.1
+        return {'images': entry, 'tags': []}
+    if not entry:
+        return {}
+    return {key: entry[key] for key in ('images', 'tags') if key in entry}
+
+
+class SidecarMetadataStore():
+    """
+    Stores the images and tags of every note in its own hidden ``.<filename>.kurup`` JSON file.
+
+    This is the format used by all kurup versions, metadata is read with one file open per note.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+    """
+
+    name = "sidecar"
+
+    def __init__(self, notes_dir):
+        self.notes_dir = notes_dir
+
+    def get(self, filename):
+        """
+        Returns the metadata of a note.
+
+        Parameters
+        ----------
+        filename : str
+            The filename of the note.
+
+        Returns
+        -------
+        dict or None
+            'images' and 'tags' of the note, see `parse_sidecar`, or None if there is no metadata.
+        """
+        path = get_sidecar_path(self.notes_dir, filename)
+        try:
+            kurup_data = json.loads(path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return None
+        logger.debug(f"kurup metadata file read from {path.name}")
+        return parse_sidecar(kurup_data, filename)
+
+    def stamp(self, filename):
+        """Returns a value which changes whenever the metadata of a note changes, or None."""
+        try:
+            st = os.stat(get_sidecar_path(self.notes_dir, filename))
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def put(self, filename, images, tags, batch=None):
+        """Stores the metadata of a note, as part of a WriteBatch if given."""
+        # kurup_metadata = {filename: img_list} (until v.0.1.1)
+        kurup_metadata = json.dumps({filename: {"images": list(images), "tags": list(tags)}})
+        path = get_sidecar_path(self.notes_dir, filename)
+        if batch is not None:
+            batch.write_text(path, kurup_metadata)
+        else:
+            atomic_write_text(path, kurup_metadata)
+
+    def delete(self, filename, batch=None):
+        """Removes the metadata of a note, as part of a WriteBatch if given."""
+        path = get_sidecar_path(self.notes_dir, filename)
+        if batch is not None:
+            batch.delete(path)
+        else:
+            path.unlink(missing_ok=True)
+
+    def items(self):
+        """Yields the filename and metadata of every note with a metadata file."""
+        with os.scandir(self.notes_dir) as entries:
+            names = [entry.name for entry in entries if is_sidecar_name(entry.name)]
+        for name in names:
+            filename = name[1:-len('.kurup')]
+            metadata = self.get(filename)
+            if metadata is not None:
+                yield filename, metadata
+
+    def close(self):
+        """Nothing to release, files are closed after every access."""
+
+
+class LogMetadataStore():
+    """
+    Stores the images and tags of all notes in one append-only JSON lines file,
+    ``.kurup/metadata.jsonl`` inside the notes directory.
+
+    The log is read once on startup and kept in memory. Every change appends a line with
+    a sequence number, which also serves as the stamp of the note's metadata. Changes made
+    as part of a WriteBatch are appended with it and kept in its journal, so `recover`
+    appends them if the process was killed after the note was written. The log is
+    compacted on startup when it has grown much larger than the number of notes.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+
+    Attributes
+    ----------
+    path : Path
+        The path of the log file.
+    """
+
+    name = "log"
+
+    def __init__(self, notes_dir):
+        self.notes_dir = notes_dir
+        self.path = notes_dir / KURUP_DIR_NAME / METADATA_LOG_NAME
+        self._entries = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._file = None
+
+        line_count = self._load()
+        if line_count > COMPACT_RATIO * len(self._entries) + 100:
+            self.compact()
+
+    def _load(self):
+        line_count = 0
+        if not self.path.exists():
+            return line_count
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                line_count += 1
+                try:
+                    record = json.loads(line)
+                    filename = record['filename']
+                    seq = record['seq']
+                except (ValueError, KeyError, TypeError):
+                    # a line torn by a crash while appending
+                    logger.warning(f"Ignoring broken line {line_count} of {self.path}")
+                    continue
+                self._seq = max(self._seq, seq)
+                self._set_entry(record)
+        logger.info(f"Loaded kurup metadata of {len(self._entries)} notes from {self.path}")
+        return line_count
+
+    def get(self, filename):
+        """
+        Returns the metadata of a note.
+
+        Parameters
+        ----------
+        filename : str
+            The filename of the note.
+
+        Returns
+        -------
+        dict or None
+            'images' and 'tags' of the note, or None if there is no metadata.
+        """
+        entry = self._entries.get(filename)
+        if entry is None:
+            return None
+        return {'images': list(entry[1]), 'tags': list(entry[2])}
+
+    def stamp(self, filename):
+        """Returns a value which changes whenever the metadata of a note changes, or None."""
+        entry = self._entries.get(filename)
+        return (entry[0],) if entry is not None else None
+
+    def put(self, filename, images, tags, batch=None):
+        """Stores the metadata of a note, as part of a WriteBatch if given."""
+        with self._lock:
+            self._seq += 1
+            record = {'seq': self._seq, 'filename': filename, 'images': list(images), 'tags': list(tags)}
+            if batch is None:
+                self._set_entry(record)
+                self._append(record)
+                return
+        self._add_to_batch(batch, record)
+
+    def put_many(self, items):
+        """Stores the metadata of many notes with a single write, `items` yields (filename, metadata)."""
+        with self._lock:
+            lines = []
+            for filename, metadata in items:
+                self._seq += 1
+                record = {
+                    'seq': self._seq, 'filename': filename,
+                    'images': list(metadata.get('images', [])), 'tags': list(metadata.get('tags', [])),
+                }
+                self._set_entry(record)
+                lines.append(record)
+            self._append(*lines)
+
+    def delete(self, filename, batch=None):
+        """Removes the metadata of a note, as part of a WriteBatch if given."""
+        with self._lock:
+            if filename not in self._entries:
+                return
+            self._seq += 1
+            record = {'seq': self._seq, 'filename': filename, 'deleted': True}
+            if batch is None:
+                self._set_entry(record)
+                self._append(record)
+                return
+        self._add_to_batch(batch, record)
+
+    def items(self):
+        """Yields the filename and metadata of every note."""
+        for filename in list(self._entries):
+            metadata = self.get(filename)
+            if metadata is not None:
+                yield filename, metadata
+
+    def compact(self):
+        """Rewrites the log with one line per note."""
+        with self._lock:
+            self._close_file()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for filename, (seq, images, tags) in sorted(self._entries.items(), key=lambda item: item[1][0]):
+                    f.write(json.dumps({'seq': seq, 'filename': filename, 'images': images, 'tags': tags}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            logger.info(f"Compacted {self.path} to {len(self._entries)} notes")
+
+    def close(self):
+        """Closes the log file."""
+        with self._lock:
+            self._close_file()
+
+    def _set_entry(self, record):
+        if record.get('deleted'):
+            self._entries.pop(record['filename'], None)
+        else:
+            self._entries[record['filename']] = (record['seq'], record.get('images', []), record.get('tags', []))
+
+    def _add_to_batch(self, batch, record):
+        # all lines of a batch are appended with a single write, and kept in memory once committed
+        batch.append_text(self.path, json.dumps(record) + '\n')
+
+        def commit():
+            with self._lock:
+                self._set_entry(record)
+        batch.on_commit(commit)
+
+    def _append(self, *records):
+        if not records:
+            return
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def migrate_to_log(notes_dir):
+    """
+    Moves the metadata of all sidecar files into the metadata log and deletes the sidecars.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+
+    Returns
+    -------
+    int
+        The number of migrated notes.
+    """
+    sidecars = SidecarMetadataStore(notes_dir)
+    items = list(sidecars.items())
+    filenames = [filename for filename, _ in items]
+    items = [(filename, metadata) for filename, metadata in items if metadata]
+    log = LogMetadataStore(notes_dir)
+    try:
+        log.put_many(items)
+        # the sidecars are only removed once the log is on disk
+        log.compact()
+    finally:
+        log.close()
+    for filename in filenames:
+        sidecars.delete(filename)
+    logger.info(f"Migrated kurup metadata of {len(items)} notes to {log.path}")
+    return len(items)
+
+
+def export_to_sidecars(notes_dir):
+    """
+    Writes the metadata of the log back to one sidecar file per note and removes the log.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+
+    Returns
+    -------
+    int
+        The number of exported notes.
+    """
+    log = LogMetadataStore(notes_dir)
+    sidecars = SidecarMetadataStore(notes_dir)
+    count = 0
+    try:
+        with WriteBatch(get_journal_dir(notes_dir)) as batch:
+            for filename, metadata in log.items():
+                sidecars.put(filename, metadata['images'], metadata['tags'], batch)
+                count += 1
+    finally:
+        log.close()
+    log.path.unlink()
+    logger.info(f"Exported kurup metadata of {count} notes from {log.path} to sidecar files")
+    return count
+
+
+def open_metadata_store(notes_dir, kind="sidecar"):
+    """
+    Opens the metadata store of a notes directory, converting existing metadata if the
+    directory was last used with the other kind of store.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+    kind : str, optional
+        Either "sidecar" for one metadata file per note or "log" for a single metadata log.
+
+    Returns
+    -------
+    SidecarMetadataStore or LogMetadataStore
+        The opened store.
+    """
+    if kind not in METADATA_STORES:
+        raise ValueError(f"Unknown metadata store {kind!r}, expected one of {', '.join(METADATA_STORES)}")
+    log_path = notes_dir / KURUP_DIR_NAME / METADATA_LOG_NAME
+    if kind == "log":
+        if not log_path.exists():
+            migrate_to_log(notes_dir)
+        return LogMetadataStore(notes_dir)
+    if log_path.exists():
+        export_to_sidecars(notes_dir)
+    return SidecarMetadataStore(notes_dir)
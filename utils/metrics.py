@@ -0,0 +1,284 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+# media type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds of the latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric():
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {', '.join(self.labelnames) or 'none'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _get_values(self):
+        if self.func is None:
+            with self._lock:
+                return dict(self._values)
+        # values read from elsewhere when scraped, a number or a dict of label values to numbers
+        values = self.func()
+        if not isinstance(values, dict):
+            return {(): values}
+        return {key if isinstance(key, tuple) else (key,): value for key, value in values.items()}
+
+    def collect(self):
+        """Returns (name, labels, value) of every sample."""
+        return [
+            (self.name, list(zip(self.labelnames, key)), value)
+            for key, value in sorted(self._get_values().items())
+        ]
+
+
+class Counter(_Metric):
+    """
+    A value which only goes up, e.g. the number of saved notes.
+
+    Parameters
+    ----------
+    name : str
+        The metric name, ending in ``_total`` by convention.
+    documentation : str
+        The help text.
+    labelnames : sequence of str, optional
+        Names of the labels every sample has.
+    func : callable, optional
+        Returns the value when scraped, instead of counting with `inc`. A dict maps label
+        values, a tuple for several labels, to values.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Increases the counter of the given label values."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A value which goes up and down, e.g. the number of notes. See `Counter` for the parameters.
+    """
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        """Sets the value of the given label values."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        """Increases the value of the given label values, decreases it for a negative amount."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """
+    Counts observed values, e.g. latencies, in cumulative buckets.
+
+    Parameters
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The help text.
+    labelnames : sequence of str, optional
+        Names of the labels every sample has.
+    buckets : sequence of float, optional
+        Upper bounds of the buckets, in increasing order.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        """Adds a value, e.g. a duration in seconds."""
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        samples = []
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labels + [("le", _format_value(float(bound)))], cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry():
+    """
+    Holds metrics and renders them in the Prometheus text format.
+
+    Methods
+    -------
+    counter(name, documentation, labelnames=(), func=None)
+        Creates and registers a `Counter`.
+    gauge(name, documentation, labelnames=(), func=None)
+        Creates and registers a `Gauge`.
+    histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS)
+        Creates and registers a `Histogram`.
+    render()
+        Returns all metrics as text.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Adds a metric, replacing a metric of the same name."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), func=None):
+        return self.register(Counter(name, documentation, labelnames, func))
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self.register(Gauge(name, documentation, labelnames, func))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Returns the current value of every metric in the Prometheus text format.
+
+        Metrics whose callback fails are left out, so one broken metric does not hide the others.
+
+        Returns
+        -------
+        str
+            The exposition text, see `CONTENT_TYPE`.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.collect()
+            except Exception as e:
+                logger.warning(f"Could not collect metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+OPERATION_SECONDS = registry.histogram(
+    "kurup_operation_duration_seconds", "Duration of kurup operations, e.g. search or save_note.", ["operation"]
+)
+OPERATION_ERRORS = registry.counter(
+    "kurup_operation_errors_total", "Operations which raised an exception.", ["operation"]
+)
+
+# operations taking at least this long are logged, None disables the log
+_slow_threshold = None
+
+
+def set_slow_threshold(ms):
+    """Logs a warning for every operation timed with `timed` that takes at least `ms` milliseconds, None disables it."""
+    global _slow_threshold
+    _slow_threshold = None if ms is None or ms <= 0 else ms / 1000
+
+
+@contextmanager
+def timed(operation):
+    """
+    Records the duration of an operation in `OPERATION_SECONDS` and logs it if it was slow.
+
+    Can be used as context manager or as decorator of a function, not of a coroutine function.
+
+    Parameters
+    ----------
+    operation : str
+        The name of the operation, the value of the ``operation`` label.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        OPERATION_ERRORS.inc(operation=operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        OPERATION_SECONDS.observe(elapsed, operation=operation)
+        if _slow_threshold is not None and elapsed >= _slow_threshold:
+            logger.warning(f"Slow operation {operation}: {elapsed * 1000:.0f} ms")
@@ -0,0 +1,174 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import sys
+from array import array
+from dataclasses import dataclass
+from datetime import datetime
+
+NATURAL_SPLIT_PATTERN = re.compile(r"([0-9]+)")
+
+
+def natural_key(text):
+    """
+    Returns a key sorting text case-insensitively with embedded numbers in numeric order.
+
+    Parameters
+    ----------
+    text : str
+        The text to compute the key for.
+
+    Returns
+    -------
+    tuple
+        The sort key, e.g. ``('note_', 2, '.md')`` for ``Note_2.md``.
+    """
+    return tuple(
+        int(part) if part.isdigit() else part.lower()
+        for part in NATURAL_SPLIT_PATTERN.split(text)
+    )
+
+
+@dataclass(slots=True)
+class NoteRecord:
+    """
+    Metadata of a single note.
+
+    Attributes
+    ----------
+    filename : str
+        The filename of the note.
+    title : str
+        The title shown for the note, derived from the filename.
+    mtime_ns : int
+        Modification time of the note file in nanoseconds since the epoch.
+    size : int
+        Length of the note content in characters.
+    preview : str
+        The first lines of the note content.
+    image_refs : tuple of str
+        Filenames of the images belonging to the note.
+    tags : tuple of str
+        The tags of the note, interned.
+    has_kurup_ref : bool
+        True if kurup metadata exists for the note, only then its images are deleted with it.
+    """
+
+    filename: str
+    title: str
+    mtime_ns: int
+    size: int
+    preview: str
+    image_refs: tuple
+    tags: tuple
+    has_kurup_ref: bool
+
+    @classmethod
+    def create(cls, filename, title, mtime_ns, size, preview, image_refs, tags, has_kurup_ref):
+        """Creates a record, normalizing list arguments to tuples and interning tags."""
+        return cls(
+            filename,
+            title,
+            int(mtime_ns),
+            int(size),
+            preview,
+            tuple(image_refs),
+            tuple(sys.intern(tag) for tag in tags),
+            bool(has_kurup_ref),
+        )
+
+    @property
+    def modified(self):
+        """The modification time as datetime."""
+        return datetime.fromtimestamp(self.mtime_ns / 1e9)
+
+    def to_row(self):
+        """Returns the record as a JSON serializable list."""
+        return [self.filename, self.title, self.mtime_ns, self.size, self.preview,
+                list(self.image_refs), list(self.tags), self.has_kurup_ref]
+
+    @classmethod
+    def from_row(cls, row):
+        """Creates a record from a list returned by `to_row`."""
+        return cls.create(*row)
+
+
+class NoteTable():
+    """
+    A columnar summary of the note records used for sorting and filtering.
+
+    Sort orders are computed from the columns once and reused until the table is rebuilt.
+
+    Parameters
+    ----------
+    records : iterable of NoteRecord
+        The notes in the table.
+    previous : NoteTable, optional
+        A previous table whose sort keys are reused for unchanged filenames.
+
+    Attributes
+    ----------
+    records : list of NoteRecord
+        The notes in the table.
+    mtime_ns : array
+        Modification times of the notes, in the order of `records`.
+    title_keys : list of tuple
+        Natural sort keys of the note filenames, in the order of `records`.
+    """
+
+    def __init__(self, records, previous=None):
+        self.records = list(records)
+        self.mtime_ns = array('q', (record.mtime_ns for record in self.records))
+        # natural sort keys only depend on the filename, reuse those of the previous table
+        known_keys = {}
+        if previous is not None:
+            known_keys = dict(zip((record.filename for record in previous.records), previous.title_keys))
+        self.title_keys = [
+            known_keys.get(record.filename) or natural_key(record.filename)
+            for record in self.records
+        ]
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def sorted(self, by="modified", reverse=False):
+        """
+        Returns the records sorted by a column.
+
+        Parameters
+        ----------
+        by : str, optional
+            Either "modified" or "title".
+        reverse : bool, optional
+            Sort in descending order.
+
+        Returns
+        -------
+        list of NoteRecord
+            A new list of the sorted records.
+        """
+        order = self._orders.get(by)
+        if order is None:
+            column = self.mtime_ns if by == "modified" else self.title_keys
+            order = self._orders[by] = sorted(range(len(self.records)), key=column.__getitem__)
+        records = self.records
+        if reverse:
+            return [records[i] for i in reversed(order)]
+        return [records[i] for i in order]
@@ -16,35 +16,47 @@
 # You should have received a copy of the GNU General Public License
 # along with kurup. If not, see <https://www.gnu.org/licenses/>.
 
-from datetime import datetime
-import json
-import re
+from collections import Counter, OrderedDict
+import inspect
+import os
 from nicegui import ui
 import zipfile
 import threading
-import time
 import logging
 
 # kurup
+from utils import md_refs
+from utils.atomic_write import WriteBatch, get_journal_dir, recover
 from utils.image_handler import get_image_refs, save_images
+from utils.index_store import IndexStore, get_index_path
+from utils.janitor import DOWNLOAD_TTL
+from utils.metadata_store import SidecarMetadataStore, is_sidecar_name, open_metadata_store
+from utils.metrics import timed
+from utils.note_record import NoteRecord, NoteTable
+from utils.search_index import SearchIndex, get_term_scores
+from utils.storage import Storage
 
 # logging
 logger = logging.getLogger("kurup_logger")
 
 
-def delete_note_and_images(note, notes_dir):
+def delete_note_and_images(note, notes_dir, metadata=None, keep_images=()):
     """    
     Deletes a note file, associated images, metadata from the specified directory.
 
     Parameters
     ----------
-    note : dict
-        A dictionary containing information about the note. The dictionary should include:
+    note : NoteRecord
+        The note to delete. Uses:
         - 'filename' (str): The filename of the note.
-        - 'kurup_ref' (list or None): A reference to Kurup metadata, if present.
-        - 'image_refs' (list of str): A list of image filenames associated with the note.
+        - 'has_kurup_ref' (bool): If kurup metadata is present, only then images are deleted.
+        - 'image_refs' (tuple of str): The image filenames associated with the note.
     notes_dir : str
         The directory where the note file, images, and metadata are stored.
+    metadata : SidecarMetadataStore or LogMetadataStore, optional
+        The store holding the kurup metadata, sidecar files by default.
+    keep_images : collection of str, optional
+        Images which are not deleted because other notes still reference them.
 
     Returns
     -------
@@ -53,33 +65,82 @@ def delete_note_and_images(note, notes_dir):
     """
 
     try:
-        note_path = notes_dir / note['filename']
-        note_path.unlink(missing_ok=True)
-
-        if note.get('kurup_ref'):
-            for img in note.get('image_refs', []):
+        if metadata is None:
+            metadata = SidecarMetadataStore(notes_dir)
+        with WriteBatch(get_journal_dir(notes_dir)) as batch:
+            batch.delete(notes_dir / note.filename)
+            metadata.delete(note.filename, batch)
+
+        if note.has_kurup_ref:
+            for img in note.image_refs:
+                if img in keep_images:
+                    continue
                 img_path = notes_dir / img
                 img_path.unlink(missing_ok=True)
 
-        kurup_path = notes_dir / f".{note['filename']}.kurup"
-        kurup_path.unlink(missing_ok=True)
-        logger.info(f"Deleted {note['filename']}")
+        logger.info(f"Deleted {note.filename}")
         return True
 
     except Exception as e:
-        print(f"Error deleting note {note['filename']}: {e}")
+        print(f"Error deleting note {note.filename}: {e}")
         return False
     
+def write_note(notes_dir, filename, content, images, tags, metadata=None):
+    """
+    Writes a note and its kurup metadata atomically, see `write_notes`.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+    filename : str
+        The filename of the note.
+    content : str
+        The markdown content of the note.
+    images : list of str
+        The image filenames belonging to the note.
+    tags : list of str
+        The tags of the note.
+    metadata : SidecarMetadataStore or LogMetadataStore, optional
+        The store holding the kurup metadata, sidecar files by default.
+    """
+    write_notes(notes_dir, [(filename, content, images, tags)], metadata)
+    logger.info(f"Saved note titled {filename}.")
+
+def write_notes(notes_dir, notes, metadata=None):
+    """
+    Writes notes and their kurup metadata in a single WriteBatch.
+
+    Either all files are replaced or, after a crash, none of them or all of them once the
+    batch is recovered on the next start. All files are written before the first is synced.
+
+    Parameters
+    ----------
+    notes_dir : Path
+        The directory where the notes are stored.
+    notes : iterable of tuple
+        (filename, content, images, tags) of every note to write.
+    metadata : SidecarMetadataStore or LogMetadataStore, optional
+        The store holding the kurup metadata, sidecar files by default.
+    """
+    if metadata is None:
+        metadata = SidecarMetadataStore(notes_dir)
+    with WriteBatch(get_journal_dir(notes_dir)) as batch:
+        for filename, content, images, tags in notes:
+            batch.write_text(notes_dir / filename, content)
+            metadata.put(filename, images, tags, batch)
+
+@timed("download_note")
 def create_zip_archive(note, notes_dir, temp_dir):
     """
     Creates a zip archive of a note and its associated images.
 
     Parameters
     ----------
-    note : dict
-        A dictionary containing information about the note. The dictionary should include:
+    note : NoteRecord
+        The note to archive. Uses:
         - 'filename' (str): The filename of the note.
-        - 'image_refs' (list of str): A list of image filenames associated with the note.
+        - 'image_refs' (tuple of str): The image filenames associated with the note.
     notes_dir : str
         The directory where the note file and images are located.
     temp_dir : str
@@ -93,20 +154,48 @@ def create_zip_archive(note, notes_dir, temp_dir):
         A URL-style reference to the zip archive's location.
     """
 
-    zip_filename = f"{note['filename'].replace('.md', '')}.zip"
+    zip_filename = f"{note.filename.replace('.md', '')}.zip"
     zip_path = temp_dir / zip_filename
 
     with zipfile.ZipFile(zip_path, 'w') as zipf:
-        note_path = notes_dir / note['filename']
-        zipf.write(note_path, arcname=note['filename'])
+        note_path = notes_dir / note.filename
+        zipf.write(note_path, arcname=note.filename)
 
-        for img in note.get('image_refs', []):
+        for img in note.image_refs:
             img_path = notes_dir / img
             if img_path.exists():
                 zipf.write(img_path, arcname=img)
 
     return zip_path, f'/temp/{zip_filename}'
 
+def get_markdown_preview(content, max_lines=10, max_chars=1000):
+    """
+    Returns the first lines of markdown content as preview.
+
+    Parameters
+    ----------
+    content : str
+        The markdown content of a note.
+    max_lines : int, optional
+        Maximum number of lines in the preview.
+    max_chars : int, optional
+        Maximum number of characters in the preview.
+
+    Returns
+    -------
+    str
+        The preview, ending with an ellipsis if the content was shortened.
+    """
+    if not content:
+        return "No content available"
+
+    lines = content.splitlines()
+    if len(lines) <= max_lines and len(content) <= max_chars:
+        return content
+
+    preview = '\n'.join(lines[:max_lines])[:max_chars] + '\n\n*....*'
+    return preview
+
 class NotesHandler():
     """
     A class for managing a collection of notes, including functionality to update note lists,
@@ -114,13 +203,45 @@ class NotesHandler():
 
     Attributes
     ----------
-    note_list : list of dict
-        A list of dictionaries, each containing metadata and content of a note.
+    note_list : list of NoteRecord
+        The indexed notes, each containing metadata and a short preview of a note.
+        The full content is loaded on demand with `get_content`.
+    note_table : NoteTable
+        Columnar summary of `note_list` used for sorting.
+    index : dict
+        Maps note filenames to their file stamps and note records, used to skip unchanged notes.
+    search_index : SearchIndex or None
+        Inverted index over the title, content and tags of the indexed notes, None while
+        it has not been loaded from the persisted note index yet.
+    store : IndexStore or None
+        The database the note index is persisted in, None if it is kept in memory only.
+    storage : Storage
+        Runs the file operations of the async methods in worker threads.
+    metadata : SidecarMetadataStore or LogMetadataStore or None
+        The store holding the images and tags of the notes, opened with the note index.
+    content_cache_hits, content_cache_misses : int
+        Number of `get_content` calls answered from the content cache and read from disk.
 
     Methods
     -------
-    update_notes_list(notes_dir)
-        Updates the note list by scanning the specified directory for markdown files.
+    load_index(notes_dir)
+        Loads the persisted note index and reads only notes changed since the last run.
+    load_search_index()
+        Builds the search index from the persisted search terms.
+    update_notes_list(notes_dir, full_rebuild=False)
+        Updates the note list by scanning the specified directory for new, changed or removed markdown files.
+    scan_changes(notes_dir)
+        Updates the note list like `update_notes_list` and returns the changed filenames.
+    rebuild_index(notes_dir)
+        Discards the note index and reads every note again.
+    search(query, limit=None, tags=())
+        Searches the indexed notes, best match first.
+    search_page(query, offset, count)
+        Searches the indexed notes and returns one page of them with the number of matches.
+    sorted_notes(by="modified", reverse=False)
+        Returns the indexed notes sorted by modification time or title.
+    get_content(note)
+        Returns the full content of a note, from a bounded cache or from disk.
     delete_note(note, notes_dir, callback=None)
         Deletes a specific note and its associated images, with an optional callback to execute after deletion.
     download_note(note, notes_dir, temp_dir)
@@ -129,12 +250,36 @@ class NotesHandler():
         Saves edited content for a note, including handling images and updating metadata.
     """
     
-    def __init__(self):
+    def __init__(self, content_cache_size=32 * 1024 * 1024, io_concurrency=4, metadata_store="sidecar"):
         self.note_list = []
-    
-    def update_notes_list(self, notes_dir):
+        self.note_table = NoteTable([])
+        self.index = {}
+        self.indexed_dir = None
+        self.search_index = SearchIndex()
+        self.store = None
+        self.storage = Storage(io_concurrency)
+        self.metadata_store = metadata_store
+        self.metadata = None
+        # the index is updated from worker threads, one update at a time
+        self._update_lock = threading.RLock()
+        self._content_lock = threading.Lock()
+        # search index changes made while it is loaded in the background
+        self._pending_search = None
+        self._search_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # least recently used note contents, bounded by their total length
+        self.content_cache_size = content_cache_size
+        self._content_cache = OrderedDict()
+        self._content_cache_used = 0
+        self.content_cache_hits = 0
+        self.content_cache_misses = 0
+
+    def load_index(self, notes_dir):
         """
-        Scans the specified directory for markdown files and updates the note list with metadata.
+        Loads the persisted note index of a directory and validates it against the file stamps,
+        so only notes changed since the last run are read from disk.
+
+        The search index is not loaded here, see `load_search_index`.
 
         Parameters
         ----------
@@ -143,58 +288,568 @@ class NotesHandler():
 
         Returns
         -------
-        list of dict
-            A list of dictionaries containing metadata and content for each note.
+        list of NoteRecord
+            The indexed notes with metadata and a preview for each note.
         """
-        self.note_list = []
+        try:
+            recover(notes_dir)
+        except Exception as e:
+            logger.error(f"Could not finish interrupted writes in {notes_dir}: {e}")
+
+        try:
+            self.store = IndexStore(get_index_path(notes_dir))
+            self.index = self.store.load_notes()
+            logger.info(f"Loaded {len(self.index)} notes from the note index at {self.store.path}")
+        except Exception as e:
+            logger.warning(f"Note index could not be loaded, notes will be read from disk: {e}")
+            self.store = None
+            self.index = {}
+
+        self.indexed_dir = notes_dir
+        self._open_metadata(notes_dir)
+        if self.store is not None:
+            self.search_index = None
+            self._pending_search = {}
+        return self.update_notes_list(notes_dir)
+
+    def load_search_index(self):
+        """
+        Loads the search index from its snapshot, or builds it from the persisted search terms,
+        without reading any note.
+
+        Notes changed since the snapshot was written are updated from their persisted search
+        terms. Safe to call from a worker thread. Changes to the note index made while loading
+        are applied afterwards.
+
+        Returns
+        -------
+        SearchIndex
+            The loaded search index.
+        """
+        with self._load_lock:
+            if self.search_index is not None:
+                return self.search_index
+            # notes changed meanwhile are indexed from their pending entries instead
+            pending = self._pending_search
+            stored = self.store.load_search_state()
+            if stored is None:
+                search_index = SearchIndex()
+                changed = None
+            else:
+                snapshot_stamps, state = stored
+                search_index = SearchIndex.from_state(state)
+                changed = []
+                for filename, stamp in self.store.load_stamps().items():
+                    if snapshot_stamps.pop(filename, None) != stamp:
+                        changed.append(filename)
+                # removed since the snapshot was written
+                for filename in snapshot_stamps:
+                    search_index.remove(filename)
+            for filename, term_scores, tags in self.store.iter_terms(changed):
+                if filename not in pending:
+                    search_index.add_scores(filename, term_scores, tags)
+            search_index.prepare()
+
+            with self._search_lock:
+                if self.search_index is not None:
+                    # rebuilt from the notes in the meantime
+                    return self.search_index
+                pending, self._pending_search = self._pending_search, None
+                for filename, entry in pending.items():
+                    if entry is None:
+                        search_index.remove(filename)
+                    else:
+                        search_index.add_scores(filename, *entry)
+                for filename in [f for f in search_index if f not in self.index]:
+                    search_index.remove(filename)
+                self.search_index = search_index
+
+            logger.info(f"Search index loaded with {len(search_index)} notes")
+            return search_index
+
+    @timed("update_notes_list")
+    def update_notes_list(self, notes_dir, full_rebuild=False):
+        """
+        Scans the specified directory for markdown files and updates the note list with metadata.
 
-        for filepath in notes_dir.iterdir():
-            if filepath.suffix == '.md' and not filepath.name.startswith('.'):
-                filename = filepath.name
-                kr_filepath = notes_dir / f".{filename}.kurup"
+        Only notes whose markdown file or kurup metadata file changed since the last scan
+        (compared by modification time in nanoseconds and size) are read again, removed
+        files are dropped from the index.
+
+        Parameters
+        ----------
+        notes_dir : str
+            The directory where the markdown notes are stored.
+        full_rebuild : bool, optional
+            If True, the index is discarded and every note is read again.
+
+        Returns
+        -------
+        list of NoteRecord
+            The indexed notes with metadata and a preview for each note.
+        """
+        with self._update_lock:
+            return self._update_notes_list(notes_dir, full_rebuild)
+
+    def _update_notes_list(self, notes_dir, full_rebuild):
+        if full_rebuild or self.indexed_dir != notes_dir:
+            logger.info(f"Rebuilding note index for {notes_dir}")
+            with self._search_lock:
+                self.index = {}
+                self.search_index = SearchIndex()
+                self._pending_search = None
+            self.indexed_dir = notes_dir
+            self._open_metadata(notes_dir)
+            if self.store is not None:
+                self.store.clear()
+
+        seen = set()
+        read_count = 0
+        batch = WriteBatch(get_journal_dir(notes_dir), durable=False)
+        created = []
+        with os.scandir(notes_dir) as entries:
+            for entry in entries:
+                filename = entry.name
+                if not filename.endswith('.md') or filename.startswith('.') or not entry.is_file():
+                    continue
+                seen.add(filename)
 
                 try:
-                    content = filepath.read_text(encoding='utf-8')
-                    title = filepath.stem.replace('_', ' ')
-                    modified_time = datetime.fromtimestamp(filepath.stat().st_mtime)
-                    pattern = rf"!\[.*?\]\(/{notes_dir.name}/([^)]+)\)"
-                    image_refs = list(set(re.findall(pattern, content)))
+                    stamp = self._get_stamp(entry, notes_dir)
+                except FileNotFoundError:
+                    # removed between listing and stat
+                    seen.discard(filename)
+                    continue
+
+                cached = self.index.get(filename)
+                if cached is not None and cached['stamp'] == stamp:
+                    continue
+
+                note, content = self._read_note(notes_dir / filename, notes_dir, batch)
+                read_count += 1
+                if note is None:
+                    self._remove_from_index(filename)
+                    continue
+                # the metadata file may have been created while reading the note
+                stamp = self._get_stamp(entry, notes_dir)
+                if stamp[2] is None:
+                    created.append((entry, note, content))
+                else:
+                    self._add_to_index(note, content, stamp)
+        self._add_created(batch, created, notes_dir)
 
-                    try:
-                        kurup_data = json.loads(kr_filepath.read_text(encoding='utf-8'))
-                        logger.info(f"kurup metadata file read from {str(kr_filepath.name)}")
-                        if isinstance(kurup_data.get(filename), list):
-                            # old format - just images, until v. 0.1.1
-                            tags = []
-                            images = kurup_data.get(filename, [])
-                        else:
-                            # new format - dict with images and tags
-                            metadata = kurup_data.get(filename, {})
-                            tags = metadata.get('tags', [])
-                            images = metadata.get('images', image_refs)
-                    except FileNotFoundError:
-                        logger.warning(f"kurup metadata file not found at {str(kr_filepath.name)}")
-                        logger.info(f"Creating kurup metadata file at {str(kr_filepath.name)}")
-                        kurup_metadata = {filename: {"images":image_refs,"tags":[]}}
-                        kr_filepath.write_text(json.dumps(kurup_metadata), encoding="utf-8")
-                        kurup_data = json.loads(kr_filepath.read_text(encoding='utf-8'))
-                        tags = []
-                        images = image_refs
-                    
-                    self.note_list.append({
-                        'filename': filename,
-                        'title': title,
-                        'modified': modified_time,
-                        'content': content,
-                        'image_refs': images,
-                        'tags': tags,
-                        'kurup_ref': kurup_data.get(filename)
-                    })
-                        
-                except Exception as e:
-                    logger.error(f"Error processing note {filename}: {e}")
+        for filename in self.index.keys() - seen:
+            self._remove_from_index(filename)
+        with self._search_lock:
+            if self.search_index is not None:
+                self.search_index.prepare()
 
+        if read_count:
+            logger.info(f"Note index updated, {read_count} of {len(self.index)} notes read from disk")
+        if self.store is not None:
+            self.store.commit()
+
+        self._refresh_note_list()
         return self.note_list
+
+    @timed("update_notes_list")
+    def scan_changes(self, notes_dir):
+        """
+        Scans the directory like `update_notes_list`, for watching it without file system events.
+
+        Parameters
+        ----------
+        notes_dir : str
+            The directory where the markdown notes are stored.
+
+        Returns
+        -------
+        set of str
+            The filenames of notes that were added, changed or removed.
+        """
+        with self._update_lock:
+            before = {filename: entry['stamp'] for filename, entry in self.index.items()}
+            self._update_notes_list(notes_dir, False)
+            after = self.index
+            return {filename for filename in before.keys() | after.keys()
+                    if filename not in before or filename not in after
+                    or before[filename] != after[filename]['stamp']}
+
+    def update_notes(self, notes_dir, filenames):
+        """
+        Updates the note index for the given files only, without scanning the whole directory.
+
+        Parameters
+        ----------
+        notes_dir : str
+            The directory where the markdown notes are stored.
+        filenames : iterable of str
+            Names of changed files, either markdown notes or their kurup metadata files.
+
+        Returns
+        -------
+        set of str
+            The filenames of notes that were added, changed or removed.
+        """
+        with self._update_lock:
+            return self._update_notes(notes_dir, filenames)
+
+    def _update_notes(self, notes_dir, filenames):
+        if self.indexed_dir != notes_dir:
+            self._update_notes_list(notes_dir, False)
+            return set(self.index)
+
+        note_filenames = set()
+        for filename in filenames:
+            if is_sidecar_name(filename):
+                filename = filename[1:-len('.kurup')]
+            if filename.endswith('.md') and not filename.startswith('.'):
+                note_filenames.add(filename)
+
+        changed = set()
+        batch = WriteBatch(get_journal_dir(notes_dir), durable=False)
+        created = []
+        for filename in note_filenames:
+            filepath = notes_dir / filename
+            try:
+                if not filepath.is_file():
+                    raise FileNotFoundError(filename)
+                stamp = self._get_stamp(filepath, notes_dir)
+            except FileNotFoundError:
+                if self._remove_from_index(filename):
+                    changed.add(filename)
+                continue
+
+            cached = self.index.get(filename)
+            if cached is not None and cached['stamp'] == stamp:
+                continue
+
+            note, content = self._read_note(filepath, notes_dir, batch)
+            if note is None:
+                if self._remove_from_index(filename):
+                    changed.add(filename)
+                continue
+            stamp = self._get_stamp(filepath, notes_dir)
+            if stamp[2] is None:
+                created.append((filepath, note, content))
+            else:
+                self._add_to_index(note, content, stamp)
+            changed.add(filename)
+        self._add_created(batch, created, notes_dir)
+
+        if changed:
+            self._refresh_note_list()
+            if self.store is not None:
+                self.store.commit()
+        return changed
+
+    def rebuild_index(self, notes_dir):
+        """
+        Discards the note index and reads every note in the directory again.
+
+        Parameters
+        ----------
+        notes_dir : str
+            The directory where the markdown notes are stored.
+
+        Returns
+        -------
+        list of NoteRecord
+            The indexed notes with metadata and a preview for each note.
+        """
+        return self.update_notes_list(notes_dir, full_rebuild=True)
+
+    @timed("search")
+    def search(self, query, limit=None, tags=()):
+        """
+        Searches the title, content and tags of the indexed notes.
+
+        Waits for the search index if it is still being loaded, see `load_search_index`, so
+        this runs in a worker thread.
+
+        Parameters
+        ----------
+        query : str
+            Whitespace separated search terms which all have to match, ``tag:name`` or ``#name``
+            restrict the results to notes with that tag.
+        limit : int, optional
+            Maximum number of results to return.
+        tags : iterable of str, optional
+            Further tags every result must have, case-insensitive like ``tag:name``.
+
+        Returns
+        -------
+        list of NoteRecord
+            The matching notes, best match first.
+        """
+        search_index = self.search_index or self.load_search_index()
+        # the index is updated from worker threads, results are collected under the same lock
+        with self._search_lock:
+            return [self.index[filename]['note'] for filename in search_index.search(query, limit, tags)
+                    if filename in self.index]
+
+    def search_page(self, query, offset, count):
+        """
+        Searches the indexed notes and ranks only the ones up to the requested page.
+
+        Waits for the search index like `search`, so this runs in a worker thread.
+
+        Parameters
+        ----------
+        query : str
+            Whitespace separated search terms, see `search`.
+        offset : int
+            Number of best matches to skip.
+        count : int
+            Maximum number of notes to return.
+
+        Returns
+        -------
+        notes : list of NoteRecord
+            The matching notes on the page, best match first.
+        total : int
+            Number of matching notes.
+        complete : bool
+            False if very common search terms matched only part of the notes they occur in.
+        """
+        search_index = self.search_index or self.load_search_index()
+        with self._search_lock:
+            filenames, total, complete = search_index.search_page(query, offset, count)
+            return [self.index[filename]['note'] for filename in filenames if filename in self.index], total, complete
+
+    def sorted_notes(self, by="modified", reverse=False):
+        """
+        Returns the indexed notes sorted by modification time or title.
+
+        Parameters
+        ----------
+        by : str, optional
+            Either "modified" or "title".
+        reverse : bool, optional
+            Sort in descending order.
+
+        Returns
+        -------
+        list of NoteRecord
+            A new list of the sorted notes.
+        """
+        return self.note_table.sorted(by, reverse)
+
+    def _refresh_note_list(self):
+        self.note_list = [entry['note'] for entry in self.index.values()]
+        self.note_table = NoteTable(self.note_list, previous=self.note_table)
+
+    def get_content(self, note):
+        """
+        Returns the full markdown content of a note.
+
+        Recently used contents are kept in a cache bounded by `content_cache_size` characters,
+        entries are invalidated when the note's file stamps change.
+
+        Parameters
+        ----------
+        note : NoteRecord
+            The note.
+
+        Returns
+        -------
+        str
+            The content of the note, or an empty string if it could not be read.
+        """
+        filename = note.filename
+        entry = self.index.get(filename)
+        stamp = entry['stamp'] if entry else None
+
+        with self._content_lock:
+            cached = self._content_cache.get(filename)
+            if cached is not None and cached[0] == stamp:
+                self._content_cache.move_to_end(filename)
+                self.content_cache_hits += 1
+                return cached[1]
+            self.content_cache_misses += 1
+
+        try:
+            content = (self.indexed_dir / filename).read_text(encoding='utf-8')
+        except Exception as e:
+            logger.error(f"Error reading note {filename}: {e}")
+            return ""
+
+        with self._content_lock:
+            self._drop_cached_content(filename)
+            if len(content) <= self.content_cache_size:
+                self._content_cache[filename] = (stamp, content)
+                self._content_cache_used += len(content)
+                while self._content_cache_used > self.content_cache_size:
+                    oldest = next(iter(self._content_cache))
+                    self._drop_cached_content(oldest)
+        return content
+
+    def _drop_content(self, filename):
+        with self._content_lock:
+            self._drop_cached_content(filename)
+
+    def _drop_cached_content(self, filename):
+        cached = self._content_cache.pop(filename, None)
+        if cached is not None:
+            self._content_cache_used -= len(cached[1])
+
+    def _add_to_index(self, note, content, stamp):
+        filename = note.filename
+        term_scores = get_term_scores(note.title, content, note.tags)
+        self._drop_content(filename)
+        with self._search_lock:
+            self.index[filename] = {'stamp': stamp, 'note': note}
+            if self.search_index is not None:
+                self.search_index.add_scores(filename, term_scores, note.tags)
+            else:
+                self._pending_search[filename] = (term_scores, note.tags)
+        if self.store is not None:
+            self.store.put(filename, stamp, note, term_scores)
+
+    def _remove_from_index(self, filename):
+        self._drop_content(filename)
+        with self._search_lock:
+            removed = self.index.pop(filename, None) is not None
+            if self.search_index is not None:
+                self.search_index.remove(filename)
+            else:
+                self._pending_search[filename] = None
+        if self.store is not None:
+            self.store.delete(filename)
+        return removed
+
+    def image_refcounts(self, exclude=None):
+        """
+        Counts the notes referencing each image, according to the images lists in the kurup metadata.
+
+        Parameters
+        ----------
+        exclude : str, optional
+            The filename of a note whose images are not counted.
+
+        Returns
+        -------
+        Counter
+            Maps image filenames to the number of indexed notes referencing them.
+        """
+        return Counter(
+            img
+            for note in self.note_list if note.filename != exclude
+            for img in set(note.image_refs)
+        )
+
+    @timed("save_note")
+    def save_new_note(self, notes_dir, temp_dir, filename, content, tags, in_use=None):
+        """
+        Moves the pasted images of a new note into the image store and writes the note with its metadata.
+
+        Parameters
+        ----------
+        notes_dir : Path
+            The directory where the notes are stored.
+        temp_dir : Path
+            The directory where pasted images are stored temporarily.
+        filename : str
+            The filename of the new note.
+        content : str
+            The markdown content, referencing pasted images in `temp_dir`.
+        tags : list of str
+            The tags of the note.
+        in_use : callable, optional
+            Called with the filename of a pasted image, True if another unsaved note uses it too.
+        """
+        # images are shared between notes, deletes must not run in between
+        with self._update_lock:
+            updated_content, img_list = save_images(content, notes_dir, temp_dir, in_use)
+            write_note(notes_dir, filename, updated_content, img_list, tags, self.metadata)
+            self._update_notes(notes_dir, [filename])
+
+    def close(self):
+        """Writes pending changes and closes the note index and the metadata store."""
+        if self.store is not None:
+            if self.search_index is not None:
+                with self._search_lock:
+                    stamps = {filename: entry['stamp'] for filename, entry in self.index.items()
+                              if filename in self.search_index}
+                    self.store.save_search_state(stamps, self.search_index.get_state())
+            self.store.close()
+        if self.metadata is not None:
+            self.metadata.close()
+
+    def _open_metadata(self, notes_dir):
+        if self.metadata is not None:
+            if self.metadata.notes_dir == notes_dir:
+                return
+            self.metadata.close()
+        self.metadata = open_metadata_store(notes_dir, self.metadata_store)
+
+    def _get_stamp(self, entry, notes_dir):
+        """Returns the (mtime_ns, size) stamp of a note (a DirEntry or Path) and the stamp of its kurup metadata."""
+        st = entry.stat()
+        return (st.st_mtime_ns, st.st_size, self.metadata.stamp(entry.name))
+
+    def _add_created(self, batch, created, notes_dir):
+        """Writes the metadata created while reading notes, then indexes those notes with it."""
+        try:
+            batch.commit()
+        except Exception as e:
+            logger.error(f"Could not create kurup metadata in {notes_dir}: {e}")
+        for path, note, content in created:
+            self._add_to_index(note, content, self._get_stamp(path, notes_dir))
+
+    def _read_note(self, filepath, notes_dir, batch=None):
+        """
+        Reads a single note and its kurup metadata.
+
+        Parameters
+        ----------
+        filepath : Path
+            The path of the markdown note.
+        notes_dir : str
+            The directory where the markdown notes are stored.
+        batch : WriteBatch, optional
+            Metadata created for a note without it is written as part of this batch, which
+            the caller commits, otherwise right away.
+
+        Returns
+        -------
+        note : NoteRecord or None
+            The note record, or None if the note could not be read.
+        content : str or None
+            The content of the note, which is not kept in the note record.
+        """
+        filename = filepath.name
+
+        try:
+            content = filepath.read_text(encoding='utf-8')
+            title = filepath.stem.replace('_', ' ')
+            mtime_ns = filepath.stat().st_mtime_ns
+            image_refs = md_refs.image_filenames(content, notes_dir)
+
+            metadata = self.metadata.get(filename)
+            if metadata is None:
+                logger.warning(f"kurup metadata not found for {filename}")
+                logger.info(f"Creating kurup metadata for {filename}")
+                self.metadata.put(filename, image_refs, [], batch)
+                metadata = {"images": image_refs, "tags": []}
+            tags = metadata.get('tags', [])
+            images = metadata.get('images', image_refs)
+
+            note = NoteRecord.create(
+                filename=filename,
+                title=title,
+                mtime_ns=mtime_ns,
+                size=len(content),
+                preview=get_markdown_preview(content),
+                image_refs=images,
+                tags=tags,
+                has_kurup_ref=bool(metadata),
+            )
+            return note, content
+
+        except Exception as e:
+            logger.error(f"Error processing note {filename}: {e}")
+            return None, None
     
     def delete_note(self, note, notes_dir, callback=None):
         """
@@ -202,31 +857,35 @@ class NotesHandler():
         
         Parameters
         ----------
-        note : dict
-            The note to be deleted, containing 'filename', 'title', 'image_refs', and 'kurup_ref'.
+        note : NoteRecord
+            The note to be deleted.
         notes_dir : str
             The directory where the note and associated files are stored.
         callback : callable, optional
             An optional callback function to execute after the note is deleted.
         """
-        def confirm_delete():
-            if delete_note_and_images(note, notes_dir):
-                ui.notify(f"Deleted {note['filename']}")
+        async def confirm_delete():
+            if await self.storage.run(self._delete_note, note, notes_dir):
+                ui.notify(f"Deleted {note.filename}")
                 if callback:
-                    callback()
-                logging.info(f"Deleted {note['filename']}")
+                    result = callback()
+                    if inspect.isawaitable(result):
+                        await result
+                logging.info(f"Deleted {note.filename}")
             else:
-                ui.notify(f"Failed to delete {note['filename']}", color='negative')
-            dialog.close()
-            dialog.delete()
+                ui.notify(f"Failed to delete {note.filename}", color='negative')
+            # the callback may have re-rendered the element holding the dialog
+            if not dialog.is_deleted:
+                dialog.close()
+                dialog.delete()
 
         
         dialog = ui.dialog()
         with dialog:
             with ui.card():
-                ui.label(f"Delete '{note['title']}'?").classes('text-h6 q-pa-md')
-                if note['kurup_ref']:
-                    ui.label(f"This will permanently delete the note and {len(note['image_refs'])} associated images.").classes('q-pa-md')
+                ui.label(f"Delete '{note.title}'?").classes('text-h6 q-pa-md')
+                if note.has_kurup_ref:
+                    ui.label(f"This will permanently delete the note and {len(note.image_refs)} associated images.").classes('q-pa-md')
                 else:
                     ui.label("This will permanently delete the note.")
                 with ui.card_actions().classes('justify-end'):
@@ -234,36 +893,37 @@ class NotesHandler():
                     ui.button('Delete', color='negative', on_click=confirm_delete)
         dialog.open()
 
-    def download_note(self, note, notes_dir, temp_dir):
+    def _delete_note(self, note, notes_dir):
+        with self._update_lock:
+            # saves update the index right away, it knows every note sharing images with this one
+            refcounts = self.image_refcounts(exclude=note.filename)
+            keep_images = {img for img in note.image_refs if refcounts[img]}
+            deleted = delete_note_and_images(note, notes_dir, self.metadata, keep_images)
+            self._update_notes(notes_dir, [note.filename])
+            return deleted
+
+    async def download_note(self, note, notes_dir, temp_dir, janitor=None):
         """
         Downloads a note and its associated images as a zip archive.
 
         Parameters
         ----------
-        note : dict
-            The note to be downloaded, containing 'filename' and 'image_refs'.
+        note : NoteRecord
+            The note to be downloaded.
         notes_dir : str
             The directory where the note and images are stored.
         temp_dir : str
             The directory where the zip archive will be temporarily saved.
+        janitor : TempJanitor, optional
+            Removes the zip archive once it was downloaded.
         """
-        zip_path, zip_url = create_zip_archive(note, notes_dir, temp_dir)
+        zip_path, zip_url = await self.storage.run(create_zip_archive, note, notes_dir, temp_dir)
+        if janitor is not None:
+            janitor.track(zip_path, DOWNLOAD_TTL)
         ui.download(zip_url)
 
 
-        def cleanup():
-            time.sleep(10)
-            try:
-                if zip_path.exists():
-                    zip_path.unlink()
-                    print(f"Deleted zip: {zip_path}")
-            except Exception as e:
-                print(f"Error deleting zip file: {e}")
-
-        threading.Thread(target=cleanup, daemon=True).start()
-        
-
-    def save_note_edits(self, temp_image_handler, edit_area_val, note, notes_dir, temp_dir, tags=None):
+    async def save_note_edits(self, temp_image_handler, edit_area_val, note, notes_dir, temp_dir, tags=None, in_use=None):
         """
         Saves the edited content of a note, including handling images and updating associated metadata.
 
@@ -273,35 +933,51 @@ class NotesHandler():
             An object responsible for managing temporary image references.
         edit_area_val : str
             The updated content of the note, including any changes to image references.
-        note : dict
-            The note being edited, containing 'filename', 'image_refs', and other metadata.
+        note : NoteRecord
+            The note being edited.
         notes_dir : str
             The directory where the note and associated images are stored.
         temp_dir : str
             The directory where temporary images are stored.
+        tags : list of str, optional
+            The tags of the note.
+        in_use : callable, optional
+            Called with the filename of a temporary image, True if another unsaved note uses it too.
         """
 
         try:
-            old_image_refs = note['image_refs']
-            temp_image_handler.temp_image_refs = get_image_refs(edit_area_val, temp_dir)
+            await self.storage.run(
+                self._write_note_edits, temp_image_handler, edit_area_val, note, notes_dir, temp_dir, tags, in_use
+            )
+            ui.notify(f"Saved changes to {note.filename}")
+            logging.info(f"Saved changes to {note.filename}")
 
-            for img_ref in temp_image_handler.temp_image_refs:
-                img_file = img_ref.replace(f'/{temp_dir.name}/', '')
-                img_path = temp_dir / img_file
-                if not img_path.exists():
-                    print(f"Warning: Referenced temp file does not exist: {img_path}")
-                    edit_area_val = edit_area_val.replace(img_ref, '')
+        except Exception as e:
+            ui.notify(f"Error saving changes: {str(e)}", color='negative')
+            print(f"Detailed error: {e}")
 
-            updated_content, img_list = save_images(edit_area_val, notes_dir, temp_dir)
+    @timed("edit_note")
+    def _write_note_edits(self, temp_image_handler, edit_area_val, note, notes_dir, temp_dir, tags, in_use=None):
+        """Writes an edited note, its images and metadata, runs in a worker thread"""
+        # images are shared between notes, deletes must not run in between
+        with self._update_lock:
+            old_image_refs = note.image_refs
+            temp_image_handler.temp_image_refs = get_image_refs(edit_area_val, temp_dir)
+            # references to missing temp images are left as they are by save_images
+            updated_content, img_list = save_images(edit_area_val, notes_dir, temp_dir, in_use)
 
-            note_path = notes_dir / note['filename']
-            note_path.write_text(updated_content, encoding='utf-8')
+            new_image_refs = md_refs.image_filenames(updated_content, notes_dir)
 
-            new_image_pattern = rf'!\[.*?\]\(/({notes_dir.name})/([^)]+)\)'
-            new_image_refs = [match[1] for match in re.findall(new_image_pattern, updated_content)]
+            if tags is None:
+                tags=[]
+            # the note and its metadata are replaced together, before unused images are removed
+            write_notes(notes_dir, [(note.filename, updated_content, new_image_refs, tags)], self.metadata)
 
+            # only images no other note references are removed
+            self._update_notes(notes_dir, [note.filename])
+            refcounts = self.image_refcounts(exclude=note.filename)
             for img in old_image_refs:
-                if img not in new_image_refs:
+                if img not in new_image_refs and not refcounts[img]:
                     img_path = notes_dir / img
                     try:
                         if img_path.exists():
@@ -309,22 +985,10 @@ class NotesHandler():
                     except Exception as e:
                         print(f"Error removing unused image {img}: {e}")
 
-            kr_filepath = notes_dir / f".{note['filename']}.kurup"
-            try:
-                kurup_file_dict = json.loads(kr_filepath.read_text(encoding='utf-8'))
-            except FileNotFoundError:
-                kurup_file_dict = {}
-
-            if tags is None:
-                tags=[]
-            kurup_file_dict[note['filename']] = {
-                "images": new_image_refs,
-                "tags": tags
-            }
-            kr_filepath.write_text(json.dumps(kurup_file_dict), encoding='utf-8')
-
             # delete temp images afterwards, needs tests.
             for img in temp_image_handler.temp_images:
+                if in_use is not None and in_use(img):
+                    continue
                 img_path = temp_dir / img
                 try:
                     if img_path.exists():
@@ -334,10 +998,3 @@ class NotesHandler():
 
             temp_image_handler.temp_images = []
 
-            ui.notify(f"Saved changes to {note['filename']}")
-            logging.info(f"Saved changes to {note['filename']}")
-
-        except Exception as e:
-            ui.notify(f"Error saving changes: {str(e)}", color='negative')
-            print(f"Detailed error: {e}")
-
@@ -0,0 +1,162 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from pathlib import Path
+
+try:
+    from watchfiles import awatch
+except ImportError:  # watchfiles is optional, fall back to polling
+    awatch = None
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+
+def is_note_file(path):
+    """
+    Checks if a path is a markdown note or a kurup metadata file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the changed file.
+
+    Returns
+    -------
+    bool
+        True if changes to this file affect the note list.
+    """
+    name = Path(path).name
+    if name.endswith('.md.kurup'):
+        return name.startswith('.')
+    return name.endswith('.md') and not name.startswith('.')
+
+
+class NotesWatcher():
+    """
+    Watches the notes directory and pushes changed notes into the note index.
+
+    Uses inotify (through watchfiles) when available and falls back to polling the
+    note index stamps otherwise. Changes are debounced and coalesced, so a syncing tool
+    writing thousands of files results in a handful of index updates and UI refreshes.
+
+    Attributes
+    ----------
+    notes_handler : NotesHandler
+        The handler whose note index is kept up to date.
+    notes_dir : Path
+        The directory to watch.
+    debounce_ms : int
+        Maximum time in milliseconds to collect changes before they are applied.
+    poll_interval : float
+        Seconds between scans when polling.
+    listeners : list of callable
+        Called with the set of changed note filenames after every applied batch.
+    """
+
+    def __init__(self, notes_handler, notes_dir, debounce_ms=1000, poll_interval=5.0):
+        self.notes_handler = notes_handler
+        self.notes_dir = notes_dir
+        self.debounce_ms = debounce_ms
+        self.poll_interval = poll_interval
+        self.listeners = []
+        self._stop_event = None
+        self._task = None
+
+    def add_listener(self, callback):
+        """Registers a callback receiving the set of changed note filenames."""
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Removes a previously registered callback."""
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def start(self):
+        """Starts watching in a background task of the running event loop."""
+        self._stop_event = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops watching and waits for the background task to finish."""
+        if self._stop_event:
+            self._stop_event.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, timeout=self.poll_interval + 1)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        if awatch is not None:
+            try:
+                await self._watch()
+                return
+            except Exception as e:
+                logger.warning(f"Watching {self.notes_dir} failed, polling instead: {e}")
+        else:
+            logger.info(f"watchfiles not installed, polling {self.notes_dir} for changes")
+        await self._poll()
+
+    async def _watch(self):
+        logger.info(f"Watching {self.notes_dir} for changes")
+        async for changes in awatch(
+            self.notes_dir,
+            watch_filter=lambda _, path: is_note_file(path),
+            debounce=self.debounce_ms,
+            recursive=False,
+            stop_event=self._stop_event,
+        ):
+            await self._apply({Path(path).name for _, path in changes})
+
+    async def _poll(self):
+        while not self._stop_event.is_set():
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.poll_interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            # the index is compared in the worker thread changing it, one failed scan does not stop polling
+            try:
+                changed = await self.notes_handler.storage.run(self.notes_handler.scan_changes, self.notes_dir)
+                self._notify(changed)
+            except Exception as e:
+                logger.error(f"Error scanning {self.notes_dir} for changes: {e}")
+
+    async def _apply(self, filenames):
+        try:
+            changed = await self.notes_handler.storage.run(
+                self.notes_handler.update_notes, self.notes_dir, filenames
+            )
+        except Exception as e:
+            logger.error(f"Error updating notes after changes in {self.notes_dir}: {e}")
+            return
+        self._notify(changed)
+
+    def _notify(self, changed):
+        if not changed:
+            return
+        logger.info(f"{len(changed)} notes changed on disk")
+        for callback in list(self.listeners):
+            try:
+                callback(changed)
+            except Exception as e:
+                logger.error(f"Error refreshing notes after changes on disk: {e}")
@@ -0,0 +1,477 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# score weights of the indexed fields
+FIELD_WEIGHTS = {'title': 3.0, 'tags': 2.0, 'content': 1.0}
+
+# score multipliers depending on how a query term matched an indexed term
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.7
+SUBSTRING_MATCH = 0.4
+
+# query terms shorter than this only match exactly or as prefix
+MIN_SUBSTRING_LENGTH = 3
+# maximum number of postings the prefix and substring matches of a term are taken from,
+# the closest matching terms first, so a short or common term does not score every note
+MAX_EXPANSION_POSTINGS = 10000
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase word tokens.
+
+    Parameters
+    ----------
+    text : str
+        The text to tokenize.
+
+    Returns
+    -------
+    list of str
+        The tokens in order of appearance.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def get_term_scores(title, content, tags):
+    """
+    Computes the weighted score of every term of a note.
+
+    Parameters
+    ----------
+    title : str
+        The title of the note.
+    content : str
+        The markdown content of the note.
+    tags : list of str
+        The tags of the note.
+
+    Returns
+    -------
+    dict
+        Maps each term to its score in this note.
+    """
+    scores = {}
+    fields = (('title', title), ('tags', ' '.join(tags)), ('content', content))
+    for field, text in fields:
+        weight = FIELD_WEIGHTS[field]
+        for term, count in Counter(tokenize(text)).items():
+            scores[term] = scores.get(term, 0.0) + weight * (1.0 + math.log(count))
+    return scores
+
+
+def _trigrams(term):
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+class SearchIndex():
+    """
+    A tokenized inverted index over the title, content and tags of notes.
+
+    Queries are split into whitespace separated terms which all have to match (boolean AND).
+    A term matches indexed terms exactly, as prefix or as substring, in decreasing order of
+    score. Terms written as ``tag:name`` or ``#name`` filter on whole tags instead.
+
+    Not thread safe, searches must not run while the index is changed.
+
+    Attributes
+    ----------
+    postings : dict
+        Maps each term to a dictionary of note ids and the term's score in that note.
+    tag_postings : dict
+        Maps each lowercase tag to the set of note ids having it.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.tag_postings = {}
+        self._doc_terms = {}
+        self._doc_tags = {}
+        # built by `prepare` or on first use, then kept up to date
+        self._sorted_terms = None
+        self._trigram_terms = None
+
+    def __len__(self):
+        return len(self._doc_tags)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_tags
+
+    def __iter__(self):
+        return iter(self._doc_tags)
+
+    def get_state(self):
+        """
+        Returns the postings of the index, e.g. to persist them with `marshal`.
+
+        Returns
+        -------
+        tuple
+            Only built-in types, see `from_state`.
+        """
+        tag_postings = {tag: list(docs) for tag, docs in self.tag_postings.items()}
+        return self.postings, tag_postings, self._doc_tags
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Creates an index from the state returned by `get_state`.
+
+        Parameters
+        ----------
+        state : tuple
+            The state of an index.
+
+        Returns
+        -------
+        SearchIndex
+            The restored index.
+        """
+        index = cls()
+        index.postings, tag_postings, index._doc_tags = state
+        index.tag_postings = {tag: set(docs) for tag, docs in tag_postings.items()}
+        # derived from the postings when a note is first replaced or removed
+        index._doc_terms = None
+        return index
+
+    def add(self, doc_id, title, content, tags):
+        """
+        Adds a note to the index, replacing an already indexed version of it.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the note, usually its filename.
+        title : str
+            The title of the note.
+        content : str
+            The markdown content of the note.
+        tags : list of str
+            The tags of the note.
+        """
+        self.add_scores(doc_id, get_term_scores(title, content, tags), tags)
+
+    def add_scores(self, doc_id, term_scores, tags):
+        """
+        Adds a note to the index from precomputed term scores, see `get_term_scores`.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the note, usually its filename.
+        term_scores : dict
+            Maps each term of the note to its score.
+        tags : list of str
+            The tags of the note.
+        """
+        if doc_id in self._doc_tags:
+            self.remove(doc_id)
+
+        for term, score in term_scores.items():
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = {}
+                self._add_term(term)
+            docs[doc_id] = score
+        if self._doc_terms is not None:
+            self._doc_terms[doc_id] = tuple(term_scores)
+
+        doc_tags = tuple({tag.lower() for tag in tags})
+        for tag in doc_tags:
+            self.tag_postings.setdefault(tag, set()).add(doc_id)
+        self._doc_tags[doc_id] = doc_tags
+
+    def remove(self, doc_id):
+        """
+        Removes a note from the index, if it is indexed.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the note.
+        """
+        if doc_id not in self._doc_tags:
+            return
+        for term in self._get_doc_terms().pop(doc_id, ()):
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+                self._remove_term(term)
+
+        for tag in self._doc_tags.pop(doc_id, ()):
+            docs = self.tag_postings.get(tag)
+            if docs is not None:
+                docs.discard(doc_id)
+                if not docs:
+                    del self.tag_postings[tag]
+
+    def clear(self):
+        """Removes all notes from the index."""
+        self.__init__()
+
+    def prepare(self):
+        """
+        Builds the sorted vocabulary and the trigram map of prefix and substring matches.
+
+        Both are otherwise built by the first search. Call it after adding many notes, e.g.
+        from a worker thread, so no search has to wait for it.
+        """
+        self._get_sorted_terms()
+        self._get_trigram_terms()
+
+    def search(self, query, limit=None, tags=()):
+        """
+        Searches the index.
+
+        Parameters
+        ----------
+        query : str
+            Whitespace separated search terms, ``tag:name`` or ``#name`` filter by tag.
+        limit : int, optional
+            Maximum number of results to return.
+        tags : iterable of str, optional
+            Further tags every result must have, compared case-insensitively like tag filters
+            in the query.
+
+        Returns
+        -------
+        list of str
+            Ids of the matching notes, best match first. Empty if the query has no terms.
+        """
+        return self.search_page(query, 0, limit, tags)[0]
+
+    def search_page(self, query, offset=0, count=None, tags=()):
+        """
+        Searches the index and ranks only the notes up to the requested page.
+
+        Parameters
+        ----------
+        query : str
+            Whitespace separated search terms, ``tag:name`` or ``#name`` filter by tag.
+        offset : int, optional
+            Number of best matches to skip.
+        count : int, optional
+            Maximum number of results to return, all remaining ones if not given.
+        tags : iterable of str, optional
+            Further tags every result must have, see `search`.
+
+        Returns
+        -------
+        ids : list of str
+            Ids of the matching notes on the page, best match first.
+        total : int
+            Number of matching notes.
+        complete : bool
+            False if a term matched more indexed terms than `MAX_EXPANSION_POSTINGS` allows,
+            so notes containing only the least close of them are missing from the results.
+        """
+        scores, complete = self._score(query, tags)
+        end = None if count is None else offset + count
+        if end is not None and end < len(scores):
+            # only notes scoring at least as high as the last one on the page can be on it
+            threshold = heapq.nlargest(end, scores.values())[-1]
+            ids = [doc_id for doc_id, score in scores.items() if score >= threshold]
+        else:
+            ids = list(scores)
+        # sorting is stable, so notes with equal scores stay ordered by id
+        ids.sort()
+        ids.sort(key=scores.__getitem__, reverse=True)
+        return ids[offset:end], len(scores), complete
+
+    @staticmethod
+    def parse_query(query):
+        """
+        Splits a query into search terms and tag filters.
+
+        Parameters
+        ----------
+        query : str
+            The search query.
+
+        Returns
+        -------
+        words : list of str
+            The lowercase search terms.
+        tags : set of str
+            The lowercase tags every result must have.
+        """
+        words = []
+        tags = set()
+        for part in (query or '').split():
+            lowered = part.lower()
+            if lowered.startswith('tag:') and len(lowered) > 4:
+                tags.add(lowered[4:])
+            elif lowered.startswith('#') and len(lowered) > 1 and not lowered.startswith('##'):
+                tags.add(lowered[1:])
+            else:
+                words.extend(tokenize(lowered))
+        return words, tags
+
+    def _score(self, query, tags):
+        """Returns the score of every matching note and whether all matching terms were used."""
+        words, query_tags = self.parse_query(query)
+        tags = query_tags | {tag.lower() for tag in tags}
+        if not words and not tags:
+            return {}, True
+
+        candidates = None
+        for tag in sorted(tags, key=lambda t: len(self.tag_postings.get(t, ()))):
+            docs = self.tag_postings.get(tag, set())
+            candidates = set(docs) if candidates is None else candidates & docs
+            if not candidates:
+                return {}, True
+
+        if not words:
+            # tag filters only
+            return dict.fromkeys(candidates, 0.0), True
+
+        scores = None
+        complete = True
+        # longer terms are usually more selective and narrow down the candidates early
+        for word in sorted(words, key=len, reverse=True):
+            word_scores, word_complete = self._match_term(word, candidates)
+            complete = complete and word_complete
+            if not word_scores:
+                return {}, complete
+            if scores is None:
+                scores = word_scores
+            else:
+                if len(word_scores) < len(scores):
+                    scores, word_scores = word_scores, scores
+                scores = {doc_id: score + word_scores[doc_id]
+                          for doc_id, score in scores.items() if doc_id in word_scores}
+                if not scores:
+                    return {}, complete
+            candidates = scores.keys()
+        return scores, complete
+
+    def _match_term(self, word, candidates=None):
+        """
+        Returns the best score per note over the indexed terms matching `word`, and whether
+        all of them were used.
+        """
+        scores = {}
+        if word in self.postings:
+            # the exact match always has the best score
+            scores = dict(self._restrict(self.postings[word], candidates))
+
+        def closest(terms):
+            return sorted(terms, key=lambda t: (len(t), -len(self.postings[t])))
+
+        sorted_terms = self._get_sorted_terms()
+        prefix_terms = []
+        i = bisect_left(sorted_terms, word)
+        while i < len(sorted_terms) and sorted_terms[i].startswith(word):
+            if sorted_terms[i] != word:
+                prefix_terms.append(sorted_terms[i])
+            i += 1
+        matches = [(term, PREFIX_MATCH) for term in closest(prefix_terms)]
+        if len(word) >= MIN_SUBSTRING_LENGTH:
+            substring_terms = [term for term in self._get_substring_terms(word)
+                               if not term.startswith(word)]
+            matches.extend((term, SUBSTRING_MATCH) for term in closest(substring_terms))
+
+        budget = MAX_EXPANSION_POSTINGS
+        complete = True
+        for term, factor in matches:
+            docs = self.postings[term]
+            if min(len(docs), len(candidates) if candidates is not None else len(docs)) > budget:
+                # terms too common for the rest of the budget are skipped, unless nothing
+                # matched so far, so a term matching only common words still finds notes
+                if scores or budget < MAX_EXPANSION_POSTINGS:
+                    complete = False
+                    continue
+            docs = self._restrict(docs, candidates)
+            budget -= len(docs)
+            for doc_id, score in docs.items():
+                score *= factor
+                if score > scores.get(doc_id, 0.0):
+                    scores[doc_id] = score
+        return scores, complete
+
+    @staticmethod
+    def _restrict(docs, candidates):
+        if candidates is None:
+            return docs
+        if len(candidates) < len(docs):
+            return {doc_id: docs[doc_id] for doc_id in candidates if doc_id in docs}
+        return {doc_id: score for doc_id, score in docs.items() if doc_id in candidates}
+
+    def _get_substring_terms(self, word):
+        trigram_terms = self._get_trigram_terms()
+        terms = None
+        for trigram in sorted(_trigrams(word), key=lambda t: len(trigram_terms.get(t, ()))):
+            found = trigram_terms.get(trigram)
+            if not found:
+                return set()
+            terms = set(found) if terms is None else terms & found
+            if not terms:
+                return set()
+        return {term for term in terms if word in term}
+
+    def _get_doc_terms(self):
+        if self._doc_terms is None:
+            self._doc_terms = {doc_id: [] for doc_id in self._doc_tags}
+            for term, docs in self.postings.items():
+                for doc_id in docs:
+                    self._doc_terms[doc_id].append(term)
+        return self._doc_terms
+
+    def _get_sorted_terms(self):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        return self._sorted_terms
+
+    def _get_trigram_terms(self):
+        if self._trigram_terms is None:
+            self._trigram_terms = {}
+            for term in self.postings:
+                for trigram in _trigrams(term):
+                    self._trigram_terms.setdefault(trigram, set()).add(term)
+        return self._trigram_terms
+
+    def _add_term(self, term):
+        if self._sorted_terms is not None:
+            insort(self._sorted_terms, term)
+        if self._trigram_terms is not None:
+            for trigram in _trigrams(term):
+                self._trigram_terms.setdefault(trigram, set()).add(term)
+
+    def _remove_term(self, term):
+        if self._sorted_terms is not None:
+            i = bisect_left(self._sorted_terms, term)
+            if i < len(self._sorted_terms) and self._sorted_terms[i] == term:
+                del self._sorted_terms[i]
+        if self._trigram_terms is not None:
+            for trigram in _trigrams(term):
+                terms = self._trigram_terms.get(trigram)
+                if terms is not None:
+                    terms.discard(term)
+                    if not terms:
+                        del self._trigram_terms[trigram]
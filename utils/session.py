@@ -0,0 +1,113 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+from nicegui import Client, app
+
+# kurup
+from utils.image_handler import TempImageHandler
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+# key of the session in the storage of a NiceGUI client
+SESSION_KEY = "kurup_session"
+
+# request header with the NiceGUI client id of uploads
+CLIENT_ID_HEADER = "X-Kurup-Client"
+
+
+class Session():
+    """
+    State of one browser tab: its pending images, tags and the labels updated outside the page builder.
+
+    The note index, caches and handlers are shared by all sessions, only what differs between
+    people writing notes at the same time is kept here.
+
+    Parameters
+    ----------
+    tag_colors : list of str
+        Colors assigned to tags in order.
+
+    Attributes
+    ----------
+    temp_image_handler : TempImageHandler
+        Images pasted into this tab and not saved yet.
+    init_tags_data : dict
+        Color of every tag of the saved notes when the page was opened.
+    tags_data : dict
+        Color of every tag known to this tab, including new tags not saved yet.
+    current_tags : dict
+        Tags selected for the new note.
+    quote_label, status_label, update_badge : nicegui.ui.element or None
+        Elements updated by event handlers.
+    """
+
+    def __init__(self, tag_colors):
+        self.tag_colors = tag_colors
+        self.temp_image_handler = TempImageHandler()
+        self.init_tags_data = {}
+        self.tags_data = {}
+        self.current_tags = {}
+        self.quote_label = None
+        self.status_label = None
+        self.update_badge = None
+
+    def add_tag(self, tag, tags_data=None):
+        """Assigns the next color to a tag if it has none yet."""
+        tags_data = self.tags_data if tags_data is None else tags_data
+        if tag not in tags_data:
+            tags_data[tag] = self.tag_colors[len(tags_data) % len(self.tag_colors)]
+
+    def init_tags(self, notes):
+        """Assigns colors to the tags of the saved notes."""
+        for tag in {tag for note in notes for tag in note.tags}:
+            self.add_tag(tag, self.init_tags_data)
+        self.tags_data = self.init_tags_data.copy()
+
+
+def create_session(tag_colors):
+    """Creates the session of the current client, must be called in a page builder function."""
+    session = Session(tag_colors)
+    app.storage.client[SESSION_KEY] = session
+    return session
+
+
+def get_session(client_id):
+    """Returns the session of a client by its id, or None if the client is gone."""
+    client = Client.instances.get(client_id) if client_id else None
+    if client is None:
+        return None
+    return client.storage.get(SESSION_KEY)
+
+
+def get_sessions():
+    """Returns the sessions of all connected clients."""
+    # copied first, clients connect and disconnect while this may run in a worker thread
+    clients = list(Client.instances.values())
+    return [client.storage[SESSION_KEY] for client in clients if SESSION_KEY in client.storage]
+
+
+def is_temp_image_in_use(name, exclude=None):
+    """Checks if an image in the temp directory belongs to a note not saved yet, in any session but `exclude`."""
+    return any(
+        name in session.temp_image_handler.temp_images
+        for session in get_sessions()
+        if session is not exclude
+    )
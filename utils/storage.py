@@ -0,0 +1,67 @@
+# kurup - A simple, markdown-based note taking application
+# Copyright (C) 2025 Davis Thomas Daniel
+#
+# This file is part of kurup.
+#
+# kurup is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# kurup is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with kurup. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+
+from nicegui import run
+
+# logging
+logger = logging.getLogger("kurup_logger")
+
+
+class Storage():
+    """
+    Runs blocking file operations in worker threads, so the event loop serving the UI of
+    every connected client is never blocked by disk I/O.
+
+    At most `max_concurrency` operations run at the same time, further calls wait for a
+    free slot instead of piling up in the thread pool.
+
+    Parameters
+    ----------
+    max_concurrency : int, optional
+        Maximum number of operations running at the same time.
+    """
+
+    def __init__(self, max_concurrency=4):
+        self.max_concurrency = max_concurrency
+        # created on first use, inside the running event loop
+        self._semaphore = None
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs a blocking function in a worker thread and waits for its result.
+
+        Parameters
+        ----------
+        func : callable
+            The blocking function.
+        *args, **kwargs
+            Arguments passed to `func`.
+
+        Returns
+        -------
+        object
+            The return value of `func`, exceptions raised by it are raised here.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await run.io_bound(func, *args, **kwargs)
+